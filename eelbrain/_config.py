@@ -18,6 +18,7 @@ CONFIG = {
     'animate': True,
     'nice': 0,
     'tqdm': False,  # disable=CONFIG['tqdm']
+    'profile_permutations': False,
 }
 
 
@@ -32,6 +33,7 @@ def configure(
         animate=None,
         nice=None,
         tqdm=None,
+        profile_permutations=None,
 ):
     """Set basic configuration parameters for the current session
 
@@ -75,6 +77,12 @@ def configure(
         other processes; negative numbers require root privileges).
     tqdm : bool
         Enable or disable :mod:`tqdm` progress bars.
+    profile_permutations : bool
+        Record the time spent in the different stages of permutation tests
+        (generating permutations, computing statistical maps, computing the
+        maximum statistic, inter-process communication and accumulating the
+        distribution). Timings are shown in the ``info_list()`` of
+        :mod:`testnd` results.
     """
     # don't change values before raising an error
     new = {}
@@ -120,5 +128,7 @@ def configure(
         new['nice'] = nice
     if tqdm is not None:
         new['tqdm'] = not tqdm
+    if profile_permutations is not None:
+        new['profile_permutations'] = bool(profile_permutations)
 
     CONFIG.update(new)
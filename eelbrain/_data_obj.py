@@ -70,7 +70,8 @@ from ._utils import (
 from ._utils.numpy_utils import (
     INT_TYPES, FULL_SLICE, FULL_AXIS_SLICE,
     apply_numpy_index, digitize_index, digitize_slice_endpoint,
-    index_length, index_to_int_array, newaxis, take_slice, slice_to_arange)
+    from_sparse_state, index_length, index_to_int_array, index_to_slice,
+    newaxis, sparse_state, take_slice, slice_to_arange)
 from .mne_fixes import MNE_EPOCHS, MNE_EVOKED, MNE_RAW, MNE_LABEL
 from functools import reduce
 
@@ -97,6 +98,7 @@ _tex_wildcard = ("TeX (*.tex)", '*.tex')
 _tsv_wildcard = ("Plain Text Tab Separated Values (*.txt)", '*.txt')
 _txt_wildcard = ("Plain Text (*.txt)", '*.txt')
 EVAL_CONTEXT = vars(np)  # updated at end of file
+AGGREGATE_BLOCK_BYTES = 2 ** 26  # memory for each block of cases in CellIndex.moments()
 
 
 def _effect_eye(n):
@@ -211,7 +213,7 @@ def isbalanced(x):
     if isinstance(x, Model):
         return all(isbalanced(e) for e in x.effects)
     else:
-        return len({np.sum(x == c) for c in x.cells}) <= 1
+        return len(np.unique(x._cell_index.counts)) <= 1
 
 
 def iscategorial(x):
@@ -332,7 +334,8 @@ def is_higher_order_effect(e1, e0):
 
 
 def empty_cells(x):
-    return [cell for cell in x.cells if not np.any(x == cell)]
+    index = x._cell_index
+    return [index.cells[i] for i in np.flatnonzero(index.counts == 0)]
 
 
 def assert_has_no_empty_cells(x):
@@ -1588,11 +1591,7 @@ class Var:
             err = "Length mismatch: %i (Var) != %i (x)" % (len(self), len(x))
             raise ValueError(err)
 
-        x_out = []
-        for cell in x.cells:
-            x_cell = self.x[x == cell]
-            if len(x_cell) > 0:
-                x_out.append(func(x_cell))
+        x_out = [func(self.x[index]) for index in x._cell_index.indexes(True)]
 
         if name is True:
             name = self.name
@@ -1836,7 +1835,229 @@ class Var:
         return np.unique(self.x)
 
 
+class CellIndex:
+    """Index grouping the cases of a categorial by cell
+
+    Computed once per categorial (see ``_Effect._cell_index``) so that
+    operations over all cells can avoid evaluating ``x == cell`` for each cell.
+
+    Parameters
+    ----------
+    codes : array of int
+        For each case, the index of its cell in ``cells``.
+    cells : tuple
+        Cells of the categorial.
+
+    Attributes
+    ----------
+    cells : tuple
+        Cells of the categorial.
+    codes : array of intp
+        For each case, the index of its cell in ``cells``.
+    counts : array of intp
+        Number of cases in each cell.
+    sort_index : array of intp
+        Stable sort of the cases by cell (within each cell, cases retain their
+        original order).
+    starts, stops : array of intp
+        For each cell, the range of its cases in ``sort_index``.
+    """
+    def __init__(self, codes, cells):
+        n_cells = len(cells)
+        self.cells = cells
+        self.codes = np.asarray(codes, np.intp)
+        self.sort_index = np.argsort(self.codes, kind='mergesort')
+        self.counts = np.bincount(self.codes, minlength=n_cells)
+        self.stops = np.cumsum(self.counts)
+        self.starts = self.stops - self.counts
+        self.is_sorted = np.all(self.sort_index == np.arange(len(self.codes)))
+        for a in (self.codes, self.sort_index, self.counts, self.starts, self.stops):
+            a.flags.writeable = False
+
+    def __len__(self):
+        return len(self.codes)
+
+    @LazyProperty
+    def _cell_ids(self):
+        return {cell: i for i, cell in enumerate(self.cells)}
+
+    def cell_id(self, cell):
+        "Position of ``cell`` in ``cells`` (``KeyError`` if it does not exist)"
+        return self._cell_ids[cell]
+
+    @LazyProperty
+    def nonempty(self):
+        "Indices of the cells that contain at least one case"
+        return np.flatnonzero(self.counts)
+
+    def index(self, i):
+        "Indices of the cases in the ``i``-th cell"
+        return self.sort_index[self.starts[i]: self.stops[i]]
+
+    def indexes(self, nonempty=False):
+        "Iterate over the indices of the cases in each cell"
+        ids = self.nonempty if nonempty else range(len(self.cells))
+        return (self.index(i) for i in ids)
+
+    def sort(self, x):
+        "Sort the cases in ``x`` by cell (avoids a copy if already sorted)"
+        if self.is_sorted:
+            return x
+        return x[self.sort_index]
+
+    def reduceat(self, ufunc, x, dtype=None, is_sorted=False):
+        """Reduce cases within each non-empty cell with a ufunc
+
+        Parameters
+        ----------
+        ufunc : numpy.ufunc
+            Ufunc with a ``reduceat`` method (e.g., ``np.add``, ``np.maximum``).
+        x : array
+            Data with cases on the first axis.
+        dtype : dtype
+            Dtype for the reduction.
+        is_sorted : bool
+            ``x`` is already sorted by cell (see :meth:`.sort`).
+
+        Returns
+        -------
+        reduced : array
+            Array with one entry per non-empty cell on the first axis.
+        """
+        if not is_sorted:
+            x = self.sort(x)
+        return ufunc.reduceat(x, self.starts[self.nonempty], 0, dtype)
+
+    def moments(self, x, block_size=None, ss=True):
+        """Count, sum and sum of squared deviations for each cell
+
+        The data are processed in a single pass over blocks of consecutive
+        cases, reducing each block with :meth:`.reduceat`. Moments of each
+        block are merged into the running moments following Chan, Golub &
+        LeVeque (1979), which avoids the loss of precision of the naive sum of
+        squares.
+
+        Parameters
+        ----------
+        x : array
+            Data with cases on the first axis.
+        block_size : int
+            Number of cases to process at once (default based on
+            ``AGGREGATE_BLOCK_BYTES``).
+        ss : bool
+            Compute the sum of squared deviations (if ``False``, ``ss`` is
+            returned as ``None``).
+
+        Returns
+        -------
+        counts : array of intp, (n_cells,)
+            Number of cases in each cell.
+        sums : array, (n_cells, ...)
+            Sum over the cases in each cell.
+        ss : array, (n_cells, ...)
+            Sum of squared deviations from the cell mean.
+        """
+        n_cells = len(self.cells)
+        shape = (n_cells, *x.shape[1:])
+        counts = np.zeros(n_cells, np.intp)
+        sums = np.zeros(shape)
+        ss_out = np.zeros(shape) if ss else None
+        if block_size is None:
+            block_size = max(1, AGGREGATE_BLOCK_BYTES // max(1, x[0].size * 8))
+        expand = (slice(None),) + (newaxis,) * (x.ndim - 1)
+        for start in range(0, len(x), block_size):
+            stop = start + block_size
+            index = CellIndex(self.codes[start:stop], self.cells)
+            block = index.sort(x[start:stop])
+            ids = index.nonempty
+            b_counts = index.counts[ids]
+            b_sums = index.reduceat(np.add, block, np.float64, True)
+            n_a = counts[ids]
+            counts[ids] += b_counts
+            if not ss:
+                sums[ids] += b_sums
+                continue
+            b_means = b_sums / b_counts[expand]
+            deviations = np.repeat(b_means, b_counts, 0)
+            np.subtract(block, deviations, deviations)
+            deviations *= deviations
+            b_ss = index.reduceat(np.add, deviations, None, True)
+            # merge with previous blocks
+            delta = b_means - sums[ids] / np.maximum(n_a, 1)[expand]
+            delta **= 2
+            delta *= (n_a * b_counts / counts[ids])[expand]
+            ss_out[ids] += b_ss + delta
+            sums[ids] += b_sums
+        return counts, sums, ss_out
+
+    def aggregate(self, x, func=np.mean):
+        """Summarize the cases in each non-empty cell
+
+        Parameters
+        ----------
+        x : array
+            Data with cases on the first axis.
+        func : callable
+            Function for summarizing the cases, called as ``func(x_cell,
+            axis=0)``. Functions in ``AGGREGATE_MOMENTS`` are computed from
+            :meth:`.moments` in a single pass; other functions are called
+            for each cell.
+
+        Returns
+        -------
+        aggregated : array
+            Array with one entry per non-empty cell on the first axis.
+        """
+        stat = AGGREGATE_MOMENTS.get(func) if x.dtype.kind in 'biuf' else None
+        if stat is None or (stat == 'sum' and x.dtype.kind != 'f') or len(x) == 0:
+            return np.array([func(x[index], axis=0) for index in self.indexes(True)])
+        counts, sums, ss = self.moments(x, ss=stat in ('var', 'std', 'sem'))
+        index = self.nonempty
+        n = counts[index].reshape((-1,) + (1,) * (x.ndim - 1))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if stat == 'sum':
+                out = sums[index]
+            elif stat == 'mean':
+                out = sums[index] / n
+            elif stat == 'var':
+                out = ss[index] / n
+            elif stat == 'std':
+                out = np.sqrt(ss[index] / n)
+            elif stat == 'sem':
+                out = np.sqrt(ss[index] / (n - 1) / n)
+            else:
+                raise RuntimeError(f"stat={stat!r}")
+        if x.dtype.kind == 'f':
+            out = out.astype(x.dtype, copy=False)
+        return out
+
+
+# Functions that CellIndex.aggregate() computes from CellIndex.moments()
+AGGREGATE_MOMENTS = {
+    np.mean: 'mean',
+    np.std: 'std',
+    np.sum: 'sum',
+    np.var: 'var',
+    scipy.stats.sem: 'sem',
+}
+
+
 class _Effect:
+    # cell index ---
+    @LazyProperty
+    def _cell_index(self):
+        return CellIndex(self._cell_codes(), self.cells)
+
+    def _clear_cell_index(self):
+        self.__dict__.pop('_cell_index', None)
+
+    def _cell_id(self, cell):
+        "Position of ``cell`` in ``.cells``, or ``None`` if it is not a cell"
+        try:
+            return self._cell_index.cell_id(cell)
+        except (KeyError, TypeError):
+            return None
+
     # numeric ---
     def __add__(self, other):
         return Model(self) + other
@@ -1916,11 +2137,9 @@ class _Effect:
         >>> f.enumerate_cells()
         Var([0, 1, 0, 1, 0, 1, 2, 2, 2])
         """
-        counts = {cell: 0 for cell in self.cells}
+        index = self._cell_index
         enum = np.empty(len(self), int)
-        for i, value in enumerate(self):
-            enum[i] = counts[value]
-            counts[value] += 1
+        enum[index.sort_index] = np.arange(len(self)) - np.repeat(index.starts, index.counts)
         return Var(enum, name)
 
     def index(self, cell):
@@ -1937,7 +2156,10 @@ class _Effect:
         >>> f
         Factor(['a', 'new_b', 'c', 'a', 'new_b', 'c', 'a', 'new_b', 'c'])
         """
-        return np.flatnonzero(self == cell)
+        i = self._cell_id(cell)
+        if i is None:
+            return np.flatnonzero(self == cell)
+        return self._cell_index.index(i).copy()
 
     def index_opt(self, cell):
         """Find an optimized index for a given cell.
@@ -1948,7 +2170,7 @@ class _Effect:
             If possible, a ``slice`` object is returned. Otherwise, an array
             of indices (as with ``e.index(cell)``).
         """
-        index = np.flatnonzero(self == cell)
+        index = self.index(cell)
         d_values = np.unique(np.diff(index))
         if len(d_values) == 1:
             start = index.min() or None
@@ -1978,18 +2200,17 @@ class _Effect:
         sort_index : array of int
             Array which can be used to sort a data_object in the desired order.
         """
-        idx = np.empty(len(self), dtype=np.intp)
+        index = self._cell_index
         if order is None:
-            cells = self.cells
-        else:
-            cells = order
-            idx.fill(-1)
-
-        for i, cell in enumerate(cells):
-            idx[self == cell] = i
-
-        sort_idx = np.argsort(idx, kind='mergesort')
-        if order is not None:
+            sort_idx = index.sort_index.copy()
+        else:
+            cell_order = np.full(len(index.cells), -1, np.intp)
+            for i, cell in enumerate(order):
+                i_cell = self._cell_id(cell)
+                if i_cell is not None:
+                    cell_order[i_cell] = i
+            idx = cell_order[index.codes]
+            sort_idx = np.argsort(idx, kind='mergesort')
             excluded = np.count_nonzero(idx == -1)
             if excluded:
                 sort_idx = sort_idx[excluded:]
@@ -2132,6 +2353,14 @@ class Factor(_Effect):
     def _init_secondary(self):
         self._codes = {label: code for code, label in self._labels.items()}
         self._n_cases = len(self.x)
+        self._clear_cell_index()
+
+    def _cell_codes(self):
+        if not self._labels:
+            return np.empty(len(self.x), np.intp)
+        lut = np.empty(max(self._labels) + 1, np.intp)
+        lut[list(self._labels)] = np.arange(len(self._labels))
+        return lut[self.x]
 
     def __setstate__(self, state):
         self.x = state['x']
@@ -2207,6 +2436,7 @@ class Factor(_Effect):
         # obliterate redundant labels
         for code in set(self._labels).difference(self.x):
             del self._codes[self._labels.pop(code)]
+        self._clear_cell_index()
 
     def _get_code(self, label):
         "Add the label if it does not exists and return its code"
@@ -2308,9 +2538,7 @@ class Factor(_Effect):
 
     def _cellsize(self):
         "int if all cell sizes are equal, otherwise a {cell: size} dict"
-        buf = np.empty(self.x.shape, bool)
-        ns = {value: np.equal(self.x, code, buf).sum() for code, value
-              in self._labels.items()}
+        ns = dict(zip(self.cells, self._cell_index.counts.tolist()))
         n_set = set(ns.values())
         if len(n_set) == 1:
             return n_set.pop()
@@ -2318,7 +2546,7 @@ class Factor(_Effect):
             return ns
 
     def _summary(self, width=80):
-        ns = [(label, np.sum(self.x == code)) for code, label in self._labels.items()]
+        ns = zip(self.cells, self._cell_index.counts)
         items = [f'{label}:{n}' if n > 1 else label for label, n in ns]
         if sum(map(len, items)) + 2 * len(items) - 2 <= width:
             return ', '.join(items)
@@ -2354,21 +2582,19 @@ class Factor(_Effect):
                 f"x={dataobj_repr(x)} of length {len(x)} for Factor "
                 f"{dataobj_repr(self)} of length {len(self)}")
 
-        x_out = []
-        for cell in x.cells:
-            idx = (x == cell)
-            if np.sum(idx):
-                x_i = np.unique(self.x[idx])
-                if len(x_i) > 1:
-                    labels = tuple(self._labels[code] for code in x_i)
-                    raise ValueError(
-                        f"Can not determine aggregated value for Factor "
-                        f"{dataobj_repr(self)} in cell {cell!r} because the "
-                        f"cell contains multiple values {labels}. Set "
-                        f"drop_bad=True in order to ignore this inconsistency "
-                        f"and drop the Factor.")
-                else:
-                    x_out.append(x_i[0])
+        index = x._cell_index
+        x_out = index.reduceat(np.minimum, self.x)
+        x_max = index.reduceat(np.maximum, self.x)
+        for i in np.flatnonzero(x_out != x_max):
+            cell = index.cells[index.nonempty[i]]
+            x_i = np.unique(self.x[index.index(index.nonempty[i])])
+            labels = tuple(self._labels[code] for code in x_i)
+            raise ValueError(
+                f"Can not determine aggregated value for Factor "
+                f"{dataobj_repr(self)} in cell {cell!r} because the "
+                f"cell contains multiple values {labels}. Set "
+                f"drop_bad=True in order to ignore this inconsistency "
+                f"and drop the Factor.")
 
         if name is True:
             name = self.name
@@ -2635,6 +2861,7 @@ class Factor(_Effect):
 
         self._labels = new_labels
         self._codes = {l: c for c, l in new_labels.items()}
+        self._clear_cell_index()
 
     def sort_cells(self, order):
         """Reorder the cells of the Factor (in-place)
@@ -2659,6 +2886,7 @@ class Factor(_Effect):
                 raise ValueError("Factor has cennls not in order: %s" % ', '.join(missing))
             raise RuntimeError("Factor.sort_cells comparing %s and %s" % (old, new))
         self._labels = {self._codes[cell]: cell for cell in new_order}
+        self._clear_cell_index()
 
     def startswith(self, substr):
         """An index that is true for all cases whose name starts with ``substr``
@@ -2831,6 +3059,7 @@ class NDVar:
         self.dims = tuple(dims_)
         self.info = dict(info)
         self.name = name
+        self._is_view = False
         self._init_secondary()
 
     def _init_secondary(self):
@@ -2849,6 +3078,8 @@ class NDVar:
                 setattr(self, dim.name, dim)
 
     def __setstate__(self, state):
+        if 'x_sparse' in state:
+            state['x'] = from_sparse_state(state.pop('x_sparse'))
         # backwards compatibility
         if 'properties' in state:
             state['info'] = state.pop('properties')
@@ -2859,13 +3090,20 @@ class NDVar:
         self.dims = state['dims']
         self.name = state['name']
         self.info = state['info']
+        self._is_view = False
         self._init_secondary()
 
     def __getstate__(self):
-        return {'dims': self.dims,
-                'x': self.x,
-                'name': self.name,
-                'info': self.info}
+        state = {'dims': self.dims,
+                 'name': self.name,
+                 'info': self.info}
+        # mostly empty maps (e.g., clusters) are stored sparsely
+        x_sparse = sparse_state(self.x)
+        if x_sparse is None:
+            state['x'] = self.x
+        else:
+            state['x_sparse'] = x_sparse
+        return state
 
     __array_priority__ = 15
 
@@ -2873,6 +3111,16 @@ class NDVar:
     def __array_interface__(self):
         return self.x.__array_interface__
 
+    @property
+    def is_view(self):
+        """Whether the data are a view on the NDVar this NDVar was retrieved from
+
+        ``True`` for NDVars returned by :meth:`.sub` (or indexing) that share
+        memory with the original NDVar, i.e., modifying one in place also
+        modifies the other.
+        """
+        return self._is_view
+
     # numeric ---
     def __neg__(self):
         return NDVar(-self.x, self.dims, self.info, self.name)
@@ -3357,6 +3605,13 @@ class NDVar:
         -------
         aggregated_ndvar : NDVar
             NDVar with data aggregated over cells of ``x``.
+
+        Notes
+        -----
+        :func:`numpy.mean`, :func:`numpy.std`, :func:`numpy.var`,
+        :func:`numpy.sum` and :func:`scipy.stats.sem` are computed for all
+        cells in a single pass over the data, without copying the data in each
+        cell.
         """
         if not self.has_case:
             raise DimensionMismatchError("%r has no case dimension" % self)
@@ -3364,19 +3619,14 @@ class NDVar:
             err = "Length mismatch: %i (Var) != %i (x)" % (len(self), len(x))
             raise ValueError(err)
 
-        x_out = []
-        for cell in x.cells:
-            idx = (x == cell)
-            if np.sum(idx):
-                x_cell = self.x[idx]
-                x_out.append(func(x_cell, axis=0))
+        x_out = x._cell_index.aggregate(self.x, func)
 
         # update info for summary
         info = self.info
         if 'summary_info' in info:
             info = info.copy()
             info.update(info.pop('summary_info'))
-        return NDVar(np.array(x_out), (Case(len(x_out)),) + self.dims[1:], info, name or self.name)
+        return NDVar(x_out, (Case(len(x_out)),) + self.dims[1:], info, name or self.name)
 
     def _aggregate_over_dims(self, axis, regions, func):
         name = regions.pop('name', self.name)
@@ -3404,7 +3654,7 @@ class NDVar:
                                                  "match data dimension" %
                                                  dim.name)
                 dim_axis = self.get_axis(dim.name)
-                index = FULL_AXIS_SLICE * dim_axis + (axis.x,)
+                index = FULL_AXIS_SLICE * dim_axis + (index_to_slice(axis.x),)
                 x = func(self.x[index], dim_axis)
                 dims = tuple(self.dims[i] for i in range(self.ndim) if i != dim_axis)
             else:
@@ -3971,6 +4221,30 @@ class NDVar:
         info = {**self.info, 'cids': cids}
         return NDVar(cmap, self.dims, info, name or self.name)
 
+    def lazy(self, block_size=None):
+        """Chain operations without evaluating intermediate results
+
+        Parameters
+        ----------
+        block_size : int
+            Number of cases to process at once when evaluating (default based
+            on ``AGGREGATE_BLOCK_BYTES``).
+
+        Returns
+        -------
+        lazy_ndvar : LazyNDVar
+            Object recording :meth:`.sub` and reductions like :meth:`.mean`,
+            to be evaluated with :meth:`LazyNDVar.evaluate`.
+
+        Examples
+        --------
+        Mean over a time window, evaluated in blocks of cases without
+        allocating intermediate arrays for all cases::
+
+            >>> y.lazy().sub(time=(0.1, 0.3)).mean('time').evaluate()
+        """
+        return LazyNDVar(self, block_size)
+
     def log(self, base=None, name=None):
         """Element-wise log
 
@@ -4575,7 +4849,17 @@ class NDVar:
         The name of the new NDVar can be set with a ``name`` keyword
         (``x.sub(time=0.1, name="new_name")``). The default is the name of the
         current NDVar.
+
+        As with numpy indexing, slices return a view on the data, whereas other
+        indexes (e.g., lists) return a copy. A :meth:`.lazy` chain of
+        :meth:`.sub` operations also returns views for regularly spaced
+        indexes like ``sensor=[1, 2, 3]`` (see :attr:`.is_view`).
         """
+        return self._sub(args, kwargs)
+
+    def _sub(self, args, kwargs, view=False):
+        "Implement :meth:`.sub`; with ``view``, convert regular indexes to slices"
+        kwargs = dict(kwargs)
         var_name = kwargs.pop('name', self.name)
         dims = list(self.dims)
         n_axes = len(dims)
@@ -4620,15 +4904,17 @@ class NDVar:
 
             # find index
             idx = dim._array_index(idx)
-            index[dimax] = idx
 
             # find corresponding dim
             if np.isscalar(idx):
                 dims[dimax] = None
             elif dimax >= self.has_case:
                 dims[dimax] = dim[idx]
+                if view:
+                    idx = index_to_slice(idx)
             else:
                 dims[dimax] = Case
+            index[dimax] = idx
         if add_axis:
             dims.insert(0, Case)
 
@@ -4652,7 +4938,10 @@ class NDVar:
         if add_axis:
             x = np.expand_dims(x, 0)
         dims = tuple(dim for dim in dims if dim is not None)
-        return self._package_aggregated_output(x, dims, self.info, var_name)
+        out = self._package_aggregated_output(x, dims, self.info, var_name)
+        if isinstance(out, NDVar):
+            out._is_view = np.may_share_memory(x, self.x)
+        return out
 
     def sum(self, dims=(), **regions):
         """Compute the sum over given dimensions
@@ -4747,6 +5036,136 @@ class NDVar:
                      zip(self.dims, self.x.nonzero()))
 
 
+class LazyNDVar:
+    """Chain of NDVar operations that is evaluated in one pass
+
+    Usually created through :meth:`NDVar.lazy`. Methods record operations and
+    return a new :class:`LazyNDVar`; :meth:`.evaluate` applies all
+    operations. If none of the operations involve the case dimension, the
+    operations are applied to one block of cases at a time, so that
+    intermediate results are only allocated for a single block.
+    """
+    def __init__(self, ndvar, block_size=None, operations=()):
+        self.ndvar = ndvar
+        self.block_size = block_size
+        self.operations = tuple(operations)
+
+    def __repr__(self):
+        operations = ''.join(f'.{op}()' for op, _, _ in self.operations)
+        return f"<LazyNDVar {dataobj_repr(self.ndvar)}{operations}>"
+
+    def _add(self, operation, *args, **kwargs):
+        operations = self.operations + ((operation, args, kwargs),)
+        return LazyNDVar(self.ndvar, self.block_size, operations)
+
+    def max(self, dims=(), **regions):
+        "See :meth:`NDVar.max`"
+        return self._add('max', dims, **regions)
+
+    def mean(self, dims=(), **regions):
+        "See :meth:`NDVar.mean`"
+        return self._add('mean', dims, **regions)
+
+    def min(self, dims=(), **regions):
+        "See :meth:`NDVar.min`"
+        return self._add('min', dims, **regions)
+
+    def rms(self, axis=(), **regions):
+        "See :meth:`NDVar.rms`"
+        return self._add('rms', axis, **regions)
+
+    def std(self, dims=(), **regions):
+        "See :meth:`NDVar.std`"
+        return self._add('std', dims, **regions)
+
+    def sub(self, *args, **kwargs):
+        """See :meth:`NDVar.sub`
+
+        Unlike :meth:`NDVar.sub`, regularly spaced indexes like
+        ``sensor=[1, 2, 3]`` are converted to slices, so that the result is a
+        view on the data.
+        """
+        return self._add('sub', *args, **kwargs)
+
+    def sum(self, dims=(), **regions):
+        "See :meth:`NDVar.sum`"
+        return self._add('sum', dims, **regions)
+
+    @property
+    def is_view(self):
+        """Whether :meth:`.evaluate` returns a view on the source NDVar
+
+        Only chains of :meth:`.sub` operations with indexes that can be
+        expressed as slices return views.
+        """
+        if not all(op == 'sub' for op, _, _ in self.operations):
+            return False
+        # apply the indexes to a dummy array that does not allocate memory
+        ndvar = self.ndvar
+        x = np.broadcast_to(np.empty(1, ndvar.x.dtype), ndvar.x.shape)
+        out = self._apply(NDVar(x, ndvar.dims, ndvar.info, ndvar.name))
+        return isinstance(out, NDVar) and np.may_share_memory(out.x, x)
+
+    def _apply(self, ndvar):
+        for op, args, kwargs in self.operations:
+            if op == 'sub' and isinstance(ndvar, NDVar):
+                ndvar = ndvar._sub(args, kwargs, view=True)
+            else:
+                ndvar = getattr(ndvar, op)(*args, **kwargs)
+        return ndvar
+
+    def _is_blockwise(self):
+        "Whether operations can be applied to blocks of cases independently"
+        if not self.ndvar.has_case:
+            return False
+        elif all(op == 'sub' for op, _, _ in self.operations):
+            return False  # retrieve views where possible
+        for op, args, kwargs in self.operations:
+            if 'case' in kwargs:
+                return False
+            elif op == 'sub':
+                arg = args[0] if args else ()
+                if not (isinstance(arg, NDVar) or (isinstance(arg, tuple) and not arg)):
+                    return False
+                continue
+            dims = args[0]
+            if isinstance(dims, NDVar):
+                if dims.has_case:
+                    return False
+            elif not dims and not kwargs.keys() - {'name'}:
+                return False  # reduce over all dimensions
+            elif dims == 'case' or (isinstance(dims, (tuple, list)) and 'case' in dims):
+                return False
+        return True
+
+    def evaluate(self):
+        """Apply the operations
+
+        Returns
+        -------
+        result : NDVar | Var | scalar
+            Result of applying all operations to the NDVar.
+        """
+        ndvar = self.ndvar
+        if not self._is_blockwise() or len(ndvar) == 0:
+            return self._apply(ndvar)
+
+        n_cases = len(ndvar)
+        block_size = self.block_size
+        if block_size is None:
+            block_size = max(1, AGGREGATE_BLOCK_BYTES // max(1, ndvar.x[0].nbytes))
+        outs = []
+        for start in range(0, n_cases, block_size):
+            x = ndvar.x[start: start + block_size]
+            block = NDVar(x, (Case(len(x)), *ndvar.dims[1:]), ndvar.info, ndvar.name)
+            outs.append(self._apply(block))
+        out = outs[0]
+        x = np.concatenate([o.x for o in outs])
+        if isinstance(out, Var):
+            return Var(x, out.name, info=out.info)
+        return NDVar(x, (Case(n_cases), *out.dims[1:]), out.info, out.name)
+
+
 def extrema(x, axis=None):
     "Extract the extreme values in x"
     max = np.max(x, axis)
@@ -4902,8 +5321,8 @@ class Datalist(list):
             raise ValueError(f"x={dataobj_repr(x)}: Length mismatch, len(x)={len(x)}, len(self)={len(self)}")
 
         x_out = []
-        for cell in x.cells:
-            x_cell = self[x == cell]
+        for index in x._cell_index.indexes(True):
+            x_cell = self[index]
             n = len(x_cell)
             if n == 1:
                 x.append(x_cell)
@@ -5644,7 +6063,7 @@ class Dataset(OrderedDict):
         """
         if isinstance(x, str):
             x = self.eval(x)
-        return {cell: self.sub(x == cell, name.format(name=self.name, cell=cell)) for
+        return {cell: self.sub(x.index(cell), name.format(name=self.name, cell=cell)) for
                 cell in x.cells if cell not in exclude}
 
     def aggregate(self, x=None, drop_empty=True, name='{name}', count='n',
@@ -5697,8 +6116,9 @@ class Dataset(OrderedDict):
 
         ds = Dataset(name=name.format(name=self.name), info=self.info)
 
+        index = x._cell_index
         if count:
-            ds[count] = Var(filter(None, (np.sum(x == cell) for cell in x.cells)))
+            ds[count] = Var(index.counts[index.nonempty])
 
         for k, v in self.items():
             if k in drop:
@@ -5707,12 +6127,7 @@ class Dataset(OrderedDict):
                 if hasattr(v, 'aggregate'):
                     ds[k] = v.aggregate(x)
                 elif isinstance(v, MNE_EPOCHS):
-                    evokeds = []
-                    for cell in x.cells:
-                        idx = (x == cell)
-                        if idx.sum():
-                            evokeds.append(v[idx].average())
-                    ds[k] = evokeds
+                    ds[k] = [v[idx].average() for idx in index.indexes(True)]
                 else:
                     raise TypeError(f"{v}: unsupported type for Dataset.aggregate()")
             except:
@@ -5759,9 +6174,8 @@ class Dataset(OrderedDict):
         """
         x = ascategorial(x, ds=self)
         self._check_n_cases(x, empty_ok=False)
-        indexes = np.array([x == cell for cell in x.cells])
-        n_by_cell = indexes.sum(1)
-        n_max = np.setdiff1d(n_by_cell, [0]).min()
+        index = x._cell_index
+        n_max = index.counts[index.nonempty].min()
         if n is None:
             n_ = n_max
         elif n < 0:
@@ -5773,10 +6187,9 @@ class Dataset(OrderedDict):
             raise ValueError("Invalid value n=%i; the maximum numer of cases "
                              "per cell is %i" % (n, n_max))
 
-        for index in indexes:
-            np.logical_and(index, index.cumsum() <= n_, index)
-        index = indexes.any(0)
-        return self[index]
+        keep = np.concatenate([idx[:n_] for idx in index.indexes(True)])
+        keep.sort()
+        return self[keep]
 
     def head(self, n=10):
         "Table with the first n cases in the Dataset"
@@ -6334,6 +6747,14 @@ class Interaction(_Effect):
     def __getstate__(self):
         return {'base': self.base, 'is_categorial': self.is_categorial}
 
+    def _cell_codes(self):
+        if not self._n_cases:
+            return np.empty(0, np.intp)
+        factors = [e for e in self.base if isinstance(e, (Factor, NestedEffect))]
+        indexes = [f._cell_index for f in factors]
+        return np.ravel_multi_index([index.codes for index in indexes],
+                                    [len(index.cells) for index in indexes])
+
     def __repr__(self):
         names = [UNNAMED if f.name is None else f.name for f in self.base]
         if preferences['short_repr']:
@@ -6450,8 +6871,8 @@ class Interaction(_Effect):
             Cells for which the index will be true. Cells described as tuples
             of strings.
         """
-        is_v = [self == cell for cell in cells]
-        return np.any(is_v, 0)
+        ids = [self._cell_id(cell) for cell in cells]
+        return np.in1d(self._cell_index.codes, [i for i in ids if i is not None])
 
     @LazyProperty
     def _value_set(self):
@@ -6526,6 +6947,10 @@ class NestedEffect(_Effect):
             return self.effect[index]
         return NestedEffect(self.effect[index], self.nestedin[index])
 
+    @property
+    def _cell_index(self):
+        return self.effect._cell_index
+
     @property
     def df(self):
         return len(self.effect.cells) - len(self.nestedin.cells)
@@ -9,11 +9,14 @@ e = MneExperiment('.', find_subjects=False)
 
 """
 from collections import defaultdict, Sequence
+from copy import copy
 from datetime import datetime
 from glob import glob
+import hashlib
 import inspect
 from itertools import chain, product
 import logging
+from multiprocessing import Pool
 import os
 from os.path import basename, exists, getmtime, isdir, join, relpath
 import re
@@ -42,9 +45,10 @@ from .._data_obj import (
     align1, all_equal, assert_is_legal_dataset_key, combine)
 from .._exceptions import DefinitionError, DimensionMismatchError, OldVersionError
 from .._info import BAD_CHANNELS
+from .._io.fiff import load_sensor_dim_cache, record_sensor_dim_keys, save_sensor_dim_cache
 from .._io.pickle import update_subjects_dir
 from .._names import INTERPOLATE_CHANNELS
-from .._meeg import new_rejection_ds
+from .._meeg import EpochStatistics, new_rejection_ds
 from .._mne import (
     dissolve_label, labels_from_mni_coords, rename_label, combination_label,
     morph_source_space, shift_mne_epoch_trigger, find_source_subject,
@@ -73,8 +77,8 @@ from .parc import (
     IndividualSeededParc, LabelParc
 )
 from .preprocessing import (
-    assemble_pipeline, RawSource, RawFilter, RawICA,
-    compare_pipelines, ask_to_delete_ica_files)
+    assemble_pipeline, CachedRawPipe, RawSource, RawFilter, RawICA,
+    cache_raw_job, compare_pipelines, ask_to_delete_ica_files)
 from .test_def import (
     Test, EvokedTest,
     ROITestResult, TestDims, TwoStageTest,
@@ -225,9 +229,12 @@ temp = {
     'raw-cache-dir': join('{cache-dir}', 'raw', '{subject}'),
     'raw-cache-base': join('{raw-cache-dir}', '{recording} {raw}'),
     'cached-raw-file': '{raw-cache-base}-raw.fif',
+    'cached-raw-data-file': '{raw-cache-base}-raw.npy',
     'event-file': '{raw-cache-base}-evts.pickled',
     'interp-file': '{raw-cache-base}-interp.pickled',
     'cached-raw-log-file': '{raw-cache-base}-raw.log',
+    # sensor dimensions
+    'sensor-dim-file': join('{cache-dir}', 'sensor-dims.pickled'),
 
     # forward modeling:
     'fwd-file': join('{raw-cache-dir}', '{recording}-{mrisubject}-{src}-fwd.fif'),
@@ -241,6 +248,12 @@ temp = {
     'evoked-file': join('{evoked-dir}', '{subject}', '{sns_kind} {epoch_visit} {model} {evoked_kind}-ave.fif'),
     # test files
     'test-dir': join('{cache-dir}', 'test'),
+    # epoch statistics for automatic rejection
+    'epoch-stats-file': join(
+        '{cache-dir}', 'epoch-stats', '{subject}', '{session} {epoch_visit} {raw}.pickled'),
+    # memory-mapped epochs for the epoch selection GUI
+    'epoch-selection-data-file': join(
+        '{cache-dir}', 'epoch-selection', '{subject}', '{session} {epoch_visit} {raw}.pickled'),
     'test-file': join('{test-dir}', '{analysis} {group}', '{test_desc} {test_dims}.pickled'),
 
     # MRIs
@@ -338,6 +351,8 @@ class MneExperiment(FileTree):
 
     # Raw preprocessing pipeline
     raw = {}
+    # format for cached raw data: 'fif' | 'mmap'
+    raw_cache_format = 'fif'
 
     # add this value to all trigger times
     trigger_shift = 0
@@ -503,6 +518,12 @@ class MneExperiment(FileTree):
         for cls in reversed(inspect.getmro(self.__class__)):
             if hasattr(cls, '_values'):
                 self._templates.update(cls._values)
+        if self.raw_cache_format == 'mmap':
+            self._templates['cached-raw-file'] = '{raw-cache-base}-raw.pickled'
+        elif self.raw_cache_format != 'fif':
+            raise ValueError(
+                f"MneExperiment.raw_cache_format={self.raw_cache_format!r}; "
+                f"needs to be 'fif' or 'mmap'")
 
         FileTree.__init__(self)
         self._log = log = logging.Logger(self.__class__.__name__, logging.DEBUG)
@@ -691,7 +712,8 @@ class MneExperiment(FileTree):
         self._bind_cache('fwd-file', self.make_fwd)
 
         # currently only used for .rm()
-        self._secondary_cache['cached-raw-file'] = ('event-file', 'interp-file', 'cached-raw-log-file')
+        self._secondary_cache['cached-raw-file'] = (
+            'event-file', 'interp-file', 'cached-raw-log-file', 'cached-raw-data-file')
 
         ########################################################################
         # logger
@@ -745,6 +767,8 @@ class MneExperiment(FileTree):
         ########################################################################
         # Cache
         #######
+        self._sensor_dim_cache_keys = None  # keys in the sensor-dim-file
+        self._sensor_dim_keys = set()  # keys of sensor dims used by this experiment
         if not root:
             return
 
@@ -1143,10 +1167,16 @@ class MneExperiment(FileTree):
                         if recording not in params.sessions:
                             continue
                         rm['evoked-file'].add({'subject': subject, 'epoch': epoch})
+                        rm['epoch-stats-file'].add({'subject': subject, 'epoch': epoch})
+                        rm['epoch-selection-data-file'].add({'subject': subject, 'epoch': epoch})
 
                 # variables
                 for var in invalid_cache['variables']:
                     rm['evoked-file'].add({'model': '*%s*' % var})
+                if invalid_cache['variables']:
+                    # cached epoch selection data depend on event variables
+                    rm['epoch-stats-file'].add({})
+                    rm['epoch-selection-data-file'].add({})
 
                 # groups
                 for group in invalid_cache['groups']:
@@ -1158,6 +1188,8 @@ class MneExperiment(FileTree):
                 for raw in invalid_cache['raw']:
                     rm['cached-raw-file'].add({'raw': raw})
                     rm['evoked-file'].add({'raw': raw})
+                    rm['epoch-stats-file'].add({'raw': raw})
+                    rm['epoch-selection-data-file'].add({'raw': raw})
                     analysis = {'analysis': '* %s *' % raw}
                     rm['test-file'].add(analysis)
                     rm['report-file'].add(analysis)
@@ -1167,6 +1199,8 @@ class MneExperiment(FileTree):
                 # epochs
                 for epoch in invalid_cache['epochs']:
                     rm['evoked-file'].add({'epoch': epoch})
+                    rm['epoch-stats-file'].add({'epoch': epoch})
+                    rm['epoch-selection-data-file'].add({'epoch': epoch})
                     for cov, cov_params in self._covs.items():
                         if cov_params.get('epoch') != epoch:
                             continue
@@ -1332,6 +1366,18 @@ class MneExperiment(FileTree):
                      'events': events}
         save.pickle(new_state, cache_state_path)
 
+        # Sensor dimensions
+        sensor_dim_path = self.get('sensor-dim-file')
+        self._sensor_dim_cache_keys = set()
+        if exists(sensor_dim_path):
+            try:
+                self._sensor_dim_cache_keys = load_sensor_dim_cache(sensor_dim_path)
+            except Exception as error:
+                log.warning("Deleting defective sensor dimension cache %s (%s)",
+                            sensor_dim_path, error)
+                os.remove(sensor_dim_path)
+        self._sensor_dim_keys.update(self._sensor_dim_cache_keys)
+
     def _subclass_init(self):
         "Allow subclass to register experimental features"
 
@@ -2188,11 +2234,15 @@ class MneExperiment(FileTree):
                 sysname = pipe.get_sysname(info, ds.info['subject'], data_kind)
                 connectivity = pipe.get_connectivity(data_kind)
                 name = 'meg' if data_kind == 'mag' else data_kind
-                ds[name] = load.fiff.epochs_ndvar(ds['epochs'], data=data_kind, sysname=sysname, connectivity=connectivity, exclude=exclude)
+                with record_sensor_dim_keys(self._sensor_dim_keys):
+                    ds[name] = load.fiff.epochs_ndvar(
+                        ds['epochs'], data=data_kind, sysname=sysname,
+                        connectivity=connectivity, exclude=exclude)
                 if add_bads_to_info:
                     ds[name].info[BAD_CHANNELS] = ds['epochs'].info['bads']
                 if isinstance(data.sensor, str):
                     ds[name] = getattr(ds[name], data.sensor)('sensor')
+            self._save_sensor_dim_cache()
 
             if ndvar != 'both':
                 del ds['epochs']
@@ -2526,9 +2576,13 @@ class MneExperiment(FileTree):
                 sysname = pipe.get_sysname(info, subject, data_kind)
                 connectivity = pipe.get_connectivity(data_kind)
                 name = 'meg' if data_kind == 'mag' else data_kind
-                ds[name] = load.fiff.evoked_ndvar(ds['evoked'], data=data_kind, sysname=sysname, connectivity=connectivity)
+                with record_sensor_dim_keys(self._sensor_dim_keys):
+                    ds[name] = load.fiff.evoked_ndvar(
+                        ds['evoked'], data=data_kind, sysname=sysname,
+                        connectivity=connectivity)
                 if data_kind != 'eog' and isinstance(data.sensor, str):
                     ds[name] = getattr(ds[name], data.sensor)('sensor')
+            self._save_sensor_dim_cache()
             # if ndvar != 'both':
             #     del ds['evoked']
 
@@ -2992,10 +3046,23 @@ class MneExperiment(FileTree):
             data_kind = data.data_to_ndvar(raw.info)[0]
             sysname = pipe.get_sysname(raw.info, self.get('subject'), data_kind)
             connectivity = pipe.get_connectivity(data_kind)
-            raw = load.fiff.raw_ndvar(raw, sysname=sysname, connectivity=connectivity)
+            with record_sensor_dim_keys(self._sensor_dim_keys):
+                raw = load.fiff.raw_ndvar(raw, sysname=sysname, connectivity=connectivity)
+            self._save_sensor_dim_cache()
 
         return raw
 
+    def _save_sensor_dim_cache(self):
+        "Save sensor dimensions that were added to the cache since it was loaded"
+        if self._sensor_dim_cache_keys is None:
+            return
+        elif self._sensor_dim_cache_keys.issuperset(self._sensor_dim_keys):
+            return
+        path = self.get('sensor-dim-file', mkdir=True)
+        self._sensor_dim_cache_keys = save_sensor_dim_cache(path, self._sensor_dim_keys)
+        # entries that were dropped from the in-memory cache are not saved
+        self._sensor_dim_keys.intersection_update(self._sensor_dim_cache_keys)
+
     def _load_result_plotter(self, test, tstart, tstop, pmin, parc=None,
                              mask=None, samples=10000, data='source',
                              baseline=True, src_baseline=None,
@@ -3453,7 +3520,7 @@ class MneExperiment(FileTree):
                 res = self._make_test(data.y_name, res_data, test_obj, test_kwargs)
 
         if do_test:
-            save.pickle(res, dst)
+            save.pickle(res, dst, separate_arrays=True)
 
         if return_data:
             return res_data, res
@@ -4431,7 +4498,77 @@ class MneExperiment(FileTree):
         pipe = self._raw[self.get('raw')]
         pipe.cache(self.get('subject'), self.get('recording'))
 
-    def make_epoch_selection(self, decim=None, auto=None, overwrite=None, **state):
+    def make_raw_cache(self, raw=None, group='all', n_workers=None, **state):
+        """Update the cache of a raw pipe for all recordings
+
+        Parameters
+        ----------
+        raw : str
+            Raw pipe to cache (default is the current ``raw`` state).
+        group : str
+            Group of subjects to process (default ``'all'``).
+        n_workers : int
+            Number of recordings to process in parallel (default is
+            ``configure(n_workers)``). If only a single recording is processed
+            at a time, channels are filtered with ``n_workers`` parallel jobs
+            instead.
+        ...
+            State parameters.
+
+        Returns
+        -------
+        info : Dataset | None
+            For each recording that was processed: the number of samples, the
+            processing time, and the throughput in samples per second (``None``
+            if all caches were up to date).
+        """
+        if raw is not None:
+            state['raw'] = raw
+        if state:
+            self.set(**state)
+        pipe = self._raw[self.get('raw')]
+        if not isinstance(pipe, CachedRawPipe):
+            raise ValueError(f"raw={pipe.name!r}: not a cached raw pipe")
+        jobs = [(pipe, subject, recording) for subject, recording in
+                self.iter(('subject', 'recording'), group=group)
+                if not pipe.cache_is_current(subject, recording)]
+        if not jobs:
+            self._log.info("Raw %s: cache is up to date", pipe.name)
+            return
+        if n_workers is None:
+            n_workers = CONFIG['n_workers']
+        n_jobs = n_workers or 1
+        n_workers = min(n_workers, len(jobs))
+
+        t0 = time.time()
+        desc = f"Caching raw {pipe.name}"
+        if n_workers > 1:
+            worker_pipe = pipe._for_worker()
+            jobs = [(worker_pipe, subject, recording) for _, subject, recording in jobs]
+            with Pool(n_workers) as pool:
+                results = pool.imap_unordered(cache_raw_job, jobs)
+                results = list(tqdm(results, desc, len(jobs), disable=CONFIG['tqdm']))
+        else:
+            parallel_pipe = copy(pipe)
+            parallel_pipe.n_jobs = n_jobs
+            jobs = [(parallel_pipe, subject, recording) for _, subject, recording in jobs]
+            results = [cache_raw_job(job) for job in tqdm(jobs, desc, disable=CONFIG['tqdm'])]
+        duration = time.time() - t0
+
+        subjects, recordings, n_samples, durations = zip(*sorted(results))
+        ds = Dataset((
+            Factor(subjects, 'subject', random=True),
+            Factor(recordings, 'recording'),
+            Var(n_samples, 'samples'),
+            Var(durations, 'time'),
+        ), info={'raw': pipe.name, 'time': duration})
+        ds['samples_per_s'] = ds['samples'] / ds['time']
+        total = ds['samples'].sum()
+        self._log.info("Raw %s: cached %i recordings in %.1f s (%.0f samples/s)",
+                       pipe.name, ds.n_cases, duration, total / duration)
+        return ds
+
+    def make_epoch_selection(self, decim=None, auto=None, overwrite=None, mmap=False, **state):
         """Open :func:`gui.select_epochs` for manual epoch selection
 
         The GUI is opened with the correct file name; if the corresponding
@@ -4456,6 +4593,11 @@ class MneExperiment(FileTree):
             overwrite the old file. The default is to raise an error if the
             file exists (``None``). Set to ``False`` to quietly keep the exising
             file.
+        mmap : bool
+            Store the epochs in the cache directory and memory-map them, so
+            that the GUI only reads the epochs it displays (default ``False``).
+            The cache takes up as much disk space as the (decimated) epochs,
+            and creating it requires loading all epochs into memory once.
         ...
             State parameters.
         """
@@ -4483,33 +4625,11 @@ class MneExperiment(FileTree):
             else:
                 raise TypeError(f"overwrite={overwrite!r}")
 
-        ds = self.load_epochs(reject=False, trigger_shift=False, decim=decim)
-        has_meg = 'meg' in ds
-        has_grad = 'grad' in ds
-        has_eeg = 'eeg' in ds
-        has_eog = 'eog' in ds
-        if sum((has_meg, has_grad, has_eeg)) > 1:
-            raise NotImplementedError("Rejection GUI for multiple channel types")
-        elif has_meg:
-            y_name = 'meg'
-            vlim = 2e-12
-        elif has_grad:
-            raise NotImplementedError("Rejection GUI for gradiometer data")
-        elif has_eeg:
-            y_name = 'eeg'
-            vlim = 1.5e-4
-        else:
-            raise RuntimeError("No data found")
-
-        if has_eog:
-            eog_sns = []  # TODO:  use EOG
-        else:
-            eog_sns = self._eog_sns.get(ds[y_name].sensor.sysname)
-
         if auto is not None:
             # create rejection
+            ds = self._load_epoch_statistics(decim)
             rej_ds = new_rejection_ds(ds)
-            rej_ds[:, 'accept'] = ds[y_name].abs().max(('sensor', 'time')) <= auto
+            rej_ds[:, 'accept'] = ds.info['statistics'].epoch_max('abs') <= auto
             # create description for info
             args = [f"auto={auto!r}"]
             if overwrite is True:
@@ -4524,12 +4644,133 @@ class MneExperiment(FileTree):
             print(self.format(f"{n_rej} of {rej_ds.n_cases} epochs rejected with threshold {auto} for {{subject}}, epoch {{epoch}}"))
             return
 
+        if mmap:
+            ds = self._load_epoch_selection_epochs(decim)
+        else:
+            ds = self.load_epochs(reject=False, trigger_shift=False, decim=decim)
+        y_name, vlim = self._epoch_selection_data(ds)
+        if 'eog' in ds:
+            eog_sns = []  # TODO:  use EOG
+        else:
+            eog_sns = self._eog_sns.get(ds[y_name].sensor.sysname)
+
         # don't mark eog sns if it is bad
         bad_channels = self.load_bad_channels()
         eog_sns = [c for c in eog_sns if c not in bad_channels]
 
         gui.select_epochs(ds, y_name, path=path, vlim=vlim, mark=eog_sns)
 
+    @staticmethod
+    def _epoch_selection_data(ds):
+        "Name of the data for epoch selection, and default display limit"
+        has_meg = 'meg' in ds
+        has_grad = 'grad' in ds
+        has_eeg = 'eeg' in ds
+        if sum((has_meg, has_grad, has_eeg)) > 1:
+            raise NotImplementedError("Rejection GUI for multiple channel types")
+        elif has_meg:
+            return 'meg', 2e-12
+        elif has_grad:
+            raise NotImplementedError("Rejection GUI for gradiometer data")
+        elif has_eeg:
+            return 'eeg', 1.5e-4
+        else:
+            raise RuntimeError("No data found")
+
+    def _epoch_selection_key(self, decim):
+        "Definitions and events that cached epoch selection data depend on"
+        epoch = self._epochs[self.get('epoch')]
+        return {
+            'raw': {k: v.as_dict() for k, v in self._raw.items()},
+            'epoch': epoch.as_dict(),
+            'decim': decim,
+            'events': self._events_hash(self.load_selected_events(reject=False)),
+        }
+
+    @staticmethod
+    def _events_hash(ds):
+        "Hash of the trigger times and variables in an events Dataset"
+        digest = hashlib.sha1()
+        for key, item in ds.items():
+            if isinstance(item, Var):
+                data = np.ascontiguousarray(item.x).tobytes()
+            elif isinstance(item, Factor):
+                data = '\0'.join(item).encode()
+            else:
+                continue
+            digest.update(key.encode())
+            digest.update(data)
+        return digest.hexdigest()
+
+    def _load_epoch_selection_epochs(self, decim=None):
+        """Epochs for the epoch selection GUI
+
+        Epochs are stored in the cache directory and memory-mapped, so that the
+        GUI only reads the epochs it displays. The cache is reused as long as
+        the raw data, the epoch definition and the events are unchanged.
+        """
+        epoch = self._epochs[self.get('epoch')]
+        key = self._epoch_selection_key(decim)
+        path = self.get('epoch-selection-data-file', mkdir=True, session=epoch.session)
+        raw_mtime = self._raw_mtime()
+        if raw_mtime and exists(path) and getmtime(path) > raw_mtime:
+            try:
+                ds = load.unpickle(path, mmap=True)
+            except Exception as error:
+                self._log.warning("Ignoring defective epoch selection cache %s (%s)", path, error)
+            else:
+                if ds.info.get('epoch_selection_key') == key:
+                    return ds
+        ds = self.load_epochs(reject=False, trigger_shift=False, decim=decim)
+        ds.info['epoch_selection_key'] = key
+        # replace the file instead of overwriting it, because an earlier
+        # version might still be memory-mapped
+        tmp_path = f'{path}.tmp'
+        save.pickle(ds, tmp_path, separate_arrays=True)
+        try:
+            os.replace(tmp_path, path)
+        except OSError:
+            # on Windows, a file that is memory-mapped can not be replaced
+            self._log.warning(
+                "Epoch selection cache %s is in use, loading epochs into memory", path)
+            os.remove(tmp_path)
+            return ds
+        return load.unpickle(path, mmap=True)
+
+    def _load_epoch_statistics(self, decim=None):
+        """Triggers and artifact statistics for epoch selection
+
+        Statistics are cached and reused as long as the raw data and the epoch
+        definition are unchanged.
+
+        Returns
+        -------
+        ds : Dataset
+            Dataset with trigger values, and the :class:`EpochStatistics` in
+            ``ds.info['statistics']``.
+        """
+        epoch = self._epochs[self.get('epoch')]
+        key = self._epoch_selection_key(decim)
+        path = self.get('epoch-stats-file', mkdir=True, session=epoch.session)
+        raw_mtime = self._raw_mtime()
+        if raw_mtime and exists(path) and getmtime(path) > raw_mtime:
+            try:
+                ds = load.unpickle(path)
+            except Exception as error:
+                self._log.warning("Ignoring defective epoch statistics cache %s (%s)", path, error)
+            else:
+                if ds.info.get('key') == key:
+                    return ds
+
+        ds = self.load_epochs(reject=False, trigger_shift=False, decim=decim)
+        y_name, _ = self._epoch_selection_data(ds)
+        statistics = EpochStatistics(ds[y_name], corr=False)
+        out = Dataset((ds['trigger'],), info={'key': key, 'statistics': statistics})
+        tmp_path = f'{path}.tmp'
+        save.pickle(out, tmp_path)
+        os.replace(tmp_path, path)
+        return out
+
     @deprecated('0.30', make_epoch_selection)
     def make_rej(self, decim=None, auto=None, overwrite=False, **state):
         pass
@@ -1,10 +1,13 @@
 # Author: Christian Brodbeck <christianbrodbeck@nyu.edu>
 """Pre-processing operations based on NDVars"""
 from collections import Sequence
-from copy import deepcopy
+from copy import copy, deepcopy
 import fnmatch
+import logging
+from multiprocessing.pool import ThreadPool
 from os import makedirs, remove
 from os.path import basename, dirname, exists, getmtime, join, splitext
+import time
 
 import mne
 from scipy import signal
@@ -12,7 +15,7 @@ from scipy import signal
 from .. import load
 from .._data_obj import NDVar
 from .._exceptions import DefinitionError
-from .._io.fiff import KIT_NEIGHBORS
+from .._io.fiff import KIT_NEIGHBORS, raw_mmap_data_path, read_raw_mmap, write_raw_mmap
 from .._ndvar import filter_data
 from .._text import enumeration
 from .._utils import ask, user_activity
@@ -21,6 +24,10 @@ from .definitions import compound, typed_arg
 from .exceptions import FileMissing
 
 
+# number of channels filtered together by RawFilterElliptic
+FILTER_BLOCK_SIZE = 16
+
+
 def _visit(recording: str) -> str:
     # visit field from recording compound
     if ' ' in recording:
@@ -49,6 +56,16 @@ class RawPipe:
     def as_dict(self):
         return {'type': self.__class__.__name__, 'name': self.name}
 
+    def _for_worker(self):
+        "Copy of the pipe and its inputs that can be pickled for a worker process"
+        out = copy(self)
+        # the experiment's logger can not be pickled
+        out.log = logging.getLogger(self.log.name)
+        for key, value in self.__dict__.items():
+            if isinstance(value, RawPipe):
+                setattr(out, key, value._for_worker())
+        return out
+
     def cache(self, subject, recording):
         "Make sure the file exists and is up to date"
         raise NotImplementedError
@@ -265,6 +282,8 @@ class RawSource(RawPipe):
 class CachedRawPipe(RawPipe):
 
     _bad_chs_affect_cache = False
+    # number of parallel jobs for processing a single recording
+    n_jobs = 1
 
     def __init__(self, source, cache=True):
         RawPipe.__init__(self)
@@ -289,30 +308,50 @@ class CachedRawPipe(RawPipe):
 
     def cache(self, subject, recording):
         "Make sure the cache is up to date"
+        if self.cache_is_current(subject, recording):
+            return
         path = self.path.format(root=self.root, subject=subject, recording=recording)
-        if exists(path):
-            mtime = self.mtime(subject, recording, self._bad_chs_affect_cache)
-            if mtime and getmtime(path) >= mtime:
-                return
         from .. import __version__
         # make sure the target directory exists
         makedirs(dirname(path), exist_ok=True)
         # generate new raw
-        with CaptureLog(path[:-3] + 'log') as logger:
+        with CaptureLog(splitext(path)[0] + '.log') as logger:
             logger.info(f"eelbrain {__version__}")
             logger.info(f"mne {mne.__version__}")
             logger.info(repr(self.as_dict()))
             raw = self._make(subject, recording)
         # save
+        if self._cache_is_fiff:
+            paths = (path,)
+        else:
+            paths = (path, raw_mmap_data_path(path))
         try:
-            raw.save(path, overwrite=True)
+            if self._cache_is_fiff:
+                raw.save(path, overwrite=True)
+            else:
+                write_raw_mmap(raw, path)
         except:
-            # clean up potentially corrupted file
-            if exists(path):
-                remove(path)
+            # clean up potentially corrupted files
+            for path in paths:
+                if exists(path):
+                    remove(path)
             raise
         return raw
 
+    def cache_is_current(self, subject, recording):
+        "Whether the cache exists and is newer than all its inputs"
+        path = self.path.format(root=self.root, subject=subject, recording=recording)
+        if not exists(path):
+            return False
+        mtime = self.mtime(subject, recording, self._bad_chs_affect_cache)
+        return bool(mtime) and getmtime(path) >= mtime
+
+    @property
+    def _cache_is_fiff(self):
+        # cache format is determined by the cache-file template:  *.fif for
+        # FIFF files, otherwise memory-mapped arrays (see write_raw_mmap)
+        return self.path.endswith('.fif')
+
     def get_connectivity(self, data):
         return self.source.get_connectivity(data)
 
@@ -330,6 +369,12 @@ class CachedRawPipe(RawPipe):
             raw = None  # only propagate fiff raw for appending
         return RawPipe.load(self, subject, recording, add_bads, preload, raw)
 
+    def _load(self, subject, recording, preload):
+        if self._cache_is_fiff:
+            return RawPipe._load(self, subject, recording, preload)
+        path = self.path.format(root=self.root, subject=subject, recording=recording)
+        return read_raw_mmap(path, preload)
+
     def load_bad_channels(self, subject, recording):
         return self.source.load_bad_channels(subject, recording)
 
@@ -379,7 +424,10 @@ class RawFilter(CachedRawPipe):
     def _make(self, subject, recording):
         raw = self.source.load(subject, recording, preload=True)
         self.log.info("Raw %s: filtering for %s/%s...", self.name, subject, recording)
-        raw.filter(*self.args, **self._use_kwargs)
+        kwargs = self._use_kwargs
+        if self.n_jobs > 1 and 'n_jobs' not in kwargs:
+            kwargs = {**kwargs, 'n_jobs': self.n_jobs}
+        raw.filter(*self.args, **kwargs)
         return raw
 
 
@@ -434,8 +482,17 @@ class RawFilterElliptic(CachedRawPipe):
         # filter data
         picks = mne.pick_types(raw.info, eeg=True, ref_meg=True)
         sos = self._sos(raw.info['sfreq'])
-        for i in picks:
-            raw._data[i] = signal.sosfilt(sos, raw._data[i])
+        blocks = [picks[i: i + FILTER_BLOCK_SIZE] for i in range(0, len(picks), FILTER_BLOCK_SIZE)]
+
+        def filter_block(block):
+            raw._data[block] = signal.sosfilt(sos, raw._data[block], 1)
+
+        if self.n_jobs > 1 and len(blocks) > 1:
+            with ThreadPool(min(self.n_jobs, len(blocks))) as pool:
+                pool.map(filter_block, blocks)
+        else:
+            for block in blocks:
+                filter_block(block)
         # update info
         low, high = self.args[1], self.args[2]
         if high and raw.info['lowpass'] > high:
@@ -701,6 +758,30 @@ class RawReReference(CachedRawPipe):
         return raw
 
 
+def cache_raw_job(job):
+    """Update the cache of a raw pipe for one recording
+
+    Parameters
+    ----------
+    job : (CachedRawPipe, str, str)
+        Pipe, subject and recording.
+
+    Returns
+    -------
+    subject, recording : str
+        The recording.
+    n_samples : int
+        Number of samples in the recording (0 if the cache was up to date).
+    duration : float
+        Processing time in seconds.
+    """
+    pipe, subject, recording = job
+    t0 = time.time()
+    raw = pipe.cache(subject, recording)
+    n_samples = 0 if raw is None else raw.n_times
+    return subject, recording, n_samples, time.time() - t0
+
+
 def assemble_pipeline(raw_dict, raw_dir, cache_path, root, sessions, log):
     "Assemble preprocessing pipeline form a definition in a dict"
     # convert to Raw objects
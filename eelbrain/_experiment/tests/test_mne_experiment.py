@@ -192,6 +192,13 @@ def test_test_experiment(root_dir):
     del EventExperiment.tests['aov']
     e = EventExperiment(root_dir)
 
+    # defective sensor dimension cache
+    path = e.get('sensor-dim-file', mkdir=True)
+    with open(path, 'wb') as fid:
+        fid.write(b'\x80\x04\x95')
+    e = EventExperiment(root_dir)
+    assert not os.path.exists(path)
+
 
 class FileExperiment(MneExperiment):
 
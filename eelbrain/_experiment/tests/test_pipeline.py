@@ -1,3 +1,5 @@
+import pickle
+
 from eelbrain.pipeline import *
 from eelbrain.testing import path
 
@@ -20,3 +22,28 @@ def test_experiment():
     assert e._glob_pattern('fwd-file', True) == path('/eelbrain-cache/raw/*/*-*-*-fwd.fif')
     assert e._glob_pattern('fwd-file', True, session='pets') == path('/eelbrain-cache/raw/*/pets-*-*-fwd.fif')
     assert e._glob_pattern('fwd-file', True, epoch='hard-cheese') == path('/eelbrain-cache/raw/*/cheese-*-*-fwd.fif')
+    # epoch selection caches are removed with their epoch
+    pattern = e._glob_pattern('epoch-stats-file', True, epoch='hard-cheese')
+    assert pattern == path('/eelbrain-cache/epoch-stats/*/cheese hard-cheese raw.pickled')
+    pattern = e._glob_pattern('epoch-selection-data-file', True, epoch='hard-cheese')
+    assert pattern == path('/eelbrain-cache/epoch-selection/*/cheese hard-cheese raw.pickled')
+
+
+def test_raw_cache_format():
+    class MmapExperiment(Experiment):
+        raw_cache_format = 'mmap'
+
+    e = MmapExperiment()
+    pattern = e._glob_pattern('cached-raw-file', True)
+    assert pattern == path('/eelbrain-cache/raw/*/* raw-raw.pickled')
+
+
+def test_pipe_for_worker():
+    class FilterExperiment(Experiment):
+        raw = {'1-40': RawFilter('raw', 1, 40)}
+
+    e = FilterExperiment()
+    pipe = e._raw['1-40']._for_worker()
+    pipe = pickle.loads(pickle.dumps(pipe))
+    assert pipe.source.name == 'raw'
+    assert pipe.log.name == e._raw['1-40'].log.name
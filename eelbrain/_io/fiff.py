@@ -2,16 +2,20 @@
 # Author: Christian Brodbeck <christianbrodbeck@nyu.edu>
 """I/O for MNE"""
 from collections import Iterable
+from contextlib import contextmanager
 import fnmatch
+import hashlib
 from itertools import zip_longest
 from logging import getLogger
 import os
 from pathlib import Path
+import pickle
 
 import numpy as np
 
 import mne
 from mne.source_estimate import _BaseSourceEstimate
+from mne.io import BaseRaw
 from mne.io.constants import FIFF
 from mne.io.kit.constants import KIT
 from mne.minimum_norm import prepare_inverse_operator, apply_inverse_raw
@@ -35,6 +39,20 @@ KIT_NEIGHBORS = {
     KIT.SYSTEM_UMD_2014_07: 'KIT-UMD-2',
     KIT.SYSTEM_UMD_2014_12: 'KIT-UMD-3',
 }
+# number of samples read at a time when extracting events from a raw file
+STIM_CHUNK_SIZE = 2 ** 20
+# stim channel steps of recently read raw files, keyed on file path, mtime and
+# size
+STIM_STEPS_CACHE = {}
+STIM_STEPS_CACHE_SIZE = 64
+# number of samples read at a time by raw_ndvar
+RAW_BLOCK_SIZE = 2 ** 16
+# Sensor dimensions created by sensor_dim(), keyed on channel names, locations,
+# sysname and connectivity
+SENSOR_DIM_CACHE = {}
+SENSOR_DIM_CACHE_SIZE = 64
+# sets collecting the keys of sensor dimensions (see record_sensor_dim_keys())
+SENSOR_DIM_KEY_RECORDS = []
 
 
 def _get_raw_filename(raw):
@@ -116,6 +134,89 @@ def mne_raw(path=None, proj=False, **kwargs):
     return raw
 
 
+class RawMmap(BaseRaw):
+    """Raw data stored as memory-mapped array (see :func:`write_raw_mmap`)
+
+    Parameters
+    ----------
+    path : str
+        Path of the metadata file written by :func:`write_raw_mmap`.
+    preload : bool
+        Load all data into memory.
+    """
+    def __init__(self, path, preload=False):
+        with open(path, 'rb') as fid:
+            meta = pickle.load(fid)
+        data_path = raw_mmap_data_path(path)
+        n_channels, n_times = np.load(data_path, mmap_mode='r').shape
+        first_samp = meta['first_samp']
+        last_samp = first_samp + n_times - 1
+        BaseRaw.__init__(self, meta['info'], False, (first_samp,), (last_samp,),
+                         (path,), (data_path,), 'single')
+        self.set_annotations(meta['annotations'])
+        if preload:
+            self.load_data()
+
+    def _read_segment_file(self, data, idx, fi, start, stop, cals, mult):
+        # start and stop include first_samp
+        offset = self._first_samps[fi]
+        x = np.load(self._raw_extras[fi], mmap_mode='r')[:, start - offset:stop - offset]
+        if mult is None:
+            data[:] = x[idx]
+            data *= cals
+        else:
+            data[:] = np.dot(mult, x)
+
+
+def raw_mmap_data_path(path):
+    "Path of the data file corresponding to a :class:`RawMmap` metadata file"
+    return os.path.splitext(path)[0] + '.npy'
+
+
+def read_raw_mmap(path, preload=False):
+    """Read raw data saved with :func:`write_raw_mmap`
+
+    Parameters
+    ----------
+    path : str
+        Path of the metadata file.
+    preload : bool
+        Load all data into memory (default ``False``: data are read from the
+        memory-mapped file as needed).
+    """
+    return RawMmap(path, preload)
+
+
+def write_raw_mmap(raw, path):
+    """Save raw data as memory-mappable single precision array
+
+    Parameters
+    ----------
+    raw : mne.io.Raw
+        Raw data to save.
+    path : str
+        Path for the metadata file (measurement info, annotations and first
+        sample); data are saved to the same path with ``.npy`` extension.
+
+    Notes
+    -----
+    Like FIFF files, the data are stored in single precision, scaled by the
+    channel calibration factors. The data file is written first, so the
+    modification time of the metadata file reflects a complete cache.
+    """
+    cals = np.array([ch['cal'] * ch['range'] for ch in raw.info['chs']])[:, np.newaxis]
+    shape = (raw.info['nchan'], raw.n_times)
+    x = np.lib.format.open_memmap(raw_mmap_data_path(path), 'w+', np.float32, shape)
+    for start in range(0, raw.n_times, RAW_BLOCK_SIZE):
+        stop = start + RAW_BLOCK_SIZE
+        x[:, start:stop] = raw[:, start:stop][0] / cals
+    x.flush()
+    del x
+    meta = {'info': raw.info, 'first_samp': raw.first_samp, 'annotations': raw.annotations}
+    with open(path, 'wb') as fid:
+        pickle.dump(meta, fid, pickle.HIGHEST_PROTOCOL)
+
+
 def events(raw=None, merge=None, proj=False, name=None, bads=None,
            stim_channel=None, events=None, **kwargs):
     """
@@ -181,13 +282,13 @@ def events(raw=None, merge=None, proj=False, name=None, bads=None,
             name = None
 
     if events is None:
-        raw.load_data()
+        steps = stim_steps(raw, stim_channel)
         if merge is None:
-            evts = mne.find_stim_steps(raw, merge=-1, stim_channel=stim_channel)
+            evts = merge_stim_steps(steps, -1)
             if len(evts) == 0:
-                evts = mne.find_stim_steps(raw, merge=0, stim_channel=stim_channel)
+                evts = steps
         else:
-            evts = mne.find_stim_steps(raw, merge=merge, stim_channel=stim_channel)
+            evts = merge_stim_steps(steps, merge)
         evts = evts[np.flatnonzero(evts[:, 2])]
     else:
         evts = mne.read_events(events)
@@ -198,6 +299,98 @@ def events(raw=None, merge=None, proj=False, name=None, bads=None,
     return Dataset((trigger, i_start), name, info=info)
 
 
+def stim_steps(raw, stim_channel=None):
+    """Find all steps in the stim channel(s) of a raw file
+
+    Equivalent to :func:`mne.find_stim_steps` with ``merge=0``, but only the
+    stim channel(s) are read from disk, in chunks of :data:`STIM_CHUNK_SIZE`
+    samples. For raw files that are not preloaded, the result is cached by
+    file path, modification time and size.
+
+    Returns
+    -------
+    steps : array  (n_steps, 3)
+        For each step the values ``[sample, v_from, v_to]``.
+    """
+    from mne.event import _get_stim_channel
+
+    stim_channel = _get_stim_channel(stim_channel, raw.info)
+    picks = mne.pick_channels(raw.info['ch_names'], include=stim_channel)
+    if len(picks) == 0:
+        raise ValueError('No stim channel found to extract event triggers.')
+
+    key = None
+    if not raw.preload:
+        paths = [path for path in raw.filenames if path is not None]
+        if paths:
+            stats = [os.stat(path) for path in paths]
+            key = (
+                tuple(map(str, paths)),
+                tuple((st.st_mtime, st.st_size) for st in stats),
+                tuple(picks), raw.first_samp, raw.last_samp,
+            )
+            if key in STIM_STEPS_CACHE:
+                return STIM_STEPS_CACHE[key].copy()
+
+    steps = []
+    last = None  # last sample of the previous chunk
+    negative = False
+    for start in range(0, raw.n_times, STIM_CHUNK_SIZE):
+        data, _ = raw[picks, start:start + STIM_CHUNK_SIZE]
+        if np.any(data < 0):
+            negative = True
+            data = np.abs(data)
+        data = data.astype(int)
+        if last is None:
+            offset = raw.first_samp
+        else:
+            data = np.hstack((last, data))
+            offset = raw.first_samp + start - 1
+        idx = np.flatnonzero(np.all(np.diff(data, axis=1) != 0, axis=0))
+        steps.append(np.column_stack((idx + 1 + offset, data[0, idx], data[0, idx + 1])))
+        last = data[:, -1:]
+    if negative:
+        getLogger('eelbrain').warning(
+            "Trigger channel contains negative values, using absolute value.")
+    steps = np.vstack(steps) if steps else np.empty((0, 3), int)
+
+    if key is not None:
+        if len(STIM_STEPS_CACHE) >= STIM_STEPS_CACHE_SIZE:
+            STIM_STEPS_CACHE.clear()
+        STIM_STEPS_CACHE[key] = steps.copy()
+    return steps
+
+
+def merge_stim_steps(steps, merge):
+    """Merge stim channel steps occurring in neighboring samples
+
+    Parameters
+    ----------
+    steps : array  (n_steps, 3)
+        Steps as returned by :func:`stim_steps`.
+    merge : int
+        Merge steps occurring within ``abs(merge)`` samples of each other;
+        negative values merge towards the earlier step, positive values
+        towards the later step (cf. :func:`mne.find_stim_steps`).
+    """
+    if merge == 0 or len(steps) < 2:
+        return steps
+    steps = steps.copy()
+    idx = np.diff(steps[:, 0]) <= abs(merge)
+    if not np.any(idx):
+        return steps
+    where = np.flatnonzero(idx)
+    keep = ~idx
+    if merge > 0:  # drop the earlier step
+        steps[where + 1, 1] = steps[where, 1]
+        keep = np.append(keep, True)
+    else:  # drop the later step
+        steps[where, 2] = steps[where + 1, 2]
+        keep = np.insert(keep, 0, True)
+    keep &= steps[:, 1] != steps[:, 2]
+    return steps[keep]
+
+
 def find_mne_channel_types(info):
     chs = {(ch['kind'], ch['unit']) for ch in info['chs']}
     types = {ch[0] for ch in chs}
@@ -703,6 +896,32 @@ def sensor_dim(info, picks=None, sysname=None, connectivity=None):
             raise ValueError("Unknown channel unit for sysname='neuromag': %r"
                              % (ch_unit,))
 
+    key = sensor_dim_key(ch_names, ch_locs, sysname, connectivity)
+    sensor = SENSOR_DIM_CACHE.get(key)
+    if sensor is None:
+        sensor = _sensor_dim(ch_locs, ch_names, sysname, connectivity)
+        if len(SENSOR_DIM_CACHE) >= SENSOR_DIM_CACHE_SIZE:
+            del SENSOR_DIM_CACHE[next(iter(SENSOR_DIM_CACHE))]
+        SENSOR_DIM_CACHE[key] = sensor
+    for keys in SENSOR_DIM_KEY_RECORDS:
+        keys.add(key)
+    return _copy_sensor_dim(sensor)
+
+
+def sensor_dim_key(ch_names, ch_locs, sysname, connectivity):
+    "Key for :data:`SENSOR_DIM_CACHE`"
+    locs_hash = hashlib.sha1(np.asarray(ch_locs, np.float64).tobytes()).hexdigest()
+    if connectivity is None or isinstance(connectivity, str):
+        connectivity_key = connectivity
+    elif isinstance(connectivity, np.ndarray):
+        connectivity_hash = hashlib.sha1(connectivity.tobytes()).hexdigest()
+        connectivity_key = (connectivity.dtype.str, connectivity.shape, connectivity_hash)
+    else:
+        connectivity_key = tuple(map(tuple, connectivity))
+    return tuple(ch_names), locs_hash, sysname, connectivity_key
+
+
+def _sensor_dim(ch_locs, ch_names, sysname, connectivity):
     if connectivity is not None:
         pass
     elif sysname is not None:
@@ -721,13 +940,85 @@ def sensor_dim(info, picks=None, sysname=None, connectivity=None):
     else:
         connectivity = 'none'
 
-    return Sensor(ch_locs, ch_names, sysname, connectivity=connectivity)
+    sensor = Sensor(ch_locs, ch_names, sysname, connectivity=connectivity)
+    # cached arrays are shared between copies
+    sensor.locs.setflags(write=False)
+    if sensor._connectivity is not None:
+        sensor._connectivity.setflags(write=False)
+    return sensor
+
+
+def _copy_sensor_dim(sensor):
+    "Copy of a cached sensor dimension that can be modified in place"
+    state = sensor.__getstate__()
+    state['locs'] = state['locs'].copy()
+    out = Sensor.__new__(Sensor)
+    out.__setstate__(state)
+    return out
+
+
+@contextmanager
+def record_sensor_dim_keys(keys):
+    "Add the keys of all sensor dimensions created in the context to ``keys``"
+    SENSOR_DIM_KEY_RECORDS.append(keys)
+    try:
+        yield keys
+    finally:
+        SENSOR_DIM_KEY_RECORDS.remove(keys)
+
+
+def load_sensor_dim_cache(path):
+    """Add sensor dimensions saved with :func:`save_sensor_dim_cache` to the cache
+
+    Returns
+    -------
+    keys : set
+        Keys of all entries in the file.
+    """
+    with open(path, 'rb') as fid:
+        cache = pickle.load(fid)
+    for key, sensor in cache.items():
+        if key not in SENSOR_DIM_CACHE:
+            sensor.locs.setflags(write=False)
+            if sensor._connectivity is not None:
+                sensor._connectivity.setflags(write=False)
+            SENSOR_DIM_CACHE[key] = sensor
+    return set(cache)
+
+
+def save_sensor_dim_cache(path, keys=None):
+    """Save the sensor dimension cache to ``path``
+
+    Parameters
+    ----------
+    path : str
+        Destination file. The file is written to a temporary file first and
+        then replaced, so that an interrupted write does not leave a partial
+        file.
+    keys : collection
+        Only save the entries with these keys (default all).
+
+    Returns
+    -------
+    keys : set
+        Keys of all entries in the file.
+    """
+    if keys is None:
+        cache = SENSOR_DIM_CACHE
+    else:
+        cache = {key: SENSOR_DIM_CACHE[key] for key in keys if key in SENSOR_DIM_CACHE}
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as fid:
+        pickle.dump(cache, fid, pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+    return set(cache)
 
 
 def raw_ndvar(raw, i_start=None, i_stop=None, decim=1, data=None, exclude='bads',
               sysname=None,  connectivity=None,
               inv=None, lambda2=1, method='dSPM', pick_ori=None, src=None,
-              subjects_dir=None, parc='aparc', label=None):
+              subjects_dir=None, parc='aparc', label=None, anti_alias=True,
+              mmap=None):
     """Raw dta as NDVar
 
     Parameters
@@ -740,8 +1031,8 @@ def raw_ndvar(raw, i_start=None, i_stop=None, decim=1, data=None, exclude='bads'
         Stop sample (see notes; default is end of the ``raw``).
     decim : int
         Downsample the data by this factor when importing. ``1`` (default)
-        means no downsampling. Note that this function does not low-pass filter
-        the data. The data is downsampled by picking out every n-th sample.
+        means no downsampling. By default, the data are low-pass filtered
+        before downsampling (see ``anti_alias``).
     data : 'eeg' | 'mag' | 'grad' | None
         The kind of data to include (default based on data).
     exclude : list of string | str
@@ -782,6 +1073,13 @@ def raw_ndvar(raw, i_start=None, i_stop=None, decim=1, data=None, exclude='bads'
         Parcellation to load for the source space.
     label : Label
         Restrict source estimate to this label.
+    anti_alias : bool
+        When downsampling (``decim > 1``), apply a polyphase anti-aliasing
+        filter (as :func:`scipy.signal.resample_poly`; default). Set to
+        ``False`` to pick out every n-th sample without filtering.
+    mmap : str
+        Store the data in a memory-mapped ``.npy`` file at this path instead of
+        keeping it in memory (only for a single segment).
 
     Returns
     -------
@@ -794,6 +1092,12 @@ def raw_ndvar(raw, i_start=None, i_stop=None, decim=1, data=None, exclude='bads'
     -----
     ``i_start`` and ``i_stop`` are interpreted as event indexes (from
     :func:`mne.find_events`), i.e. relative to ``raw.first_samp``.
+
+    The raw data are read in blocks of :data:`RAW_BLOCK_SIZE` samples, so
+    that, apart from the output, memory use does not depend on the length of
+    the segment. The anti-aliasing filter uses data outside of the segment
+    where available; only at the edges of the raw file, data are
+    zero-padded.
     """
     if not isinstance(raw, MNE_RAW):
         raw = mne_raw(raw)
@@ -810,6 +1114,11 @@ def raw_ndvar(raw, i_start=None, i_stop=None, decim=1, data=None, exclude='bads'
         scalar = True
     else:
         scalar = False
+    if mmap is not None and len(i_start) > 1:
+        raise ValueError(f"mmap={mmap!r}: only possible for a single segment")
+    decim = int(decim)
+    if decim < 1:
+        raise ValueError(f"decim={decim!r}")
 
     # event index to raw index
     i_start = tuple(i if i is None else i - raw.first_samp for i in i_start)
@@ -829,16 +1138,18 @@ def raw_ndvar(raw, i_start=None, i_stop=None, decim=1, data=None, exclude='bads'
         inv = prepare_inverse_operator(inv, 1, lambda2, method)
         info = {}  # FIXME
 
+    if inv is None:
+        def read(start, stop):
+            return raw[picks, start:stop][0]
+    else:
+        def read(start, stop):
+            stc = apply_inverse_raw(raw, inv, lambda2, method, label, start, stop,
+                                    pick_ori=pick_ori, prepared=True)
+            return stc.data
+
     out = []
     for start, stop in zip(i_start, i_stop):
-        if inv is None:
-            x = raw[picks, start:stop][0]
-        else:
-            x = apply_inverse_raw(raw, inv, lambda2, method, label, start,
-                                  stop, pick_ori=pick_ori, prepared=True).data
-
-        if decim != 1:
-            x = x[:, ::decim]
+        x = _read_decimated(read, start, stop, raw.n_times, decim, anti_alias, mmap)
         time = UTS(0, float(decim) / raw.info['sfreq'], x.shape[1])
         out.append(NDVar(x, (dim, time), info, name))
 
@@ -848,6 +1159,66 @@ def raw_ndvar(raw, i_start=None, i_stop=None, decim=1, data=None, exclude='bads'
         return out
 
 
+def _read_decimated(read, start, stop, n_times, decim=1, anti_alias=True, mmap=None):
+    """Read a segment of data block by block, with optional decimation
+
+    Parameters
+    ----------
+    read : callable
+        ``read(start, stop)`` returns data for samples ``start:stop``, shape
+        ``(n_channels, stop - start)``.
+    start, stop : int | None
+        Segment to read (default all ``n_times`` samples).
+    n_times : int
+        Number of samples available to ``read``.
+    decim : int
+        Decimation factor.
+    anti_alias : bool
+        Low-pass filter before decimating.
+    mmap : str
+        Path for storing the output in a memory-mapped ``.npy`` file.
+    """
+    start = 0 if start is None else start if start >= 0 else n_times + start
+    stop = n_times if stop is None else stop if stop >= 0 else n_times + stop
+    if not 0 <= start < stop <= n_times:
+        raise ValueError(
+            f"start={start}, stop={stop}: invalid segment for data with {n_times} samples")
+    n_out = -(-(stop - start) // decim)
+    n_block = max(1, RAW_BLOCK_SIZE // decim)
+    if decim > 1 and anti_alias:
+        from scipy.signal import firwin, upfirdn
+
+        # same filter as scipy.signal.resample_poly
+        half_len = 10 * decim
+        h = firwin(2 * half_len + 1, 1. / decim, window=('kaiser', 5.0))
+    else:
+        half_len = 0
+        h = None
+
+    x = None
+    for i0 in range(0, n_out, n_block):
+        i1 = min(i0 + n_block, n_out)
+        # input samples needed for output samples i0:i1
+        a = start + i0 * decim - half_len
+        b = start + (i1 - 1) * decim + half_len + 1
+        if h is None:
+            block = read(a, min(b, stop))[:, ::decim]
+        else:
+            block = read(max(a, 0), min(b, n_times))
+            if a < 0 or b > n_times:
+                block = np.pad(block, ((0, 0), (max(0, -a), max(0, b - n_times))), 'constant')
+            # upfirdn output m corresponds to input sample m * decim - half_len
+            block = upfirdn(h, block, 1, decim)[:, 2 * half_len // decim:][:, :i1 - i0]
+        if x is None:
+            shape = (len(block), n_out)
+            if mmap is None:
+                x = np.empty(shape)
+            else:
+                x = np.lib.format.open_memmap(mmap, 'w+', np.float64, shape)
+        x[:, i0:i1] = block
+    return x
+
+
 def epochs_ndvar(epochs, name=None, data=None, exclude='bads', mult=1,
                  info=None, sensors=None, vmax=None, sysname=None,
                  connectivity=None):
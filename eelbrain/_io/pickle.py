@@ -1,12 +1,46 @@
 # Author: Christian Brodbeck <christianbrodbeck@nyu.edu>
-from pickle import dump, HIGHEST_PROTOCOL, Unpickler
+from io import BytesIO
+import mmap
+from pickle import dump, dumps, loads, HIGHEST_PROTOCOL, Pickler, Unpickler
 from itertools import chain
 import os
+import struct
+
+import numpy as np
 
 from .._data_obj import NDVar, SourceSpaceBase
 from .._utils import ui
 
 
+# Format for pickles with separate arrays:
+# MAGIC, header length (uint64), header pickle, object length (uint64), object
+# pickle, array data (each array aligned to ARRAY_ALIGN bytes)
+MAGIC = b'EELARRS\x01'
+ARRAY_ALIGN = 64
+ARRAY_MIN_BYTES = 2 ** 16  # smaller arrays are stored in the pickle
+UINT64 = struct.Struct('<Q')
+
+
+class ArrayPickler(Pickler):
+    "Pickler that stores large arrays outside of the pickle"
+
+    def __init__(self, file, protocol):
+        Pickler.__init__(self, file, protocol)
+        self.arrays = []
+        self.array_ids = {}
+
+    def persistent_id(self, obj):
+        if type(obj) is not np.ndarray and not isinstance(obj, np.memmap):
+            return
+        elif obj.dtype.hasobject or obj.nbytes < ARRAY_MIN_BYTES:
+            return
+        key = id(obj)
+        if key not in self.array_ids:
+            self.array_ids[key] = len(self.arrays)
+            self.arrays.append(obj)
+        return 'ndarray', self.array_ids[key]
+
+
 class EelUnpickler(Unpickler):
 
     def find_class(self, module, name):
@@ -30,7 +64,21 @@ class EelUnpickler(Unpickler):
         return Unpickler.find_class(self, module, name)
 
 
-def pickle(obj, dest=None, protocol=HIGHEST_PROTOCOL):
+class ArrayUnpickler(EelUnpickler):
+    "Unpickler for pickles with separate arrays"
+
+    def __init__(self, file, arrays):
+        EelUnpickler.__init__(self, file)
+        self.arrays = arrays
+
+    def persistent_load(self, pid):
+        kind, i = pid
+        if kind != 'ndarray':
+            raise IOError(f"Unknown persistent object: {kind!r}")
+        return self.arrays[i]
+
+
+def pickle(obj, dest=None, protocol=HIGHEST_PROTOCOL, separate_arrays=False):
     """Pickle a Python object.
 
     Parameters
@@ -44,6 +92,11 @@ def pickle(obj, dest=None, protocol=HIGHEST_PROTOCOL):
     protocol : int
         Pickle protocol (default is ``HIGHEST_PROTOCOL``). For pickles that can
         be opened in Python 2, use ``protocol<=2``.
+    separate_arrays : bool
+        Store large arrays (e.g., data of NDVars and permutation
+        distributions) as raw data after the pickle. Such files load faster,
+        and arrays can be memory-mapped with ``unpickle(..., mmap=True)``.
+        Files can only be loaded with Eelbrain 0.30 or later.
     """
     if dest is None:
         filetypes = [("Pickled Python Objects (*.pickled)", '*.pickled')]
@@ -59,7 +112,10 @@ def pickle(obj, dest=None, protocol=HIGHEST_PROTOCOL):
 
     try:
         with open(dest, 'wb') as fid:
-            dump(obj, fid, protocol)
+            if separate_arrays:
+                _dump_separate_arrays(obj, fid, protocol)
+            else:
+                dump(obj, fid, protocol)
     except SystemError as exception:
         if exception.args[0] == 'error return without exception set':
             if os.path.exists(dest):
@@ -71,7 +127,59 @@ def pickle(obj, dest=None, protocol=HIGHEST_PROTOCOL):
             raise
 
 
-def unpickle(file_path=None):
+def _dump_separate_arrays(obj, fid, protocol):
+    buf = BytesIO()
+    pickler = ArrayPickler(buf, protocol)
+    pickler.dump(obj)
+    # array table with offsets relative to the start of the array data
+    table = []
+    data_size = 0
+    for array in pickler.arrays:
+        order = 'F' if array.flags.f_contiguous and not array.flags.c_contiguous else 'C'
+        table.append((array.dtype, array.shape, order, data_size))
+        data_size += -(-array.nbytes // ARRAY_ALIGN) * ARRAY_ALIGN
+    header = dumps({'version': 1, 'arrays': table}, protocol)
+    fid.write(MAGIC)
+    fid.write(UINT64.pack(len(header)))
+    fid.write(header)
+    fid.write(UINT64.pack(buf.tell()))
+    fid.write(buf.getbuffer())
+    # array data
+    data_start = -(-fid.tell() // ARRAY_ALIGN) * ARRAY_ALIGN
+    for array, (_, _, order, offset) in zip(pickler.arrays, table):
+        fid.seek(data_start + offset)
+        if order == 'F':
+            array = array.T
+        fid.write(np.ascontiguousarray(array).data)
+    # make sure the file extends to the end of the last array
+    fid.truncate(data_start + data_size)
+
+
+def _load_separate_arrays(fid, use_mmap):
+    header = loads(fid.read(UINT64.unpack(fid.read(UINT64.size))[0]))
+    if header['version'] > 1:
+        raise IOError("File was saved with a newer version of Eelbrain, please "
+                      "update Eelbrain to open it")
+    obj_bytes = fid.read(UINT64.unpack(fid.read(UINT64.size))[0])
+    data_start = -(-fid.tell() // ARRAY_ALIGN) * ARRAY_ALIGN
+    if use_mmap and header['arrays']:
+        buffer = mmap.mmap(fid.fileno(), 0, access=mmap.ACCESS_COPY)
+    else:
+        buffer = None
+    arrays = []
+    for dtype, shape, order, offset in header['arrays']:
+        dtype = np.dtype(dtype)
+        count = int(np.prod(shape))
+        if buffer is None:
+            fid.seek(data_start + offset)
+            x = np.fromfile(fid, dtype, count)
+        else:
+            x = np.frombuffer(buffer, dtype, count, data_start + offset)
+        arrays.append(x.reshape(shape, order=order))
+    return ArrayUnpickler(BytesIO(obj_bytes), arrays).load()
+
+
+def unpickle(file_path=None, mmap=False):
     """Load pickled Python objects from a file.
 
     Almost like ``pickle.load(open(file_path))``, but also loads object saved
@@ -84,6 +192,12 @@ def unpickle(file_path=None):
         Path to a pickled file. If ``None`` (default), a system file dialog
         will be shown. If the user cancels the file dialog, a RuntimeError is
         raised.
+    mmap : bool
+        For files saved with ``pickle(..., separate_arrays=True)``, memory-map
+        arrays instead of reading them. Data is then only read from disk when
+        it is accessed, so that, e.g., cluster tables of a test result can
+        be retrieved without reading all parameter maps. Arrays are
+        copy-on-write (modifying them does not modify the file).
 
     Notes
     -----
@@ -107,6 +221,9 @@ def unpickle(file_path=None):
                 file_path = new_path
 
     with open(file_path, 'rb') as fid:
+        if fid.read(len(MAGIC)) == MAGIC:
+            return _load_separate_arrays(fid, mmap)
+        fid.seek(0)
         unpickler = EelUnpickler(fid, encoding='latin1')
         return unpickler.load()
 
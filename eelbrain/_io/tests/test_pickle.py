@@ -1,6 +1,11 @@
 # Author: Christian Brodbeck <christianbrodbeck@nyu.edu>
-from eelbrain import datasets, load
-from eelbrain.testing import assert_dataobj_equal, file_path
+import os
+
+import numpy as np
+from numpy.testing import assert_array_equal
+
+from eelbrain import datasets, load, save, testnd
+from eelbrain.testing import assert_dataobj_equal, assert_dataset_equal, file_path, TempDir
 
 
 def test_pickle():
@@ -10,3 +15,39 @@ def test_pickle():
     assert_dataobj_equal(ds_2, ds)
     ds_3 = load.unpickle(file_path('uts-py3.pickle'))
     assert_dataobj_equal(ds_3, ds)
+
+
+def test_pickle_separate_arrays():
+    ds = datasets.get_uts(True)
+    res = testnd.ttest_1samp('utsnd', ds=ds, samples=100, pmin=0.05)
+    tempdir = TempDir()
+    dst = os.path.join(tempdir, 'res.pickled')
+    save.pickle(res, dst, separate_arrays=True)
+    for mmap in (False, True):
+        res_ = load.unpickle(dst, mmap=mmap)
+        assert_dataobj_equal(res_.t, res.t)
+        assert_dataobj_equal(res_.p, res.p)
+        assert_dataobj_equal(res_.clusters, res.clusters)
+        assert repr(res_) == repr(res)
+    # memory-mapped data is copy-on-write
+    res_ = load.unpickle(dst, mmap=True)
+    res_.t.x += 1
+    assert_dataobj_equal(load.unpickle(dst).t, res.t)
+    # Dataset with large arrays
+    save.pickle(ds, dst, separate_arrays=True)
+    for mmap in (False, True):
+        ds_ = load.unpickle(dst, mmap=mmap)
+        assert_dataset_equal(ds_, ds)
+    # objects without large arrays
+    save.pickle(ds['A'], dst, separate_arrays=True)
+    assert_dataobj_equal(load.unpickle(dst, mmap=True), ds['A'])
+    # structured arrays keep their fields
+    x = np.zeros(10000, [('time', 'i8'), ('event', 'U6'), ('value', 'f4')])
+    x['time'] = np.arange(10000)
+    x['event'][::2] = 'EBLINK'
+    x['value'] = 0.5
+    save.pickle({'x': x}, dst, separate_arrays=True)
+    for mmap in (False, True):
+        x_ = load.unpickle(dst, mmap=mmap)['x']
+        assert x_.dtype == x.dtype
+        assert_array_equal(x_, x)
@@ -4,10 +4,14 @@ from collections import defaultdict
 import numpy as np
 
 from ._data_obj import Datalist, Dataset
-from ._ndvar import neighbor_correlation
 from ._info import BAD_CHANNELS
 
 
+# number of values (epochs x sensors x times) processed at a time by
+# EpochStatistics
+EPOCH_STATISTICS_BLOCK_SIZE = 2 ** 21
+
+
 def _out(out, epochs):
     if out is None:
         return Datalist([[] for _ in range(len(epochs))])
@@ -26,15 +30,123 @@ def new_rejection_ds(ds):
     return out
 
 
-def find_flat_epochs(epochs, flat=1e-13, out=None):
-    out = _out(out, epochs)
-    d = epochs.max('time') - epochs.min('time')
-    for i, chi in zip(*np.nonzero(d.get_data(('case', 'sensor')) < flat)):
-        ch = epochs.sensor.names[chi]
-        if ch not in out[i]:
-            out[i].append(ch)
+class EpochStatistics:
+    """Per epoch and sensor statistics for artifact detection
 
-    return out
+    The statistics are computed in a single pass over blocks of epochs, after
+    which rejection criteria can be evaluated repeatedly without accessing the
+    data.
+
+    Parameters
+    ----------
+    epochs : NDVar  (case, sensor, time)
+        Epochs.
+    corr : bool
+        Compute the average correlation of each sensor with its neighbors
+        (requires sensor connectivity).
+
+    Attributes
+    ----------
+    sensor : Sensor
+        Sensor dimension of the epochs.
+    max : array  (n_epochs, n_sensors)
+        Maximum value in each epoch.
+    min : array  (n_epochs, n_sensors)
+        Minimum value in each epoch.
+    corr : array  (n_epochs, n_sensors) | None
+        Average correlation with neighboring sensors (neighbors without
+        variance are ignored; ``nan`` for sensors without variance).
+    """
+    def __init__(self, epochs, corr=True):
+        x = epochs.get_data(('case', 'sensor', 'time'))
+        n_epochs, n_sensors, n_times = x.shape
+        self.sensor = epochs.sensor
+        self.max = np.empty((n_epochs, n_sensors))
+        self.min = np.empty((n_epochs, n_sensors))
+        if corr:
+            edges = epochs.sensor.connectivity()
+            self.corr = np.empty((n_epochs, n_sensors))
+            # sum of correlations with neighbors = edge correlations x incidence
+            incidence = np.zeros((len(edges), n_sensors))
+            np.add.at(incidence, (np.arange(len(edges)), edges[:, 0]), 1)
+            np.add.at(incidence, (np.arange(len(edges)), edges[:, 1]), 1)
+        else:
+            self.corr = None
+
+        # values per epoch, including the neighbor pairs for correlations
+        n_values = n_times * (n_sensors + 2 * len(edges) if corr else n_sensors)
+        n = max(1, EPOCH_STATISTICS_BLOCK_SIZE // n_values)
+        for start in range(0, n_epochs, n):
+            stop = min(start + n, n_epochs)
+            block = x[start:stop]
+            block.max(2, out=self.max[start:stop])
+            block.min(2, out=self.min[start:stop])
+            if corr:
+                z = block - block.mean(2, keepdims=True)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    z /= np.sqrt(np.einsum('ijk,ijk->ij', z, z))[:, :, None]
+                    r = np.einsum('ijk,ijk->ij', z[:, edges[:, 0]], z[:, edges[:, 1]])
+                    # ignore neighbors without variance
+                    valid = ~np.isnan(r)
+                    r[~valid] = 0
+                    self.corr[start:stop] = r.dot(incidence) / valid.dot(incidence)
+
+    def abs_max(self):
+        "Maximum absolute value of each sensor in each epoch"
+        return np.maximum(self.max, -self.min)
+
+    def p2p(self):
+        "Peak-to-peak amplitude of each sensor in each epoch"
+        return self.max - self.min
+
+    def epoch_max(self, method='abs', exclude=None):
+        """Maximum of a statistic across sensors for each epoch
+
+        Parameters
+        ----------
+        method : 'abs' | 'p2p'
+            Absolute value or peak-to-peak amplitude.
+        exclude : array of bool  (n_epochs, n_sensors)
+            Sensors to ignore in each epoch.
+
+        Returns
+        -------
+        epoch_max : array  (n_epochs,)
+            Largest value in each epoch.
+        """
+        if method == 'abs':
+            x = self.abs_max()
+        elif method == 'p2p':
+            x = self.p2p()
+        else:
+            raise ValueError("Invalid method: %r" % method)
+        if exclude is not None:
+            x[exclude] = 0
+        return x.max(1)
+
+    def find_flat_epochs(self, flat=1e-13, out=None):
+        "Sensors whose peak-to-peak amplitude is below ``flat`` in each epoch"
+        return self._sensor_lists(self.p2p() < flat, out)
+
+    def find_noisy_channels(self, mincorr=0.35):
+        "Sensors whose correlation with neighbors is below ``mincorr`` in each epoch"
+        if self.corr is None:
+            raise RuntimeError("Statistics were computed without neighbor correlation")
+        return self._sensor_lists(self.corr < mincorr)
+
+    def _sensor_lists(self, index, out=None):
+        out = _out(out, index)
+        for i, chi in zip(*np.nonzero(index)):
+            ch = self.sensor.names[chi]
+            if ch not in out[i]:
+                out[i].append(ch)
+        return out
+
+
+def find_flat_epochs(epochs, flat=1e-13, out=None):
+    if not isinstance(epochs, EpochStatistics):
+        epochs = EpochStatistics(epochs, corr=False)
+    return epochs.find_flat_epochs(flat, out)
 
 
 def find_flat_evoked(epochs, flat=1e-14):
@@ -44,9 +156,9 @@ def find_flat_evoked(epochs, flat=1e-14):
 
 
 def find_noisy_channels(epochs, mincorr=0.35):
-    names = epochs.sensor.names
-    out_e = Datalist([list(names[neighbor_correlation(ep) < mincorr]) for ep in epochs])
-    return out_e
+    if not isinstance(epochs, EpochStatistics):
+        epochs = EpochStatistics(epochs)
+    return epochs.find_noisy_channels(mincorr)
 
 
 def channel_listlist_to_dict(listlist):
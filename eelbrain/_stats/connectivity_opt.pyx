@@ -130,3 +130,104 @@ def tfce_increment(np.ndarray[UINT32, ndim=1] labels,
             image[i] += area[cid]
 
     free(area)
+
+
+def segment_max(np.ndarray[FLOAT64, ndim=1] x,
+                np.ndarray[INT64, ndim=1] order,
+                np.ndarray[INT64, ndim=1] starts,
+                np.ndarray[FLOAT64, ndim=1] out):
+    """Maximum in each segment of a region-sorted index
+
+    Parameters
+    ----------
+    x : array (n,)
+        Values.
+    order : array (n_indexed,)
+        Indexes into ``x``, sorted by region.
+    starts : array (n_regions + 1,)
+        Region ``i`` consists of ``order[starts[i]: starts[i + 1]]``.
+    out : array (n_regions,)
+        Container for the maxima (``-inf`` for empty regions).
+    """
+    cdef Py_ssize_t i, j
+    cdef double v, max_v
+    cdef Py_ssize_t n_regions = starts.shape[0] - 1
+
+    for i in range(n_regions):
+        max_v = -np.inf
+        for j in range(starts[i], starts[i + 1]):
+            v = x[order[j]]
+            if v > max_v:
+                max_v = v
+        out[i] = max_v
+
+
+def segment_cluster_max(np.ndarray[FLOAT64, ndim=1] stat_map,
+                        np.ndarray[UINT32, ndim=1] cmap,
+                        np.ndarray[UINT32, ndim=1] cids,
+                        np.ndarray[INT64, ndim=1] order,
+                        np.ndarray[INT64, ndim=1] starts,
+                        int absolute,
+                        np.ndarray[FLOAT64, ndim=1] out):
+    """Largest cluster value in each segment of a region-sorted index
+
+    Parameters
+    ----------
+    stat_map : array (n,)
+        Flattened statistical map.
+    cmap : array of uint32 (n,)
+        Flattened cluster map.
+    cids : array of uint32
+        Clusters to consider.
+    order : array (n_indexed,)
+        Indexes into ``stat_map``, sorted by region.
+    starts : array (n_regions + 1,)
+        Region ``i`` consists of ``order[starts[i]: starts[i + 1]]``.
+    absolute : bool
+        Use the absolute cluster values.
+    out : array (n_regions,)
+        Container for the maximum over ``cids`` of the sum of ``stat_map``
+        in the part of each cluster that lies inside the region (0 if
+        ``cids`` is empty).
+    """
+    cdef Py_ssize_t i, j, k
+    cdef unsigned int cid
+    cdef double v, max_v
+    cdef Py_ssize_t n_regions = starts.shape[0] - 1
+    cdef Py_ssize_t n_cids = cids.shape[0]
+    cdef unsigned int n_labels = 0
+
+    if n_cids == 0:
+        for i in range(n_regions):
+            out[i] = 0
+        return
+
+    for k in range(n_cids):
+        if cids[k] >= n_labels:
+            n_labels = cids[k] + 1
+
+    cdef double* sums = <double*> malloc(sizeof(double) * n_labels)
+    for k in range(n_labels):
+        sums[k] = 0.
+
+    for i in range(n_regions):
+        for j in range(starts[i], starts[i + 1]):
+            cid = cmap[order[j]]
+            if cid < n_labels:
+                sums[cid] += stat_map[order[j]]
+
+        for k in range(n_cids):
+            v = sums[cids[k]]
+            if absolute and v < 0:
+                v = -v
+            if k == 0 or v > max_v:
+                max_v = v
+        out[i] = max_v
+
+        # reset the sums touched by this region
+        for j in range(starts[i], starts[i + 1]):
+            cid = cmap[order[j]]
+            if cid < n_labels:
+                sums[cid] = 0.
+
+    free(sums)
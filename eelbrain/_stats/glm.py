@@ -20,7 +20,6 @@ from .._utils import LazyProperty
 from .._data_obj import (
     Model, asmodel, assub, asvar, assert_has_no_empty_cells, find_factors,
     hasrandom, is_higher_order_effect, isbalanced, iscategorial, isnestedin)
-from .opt import anova_fmaps, anova_full_fmaps, lm_res_ss, ss
 from .stats import ftest_p
 from . import test
 
@@ -316,7 +315,14 @@ def _nd_anova(x):
 
 
 class _NDANOVA:
-    """Efficiently fit a model to multiple dependent variables."""
+    """Efficiently fit a model to multiple dependent variables.
+
+    F-maps are computed with dense matrix products over all tests (and over
+    blocks of permutations): for each (permuted) model, betas are
+    ``B = xsinv[:, perm] @ y``, and sums of squares of (partial) model
+    predictions are quadratic forms ``B.T @ (X.T @ X) @ B``, where ``X.T @ X``
+    does not depend on the permutation.
+    """
     def __init__(self, x, effects, dfs_denom):
         self.x = x
         self.p = x._parametrize()
@@ -339,36 +345,65 @@ class _NDANOVA:
             Assumes that the first dimension of y provides cases.
             Other than that, shape is free to vary and output shape will match
             input shape.
-        perm : None | array (n_cases, )
-            Permutation.
+        perm : None | array (n_cases, ) | array (n_permutations, n_cases)
+            Permutation, or block of permutations (one per row).
 
         Returns
         -------
-        f_maps : list
-            A list with maps of F values (order corresponding to self.effects).
+        f_maps : array (n_effects, ...) | array (n_permutations, n_effects, ...)
+            Maps of F values (order corresponding to self.effects; ``None`` if
+            the result is stored in a container from :meth:`.preallocate`).
         """
         if y.shape[0] != self._n_obs:
             raise ValueError("y has wrong number of observations (%i, model "
                              "has %i)" % (y.shape[0], self._n_obs))
 
+        is_block = perm is not None and perm.ndim == 2
+        if perm is not None and not is_block:
+            perm = perm[np.newaxis]
+        n_perm = 1 if perm is None else len(perm)
+
         # find result container
         if self._flat_f_map is None:
             shape = (self.n_effects,) + y.shape[1:]
+            if is_block:
+                shape = (n_perm,) + shape
             f_map = np.empty(shape)
-            flat_f_map = f_map.reshape((self.n_effects, -1))
+            flat_f_map = f_map.reshape((n_perm, self.n_effects, -1))
+        elif n_perm > len(self._flat_f_map):
+            raise ValueError(
+                f"Block of {n_perm} permutations; preallocated for {len(self._flat_f_map)}")
         else:
             f_map = None
-            flat_f_map = self._flat_f_map
+            flat_f_map = self._flat_f_map[:n_perm]
 
-        if y.ndim > 2:
+        if y.ndim != 2:
             y = y.reshape((self._n_obs, -1))
 
-        self._map(y, flat_f_map, perm)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self._map(y, flat_f_map, perm)
+        # tests with zero variance
+        flat_f_map[:, :, np.all(y == y[0], 0)] = 0
         return f_map
 
     def _map(self, y, flat_f_map, perm):
         raise NotImplementedError
 
+    @staticmethod
+    def _betas(y, xsinv, perm):
+        "Betas for each permutation, array (n_perm, n_betas, n_tests)"
+        if perm is None:
+            return np.dot(xsinv, y)[np.newaxis]
+        n_betas = len(xsinv)
+        xsinv_perm = np.ascontiguousarray(xsinv[:, perm].swapaxes(0, 1))
+        betas = np.dot(xsinv_perm.reshape((-1, len(y))), y)
+        return betas.reshape((len(perm), n_betas, y.shape[1]))
+
+    @staticmethod
+    def _quadratic_form(betas, xtx):
+        "Sum of squares of the predictions ``x @ betas``, from ``xtx = x.T @ x``"
+        return np.einsum('pim,pim->pm', betas, np.matmul(xtx, betas))
+
     def p_maps(self, f_maps):
         """Convert F-maps for uncorrected p-maps
 
@@ -387,7 +422,7 @@ class _NDANOVA:
             p_maps[i] = ftest_p(f_maps[i], self.dfs_nom[i], self.dfs_denom[i])
         return p_maps
 
-    def preallocate(self, y_shape):
+    def preallocate(self, y_shape, block_size=None):
         """Pre-allocate an output array container.
 
         Parameters
@@ -395,17 +430,21 @@ class _NDANOVA:
         y_shape : tuple
             Data shape (excluding case), will allow preallocation of containers
             for results.
+        block_size : int
+            Preallocate for blocks of up to ``block_size`` permutations.
 
         Returns
         -------
-        f_maps : array
+        f_maps : array (n_effects, ...) | array (block_size, n_effects, ...)
             Properly shaped output array. Every time .map() is called, the
             content of this array will change (and map() will not return
             anything)
         """
         shape = (self.n_effects,) + y_shape
+        if block_size:
+            shape = (block_size,) + shape
         f_map = np.empty(shape)
-        self._flat_f_map = f_map.reshape((self.n_effects, -1))
+        self._flat_f_map = f_map.reshape((block_size or 1, self.n_effects, -1))
         return f_map
 
 
@@ -415,23 +454,18 @@ class _BalancedNDANOVA(_NDANOVA):
         _NDANOVA.__init__(self, x, effects, dfs_denom)
 
         self._effect_to_beta = x._effect_to_beta
-        self._x_full_perm = None
-        self._x_proj_perm = None
+        xtx = self.p.x.T.dot(self.p.x)
+        self._xtx = xtx
+        self._effect_xtx = [(slice(i, i + df), xtx[i: i + df, i: i + df])
+                            for i, df in x._effect_to_beta]
 
     def _map(self, y, flat_f_map, perm):
-        if perm is None:
-            x_full = self.p.x
-            x_proj = self.p.projector
-        else:
-            if self._x_full_perm is None:
-                self._x_full_perm = np.empty_like(self.p.x)
-                self._x_proj_perm = np.empty_like(self.p.projector)
-            x_full = self.p.x.take(perm, 0, self._x_full_perm)
-            x_proj = self.p.projector.take(perm, 1, self._x_proj_perm)
+        betas = self._betas(y, self.p.projector, perm)
+        ms_effects = [self._quadratic_form(betas[:, index], xtx) / xtx.shape[0]
+                      for index, xtx in self._effect_xtx]
+        self._map_balanced(y, betas, ms_effects, flat_f_map)
 
-        self._map_balanced(y, flat_f_map, x_full, x_proj)
-
-    def _map_balanced(self, y, flat_f_map, x_full, xsinv):
+    def _map_balanced(self, y, betas, ms_effects, flat_f_map):
         raise NotImplementedError
 
 
@@ -448,9 +482,12 @@ class _BalancedFixedNDANOVA(_BalancedNDANOVA):
 
         self.df_error = x.df_error
 
-    def _map_balanced(self, y, flat_f_map, x_full, xsinv):
-        anova_fmaps(y, x_full, xsinv, flat_f_map, self._effect_to_beta,
-                    self.df_error)
+    def _map_balanced(self, y, betas, ms_effects, flat_f_map):
+        ms_res = np.einsum('im,im->m', y, y) - self._quadratic_form(betas, self._xtx)
+        np.maximum(ms_res, 0, ms_res)
+        ms_res /= self.df_error
+        for i, ms in enumerate(ms_effects):
+            np.divide(ms, ms_res, flat_f_map[:, i])
 
 
 class _BalancedMixedNDANOVA(_BalancedNDANOVA):
@@ -474,11 +511,16 @@ class _BalancedMixedNDANOVA(_BalancedNDANOVA):
         effects = tuple(x.effects[i] for i in keep)
         dfs_denom = tuple(df_den[i] for i in keep)
         _BalancedNDANOVA.__init__(self, x, effects, dfs_denom)
+        self._keep = keep
         self._e_ms_array = _hopkins_ems_array(x)
 
-    def _map_balanced(self, y, flat_f_map, x_full, xsinv):
-        anova_full_fmaps(y, x_full, xsinv, flat_f_map, self._effect_to_beta,
-                         self._e_ms_array)
+    def _map_balanced(self, y, betas, ms_effects, flat_f_map):
+        ms_effects = np.array(ms_effects)
+        ms_denom = np.tensordot(self._e_ms_array[list(self._keep)] > 0, ms_effects, 1)
+        for i_fmap, i_effect in enumerate(self._keep):
+            out = flat_f_map[:, i_fmap]
+            out.fill(0)
+            np.divide(ms_effects[i_effect], ms_denom[i_fmap], out, where=ms_denom[i_fmap] > 0)
 
 
 class _IncrementalNDANOVA(_NDANOVA):
@@ -487,82 +529,56 @@ class _IncrementalNDANOVA(_NDANOVA):
         _NDANOVA.__init__(self, x, comparisons.effects, comparisons.dfs_denom)
 
         self._comparisons = comparisons
-        self._SS_diff = None
-        self._MS_e = None
-        self._SS_res = None
 
+        # models with their projectors stacked into a single matrix
         self._x_orig = {}
         self._full_ss_i = -1
+        xsinvs = []
+        n_betas = 0
         for m, i in comparisons.relevant_models:
             if m is None:  # intercept only
                 self._x_orig[i] = None
                 self._full_ss_i = i
             else:
                 p = m._parametrize()
-                self._x_orig[i] = (p.x, p.projector)
+                index = slice(n_betas, n_betas + len(p.projector))
+                self._x_orig[i] = (index, p.x.T.dot(p.x))
+                xsinvs.append(p.projector)
+                n_betas += len(p.projector)
         if comparisons.mixed and self._full_ss_i == -1:
             # need full SS
             self._x_orig[-1] = None
-        self._x_perm = None
-
-    def preallocate(self, y_shape):
-        f_map = _NDANOVA.preallocate(self, y_shape)
-
-        shape = self._flat_f_map.shape[1]
-        self._SS_diff = np.empty(shape)
-        self._MS_e = np.empty(shape)
-        self._SS_res = {i: np.empty(shape) for i in self._x_orig.keys()}
-        return f_map
+        self._xsinv = np.vstack(xsinvs) if xsinvs else None
 
     def _map(self, y, flat_f_map, perm):
-        if self._SS_diff is None:
-            shape = y.shape[1]
-            SS_diff = MS_diff = np.empty(shape)
-            MS_e = np.empty(shape)
-            SS_res = {i: np.empty(shape) for i in self._x_orig.keys()}
-        else:
-            SS_diff = MS_diff = self._SS_diff
-            MS_e = self._MS_e
-            SS_res = self._SS_res
-
-        if perm is None:
-            x_dict = self._x_orig
-        else:
-            x_orig = self._x_orig
-            x_dict = self._x_perm
-            if x_dict is None:
-                self._x_perm = x_dict = {}
-                for i, x in x_orig.items():
-                    if x is None:
-                        x_dict[i] = None
-                    else:
-                        x_dict[i] = (np.empty_like(x[0]), np.empty_like(x[1]))
-
-            for i in x_dict:
-                if x_dict[i]:
-                    x_orig[i][0].take(perm, 0, x_dict[i][0])
-                    x_orig[i][1].take(perm, 1, x_dict[i][1])
-
+        n_perm = len(flat_f_map)
         # calculate SS_res for all models
-        for i, x in x_dict.items():
-            if x is None:  # TODO:  use the same across permutations?
-                ss(y, SS_res[i])
+        ss_y = np.einsum('im,im->m', y, y)
+        betas = None if self._xsinv is None else self._betas(y, self._xsinv, perm)
+        SS_res = {}
+        for i, x in self._x_orig.items():
+            if x is None:  # intercept only
+                mean = y.mean(0)
+                ss = np.maximum(ss_y - len(y) * mean ** 2, 0)
+                SS_res[i] = np.broadcast_to(ss, (n_perm, y.shape[1]))
             else:
-                x_full, xsinv = x
-                lm_res_ss(y, x_full, xsinv, SS_res[i])
+                index, xtx = x
+                ss = ss_y - self._quadratic_form(betas[:, index], xtx)
+                # rounding errors can make the difference negative
+                SS_res[i] = np.maximum(ss, 0, ss)
 
         # incremental comparisons
         if not self._comparisons.mixed:
-            np.divide(SS_res[0], self.x.df_error, MS_e)
+            MS_e = SS_res[0] / self.x.df_error
         for i, (i_test, (i1, i0)) in enumerate(self._comparisons.comparisons.items()):
             if self._comparisons.mixed:
                 i_ems = self._comparisons.ems_idx[i_test]
-                np.subtract(SS_res[self._full_ss_i], SS_res[i_ems], MS_e)
-                np.divide(MS_e, self.dfs_denom[i], MS_e)
+                MS_e = SS_res[self._full_ss_i] - SS_res[i_ems]
+                MS_e /= self.dfs_denom[i]
             df_diff = self._comparisons.x.effects[i_test].df
-            np.subtract(SS_res[i0], SS_res[i1], SS_diff)
-            np.divide(SS_diff, df_diff, MS_diff)
-            np.divide(MS_diff, MS_e, flat_f_map[i])
+            MS_diff = SS_res[i0] - SS_res[i1]
+            MS_diff /= df_diff
+            np.divide(MS_diff, MS_e, flat_f_map[:, i])
 
 
 def effect_id(effects):
@@ -2,7 +2,6 @@
 #cython: boundscheck=False, wraparound=False
 
 cimport cython
-from cython.view cimport array as cvarray
 from libc.stdlib cimport malloc, free
 import numpy as np
 cimport numpy as cnp
@@ -11,149 +10,8 @@ ctypedef cnp.int8_t INT8
 ctypedef cnp.int64_t INT64
 ctypedef cnp.float64_t FLOAT64
 
-
-def anova_full_fmaps(cnp.ndarray[FLOAT64, ndim=2] y,
-                     cnp.ndarray[FLOAT64, ndim=2] x,
-                     cnp.ndarray[FLOAT64, ndim=2] xsinv,
-                     cnp.ndarray[FLOAT64, ndim=2] f_map,
-                     cnp.ndarray[INT64, ndim=2] effects,
-                     cnp.ndarray[INT8, ndim=2] e_ms):
-    """Compute f-maps for a balanced, fully specified ANOVA model
-    
-    Parameters
-    ----------
-    y : array (n_cases, n_tests)
-        Dependent Measurement.
-    x : array (n_cases, n_betas)
-        model matrix.
-    xsinv : array (n_betas, n_cases)
-        xsinv for regression.
-    f_map : array (n_fs, n_tests)
-        container for output.
-    effects : array (n_effects, 2)
-        For each effect, indicating the first index in betas and df.
-    e_ms : array (n_effects, n_effects)
-        Each row represents the expected MS of one effect.
-    """
-    cdef unsigned long i
-    cdef unsigned int df, i_beta, i_effect, i_effect_ms, i_start, i_stop, i_fmap, case
-    cdef double v, ss, ms_denom
-
-    cdef unsigned long n_tests = y.shape[1]
-    cdef unsigned int n_cases = y.shape[0]
-    cdef unsigned int n_betas = x.shape[1]
-    cdef unsigned int n_effects = effects.shape[0]
-    cdef double *betas = <double *>malloc(sizeof(double) * n_betas)
-    cdef double *mss = <double *>malloc(sizeof(double) * n_effects)
-
-    for i in range(n_tests):
-        if zero_variance(y, i) == 1:
-            for i_fmap in range(f_map.shape[0]):
-                f_map[i_fmap, i] = 0
-            continue
-
-        _lm_betas(y, i, xsinv, betas)
-
-        # find MS of effects
-        for i_effect in range(n_effects):
-            i_start = effects[i_effect, 0]
-            df = effects[i_effect, 1]
-            i_stop = i_start + df
-            ss = 0
-            for case in range(n_cases):
-                v = 0
-                for i_beta in range(i_start, i_stop):
-                    v += x[case, i_beta] * betas[i_beta]
-                ss += v ** 2
-            mss[i_effect] = ss / df
-
-        # compute F maps
-        i_fmap = 0
-        for i_effect in range(n_effects):
-            ms_denom = 0
-            for i_effect_ms in range(n_effects):
-                if e_ms[i_effect, i_effect_ms] > 0:
-                    ms_denom += mss[i_effect_ms]
-
-            if ms_denom > 0:
-                f_map[i_fmap, i] = mss[i_effect] / ms_denom
-                i_fmap += 1
-
-    free(betas)
-    free(mss)
-
-
-def anova_fmaps(cnp.ndarray[FLOAT64, ndim=2] y,
-                cnp.ndarray[FLOAT64, ndim=2] x,
-                cnp.ndarray[FLOAT64, ndim=2] xsinv,
-                cnp.ndarray[FLOAT64, ndim=2] f_map,
-                cnp.ndarray[INT64, ndim=2] effects,
-                int df_res):
-    """Compute f-maps for a balanced ANOVA model with residuals
-
-    Parameters
-    ----------
-    y : array (n_cases, n_tests)
-        Dependent Measurement.
-    x : array (n_cases, n_betas)
-        model matrix.
-    xsinv : array (n_betas, n_cases)
-        xsinv for regression.
-    f_map : array (n_fs, n_tests)
-        container for output.
-    effects : array (n_effects, 2)
-        For each effect, indicating the first index in betas and df.
-    df_res : int
-        Df of the residuals.
-    """
-    cdef unsigned long i
-    cdef unsigned int df, i_beta, i_effect, i_effect_ms, i_effect_beta, i_fmap, case
-    cdef double v, SS, MS, MS_res, MS_den
-
-    cdef unsigned long n_tests = y.shape[1]
-    cdef unsigned int n_cases = y.shape[0]
-    cdef unsigned int n_betas = x.shape[1]
-    cdef unsigned int n_effects = effects.shape[0]
-    cdef double *betas = <double *>malloc(sizeof(double) * n_betas)
-    cdef double [:,:] values = cvarray((n_cases, n_betas), sizeof(double), "d")
-    cdef double *predicted_y = <double *>malloc(sizeof(double) * n_cases)
-
-    for i in range(n_tests):
-        if zero_variance(y, i) == 1:
-            for i_fmap in range(f_map.shape[0]):
-                f_map[i_fmap, i] = 0
-            continue
-
-        _lm_betas(y, i, xsinv, betas)
-
-        # expand accounted variance
-        for case in range(n_cases):
-            predicted_y[case] = 0
-            for i_beta in range(n_betas):
-                v = x[case, i_beta] * betas[i_beta]
-                predicted_y[case] += v
-                values[case, i_beta] = v
-
-        # residuals
-        SS = 0
-        for case in range(n_cases):
-            SS += (y[case, i] - predicted_y[case]) ** 2
-        MS_res = SS / df_res
-
-        # find MS of effects
-        for i_effect in range(n_effects):
-            i_effect_beta = effects[i_effect, 0]
-            df = effects[i_effect, 1]
-            SS = 0
-            for case in range(n_cases):
-                v = 0
-                for i_beta in range(i_effect_beta, i_effect_beta + df):
-                    v += values[case, i_beta]
-                SS += v ** 2
-            MS = SS / df
-            f_map[i_effect, i] = MS / MS_res
-
-    free(betas)
+# number of tests processed at a time by block functions
+cdef Py_ssize_t TILE = 256
 
 
 def sum_square(cnp.ndarray[FLOAT64, ndim=2] y,
@@ -215,18 +73,6 @@ def ss(cnp.ndarray[FLOAT64, ndim=2] y,
         out[i] = ss_
 
 
-cdef int zero_variance(cnp.ndarray[FLOAT64, ndim=2] y,
-                            unsigned long i):
-    """Check whether a column of y has zero variance"""
-    cdef unsigned int case
-    cdef double ref_value = y[0, i]
-
-    for case in range(1, y.shape[0]):
-        if y[case, i] != ref_value:
-            return 0
-    return 1
-
-
 cdef void _lm_betas(cnp.ndarray[FLOAT64, ndim=2] y,
                     unsigned long i,
                     cnp.ndarray[FLOAT64, ndim=2] xsinv,
@@ -262,39 +108,6 @@ cdef void _lm_betas(cnp.ndarray[FLOAT64, ndim=2] y,
         betas[i_beta] = beta
 
 
-cdef double _lm_res_ss(cnp.ndarray[FLOAT64, ndim=2] y,
-                       int i,
-                       cnp.ndarray[FLOAT64, ndim=2] x,
-                       int df_x,
-                       double *betas):
-    """Residual sum squares
-
-    Parameters
-    ----------
-    y : array (n_cases, n_tests)
-        Dependent Measurement.
-    i : int
-        Index of the test for which to calculate betas.
-    x : array (n_cases, df_model)
-        Model matrix.
-    betas : array (n_betas,)
-        Fitted regression coefficients.
-    """
-    cdef unsigned int case, i_beta
-    cdef double predicted_y
-
-    cdef double ss = 0
-    cdef unsigned int n_cases = y.shape[0]
-
-    for case in range(n_cases):
-        predicted_y = 0
-        for i_beta in range(df_x):
-            predicted_y += x[case, i_beta] * betas[i_beta]
-        ss += (y[case, i] - predicted_y) ** 2
-
-    return ss
-
-
 def lm_betas(cnp.ndarray[FLOAT64, ndim=2] y,
              cnp.ndarray[FLOAT64, ndim=2] x,
              cnp.ndarray[FLOAT64, ndim=2] xsinv,
@@ -366,37 +179,6 @@ def lm_res(cnp.ndarray[FLOAT64, ndim=2] y,
     free(betas)
 
 
-def lm_res_ss(cnp.ndarray[FLOAT64, ndim=2] y,
-              cnp.ndarray[FLOAT64, ndim=2] x,
-              cnp.ndarray[FLOAT64, ndim=2] xsinv,
-              cnp.ndarray[FLOAT64, ndim=1] ss):
-    """Fit a linear model and compute the residual sum squares
-
-    Parameters
-    ----------
-    y : array (n_cases, n_tests)
-        Dependent Measurement.
-    x : array (n_cases, n_betas)
-        Model matrix for the model.
-    xsinv : array (n_betas, n_cases)
-        xsinv for x.
-    ss : array (n_tests,)
-        Container for output.
-    """
-    cdef unsigned long i
-
-    cdef unsigned long n_tests = y.shape[1]
-    cdef unsigned int n_cases = y.shape[0]
-    cdef unsigned int df_x = xsinv.shape[0]
-    cdef double *betas = <double *>malloc(sizeof(double) * df_x)
-
-    for i in range(n_tests):
-        _lm_betas(y, i, xsinv, betas)
-        ss[i] = _lm_res_ss(y, i, x, df_x, betas)
-
-    free(betas)
-
-
 def t_1samp(cnp.ndarray[FLOAT64, ndim=2] y,
             cnp.ndarray[FLOAT64, ndim=1] out):
     """T-values for 1-sample t-test
@@ -478,6 +260,85 @@ def t_1samp_perm(cnp.ndarray[FLOAT64, ndim=2] y,
             out[i] = 0
 
 
+@cython.cdivision(True)
+def t_1samp_diff_block(FLOAT64[:, ::1] y,
+                       INT64[:, :, ::1] rows1,
+                       INT64[:, :, ::1] rows0,
+                       FLOAT64[:, ::1] out):
+    """T-values for 1-sample t-tests on differences between rows of ``y``
+
+    Equivalent to :func:`t_1samp` on ``y1 - y0``, where each case in ``y1``
+    (``y0``) is the mean of the rows of ``y`` in ``rows1`` (``rows0``), for a
+    block of permutations. ``y`` is processed ``TILE`` tests at a time.
+
+    Parameters
+    ----------
+    y : array (n_rows, n_tests)
+        Dependent Measurement.
+    rows1, rows0 : array of int64 (n_perm, n_cases, n_components)
+        For each permutation and case, the rows of ``y`` whose mean
+        constitutes the case.
+    out : array (n_perm, n_tests)
+        Container for output.
+    """
+    cdef Py_ssize_t i0, j, n_j, k, case, p
+    cdef Py_ssize_t n_tests = y.shape[1]
+    cdef Py_ssize_t n_perm = rows1.shape[0]
+    cdef Py_ssize_t n_cases = rows1.shape[1]
+    cdef double div = (n_cases - 1) * n_cases
+    cdef FLOAT64[::1] y1 = np.empty(TILE)
+    cdef FLOAT64[::1] y0 = np.empty(TILE)
+    cdef FLOAT64[::1] mean = np.empty(TILE)
+    cdef FLOAT64[::1] denom = np.empty(TILE)
+
+    for i0 in range(0, n_tests, TILE):
+        n_j = min(TILE, n_tests - i0)
+        for p in range(n_perm):
+            # mean
+            mean[:] = 0
+            for case in range(n_cases):
+                _mean_rows(y, rows1[p, case], i0, n_j, y1)
+                _mean_rows(y, rows0[p, case], i0, n_j, y0)
+                for j in range(n_j):
+                    mean[j] += y1[j] - y0[j]
+            for j in range(n_j):
+                mean[j] /= n_cases
+            # variance
+            denom[:] = 0
+            for case in range(n_cases):
+                _mean_rows(y, rows1[p, case], i0, n_j, y1)
+                _mean_rows(y, rows0[p, case], i0, n_j, y0)
+                for j in range(n_j):
+                    denom[j] += (y1[j] - y0[j] - mean[j]) ** 2
+            for j in range(n_j):
+                denom[j] /= div
+                denom[j] = denom[j] ** 0.5
+                if denom[j] > 0:
+                    out[p, i0 + j] = mean[j] / denom[j]
+                else:
+                    out[p, i0 + j] = 0
+    return out.base
+
+
+@cython.cdivision(True)
+cdef void _mean_rows(FLOAT64[:, ::1] y, INT64[::1] rows, Py_ssize_t i0,
+                     Py_ssize_t n_j, FLOAT64[::1] out):
+    "Mean of ``y[rows, i0: i0 + n_j]``"
+    cdef Py_ssize_t j, k
+    cdef Py_ssize_t n_rows = rows.shape[0]
+    cdef Py_ssize_t row = rows[0]
+
+    for j in range(n_j):
+        out[j] = y[row, i0 + j]
+    for k in range(1, n_rows):
+        row = rows[k]
+        for j in range(n_j):
+            out[j] += y[row, i0 + j]
+    if n_rows > 1:
+        for j in range(n_j):
+            out[j] /= n_rows
+
+
 def t_ind(cnp.ndarray[FLOAT64, ndim=2] y,
           cnp.ndarray[FLOAT64, ndim=1] out,
           cnp.ndarray[INT8, ndim=1] group):
@@ -5,13 +5,15 @@ import random
 
 import numpy as np
 
-from .._data_obj import NDVar, Var, NestedEffect
+from .._data_obj import NDVar, Var, NestedEffect, dataobj_repr
 from .._utils import intervals
 from . import vector
 
 
 _YIELD_ORIGINAL = 0
 # for testing purposes, yield original order instead of permutations
+RESAMPLE_BLOCK_BYTES = 2**22
+# memory for each block of resampling indexes
 
 
 def _resample_params(N, samples):
@@ -100,7 +102,7 @@ def permute_order(n, samples=10000, replacement=False, unit=None, seed=0):
             raise NotImplementedError("Replacement and units")
         idx_orig = np.arange(n)
         idx_perm = np.empty_like(idx_orig)
-        unit_idxs = [np.flatnonzero(unit == cell) for cell in unit.cells]
+        unit_idxs = list(unit._cell_index.indexes())
         if isinstance(unit, NestedEffect):
             dst_idxs_iter = ((unit_idxs[i] for i in order)
                              for order in permute_order(len(unit_idxs), samples, seed=None))
@@ -173,6 +175,115 @@ def permute_sign_flip(n, samples=10000, seed=0, out=None):
         yield out
 
 
+def permutation_blocks(iterator, block_size):
+    """Collect permutations into blocks
+
+    Parameters
+    ----------
+    iterator : iterator over array
+        Permutation iterator (e.g., from :func:`permute_order`).
+    block_size : int
+        Maximum number of permutations per block.
+
+    Yields
+    ------
+    block : array, shape = (n, ...)
+        Block of ``n <= block_size`` permutations (a new array for each block).
+    """
+    block = None
+    i = 0
+    for perm in iterator:
+        if block is None:
+            block = np.empty((block_size, *perm.shape), perm.dtype)
+        block[i] = perm
+        i += 1
+        if i == block_size:
+            yield block
+            block = None
+            i = 0
+    if i:
+        yield block[:i]
+
+
+def resample_index(n, samples=10000, replacement=False, unit=None, seed=0,
+                   block_size=None):
+    """Generate blocks of indexes to resample ``n`` cases
+
+    Parameters
+    ----------
+    n : int
+        Number of cases.
+    samples : int
+        Number of resampling iterations.
+    replacement : bool
+        whether random samples should be drawn with replacement or without.
+    unit : categorial
+        Factor specifying unit of measurement (e.g. subject). If unit is
+        specified, resampling proceeds by first resampling the categories of
+        unit (with or without replacement) and then shuffling the values
+        within units (no replacement).
+    seed : None | int
+        Seed the random state of :mod:`numpy.random` to make replication
+        possible. None to skip seeding (default 0).
+    block_size : int
+        Maximum number of resampling iterations per block (default is all
+        ``samples`` in one block).
+
+    Yields
+    ------
+    index : array of int  (n_block, n)
+        Each row is one resampling iteration, i.e. ``y[index[i]]`` is the
+        ``i``-th resampled version of ``y``.
+    """
+    n = int(n)
+    samples = int(samples)
+    if samples < 0:
+        raise NotImplementedError("Complete permutation for resampling")
+    if block_size is None:
+        block_size = max(samples, 1)
+    if seed is not None:
+        np.random.seed(seed)
+
+    if unit is None or unit is False:
+        unit_idxs = units = None
+    else:
+        unit_idxs = [np.flatnonzero(index) if index.dtype.kind == 'b' else index
+                     for index in map(np.asarray, unit._cell_index.indexes())]
+        units = None
+        if replacement or isinstance(unit, NestedEffect):
+            # units are exchanged, which requires units of equal size
+            if len(set(map(len, unit_idxs))) > 1:
+                raise NotImplementedError(
+                    "Resampling units of unequal size (%s)" % dataobj_repr(unit))
+            units = np.array(unit_idxs)
+
+    for start in range(0, samples, block_size):
+        n_block = min(block_size, samples - start)
+        if _YIELD_ORIGINAL:
+            yield np.tile(np.arange(n), (n_block, 1))
+        elif unit_idxs is None:
+            if replacement:
+                yield np.random.randint(n, size=(n_block, n))
+            else:
+                yield np.argsort(np.random.random((n_block, n)), 1)
+        elif units is None:
+            index = np.empty((n_block, n), int)
+            for idx in unit_idxs:
+                shuffle = np.argsort(np.random.random((n_block, len(idx))), 1)
+                index[:, idx] = idx[shuffle]
+            yield index
+        else:
+            n_units, unit_size = units.shape
+            if replacement:
+                source = np.random.randint(n_units, size=(n_block, n_units))
+            else:
+                source = np.argsort(np.random.random((n_block, n_units)), 1)
+            shuffle = np.argsort(np.random.random((n_block, n_units, unit_size)), 2)
+            index = np.empty((n_block, n), int)
+            index[:, units] = np.take_along_axis(units[source], shuffle, 2)
+            yield index
+
+
 def resample(y, samples=10000, replacement=False, unit=None, seed=0):
     """
     Generator function to resample a dependent variable (y) multiple times
@@ -210,10 +321,11 @@ def resample(y, samples=10000, replacement=False, unit=None, seed=0):
         raise TypeError("Need Var or NDVar")
 
     out = y.copy('{name}_resampled')
-
-    for index in permute_order(len(out), samples, replacement, unit, seed):
-        out.x[index] = y.x
-        yield out
+    block_size = max(1, RESAMPLE_BLOCK_BYTES // (8 * len(y)))
+    for index_block in resample_index(len(out), samples, replacement, unit, seed, block_size):
+        for index in index_block:
+            np.take(y.x, index, 0, out.x)
+            yield out
 
 
 def random_seeds(samples, seed=0):
@@ -274,25 +386,45 @@ def _sample_xi_by_rejection(n, seed=0):
     return samples
 
 
-def rand_rotation_matrices(n, seed=0):
+def rand_rotation_matrices(n, seed=0, out=None):
     """Function to create random rotation matrices in 3D
 
     Parameters
     ----------
     n : int
         Number of rotation matrices to return.
-    seed : None | int
+    seed : None | int | array of int
         Seed the random state of the relevant randomization module
         (:mod:`random` or :mod:`numpy.random`) to make replication possible.
-        None to skip seeding (default 0).
+        None to skip seeding (default 0). With an array of seeds, generate a
+        block of ``n`` matrices for each seed (the same matrices as with the
+        individual seeds).
+    out : array (n, 3, 3) | array (n_seeds, n, 3, 3)
+        Container for the result.
 
     Returns
     -------
-    rotation : array (n, 3, 3)
+    rotation : array (n, 3, 3) | array (n_seeds, n, 3, 3)
         Sampled rotation matrices.
     """
+    if isinstance(seed, np.ndarray) and seed.ndim:
+        n_seeds = len(seed)
+        angles = np.empty((3, n_seeds, n))
+        for i, seed_i in enumerate(seed):
+            angles[:, i] = _rotation_angles(n, seed_i)
+        if out is None:
+            out = np.empty((n_seeds, n, 3, 3))
+        vector.rotation_matrices(*angles.reshape((3, -1)), out.reshape((-1, 3, 3)))
+        return out
+    if out is None:
+        out = np.empty((n, 3, 3))
+    return vector.rotation_matrices(*_rotation_angles(n, seed), out)
+
+
+def _rotation_angles(n, seed):
+    "Rotation axis (phi, theta) and angle (xi) for :func:`rand_rotation_matrices`"
     np.random.seed(seed)
     phi = np.arccos(np.random.uniform(-1, 1, n))
     theta = np.random.uniform(0, 2 * pi, n)
     xi = _sample_xi_by_rejection(n, seed)
-    return vector.rotation_matrices(phi, theta, xi, np.empty((n, 3, 3)))
+    return phi, theta, xi
@@ -7,11 +7,11 @@ import numpy as np
 from .. import _info, fmtxt
 from .._data_obj import (
     Dataset, Factor, Var, NDVar,
-    asmodel, asndvar, assub,
-    combine, dataobj_repr)
+    asfactor, asmodel, asndvar, assub,
+    dataobj_repr)
 from .._exceptions import DimensionMismatchError
 from . import opt
-from .stats import lm_betas_se_1d
+from .stats import lm_betas_se_1d, lm_betas_se_batch
 from .testnd import ttest_1samp
 from functools import reduce
 
@@ -138,6 +138,10 @@ class LMGroup:
         Tests computed with :meth:`compute_column_ttests`.
     samples : None | int
         Number of samples used to compute tests in :attr:`tests`.
+
+    See Also
+    --------
+    LMGroup.fit : fit the subjects' models and combine them in one step
     """
     def __init__(self, lms):
         # check lms
@@ -168,10 +172,91 @@ class LMGroup:
 
         self.__setstate__({'lms': lms, 'subjects': tuple(subjects)})
 
+    @classmethod
+    def fit(cls, y, model, subject, ds=None, coding='dummy', sub=None):
+        """Fit a separate :class:`LM` for each subject
+
+        Parameters
+        ----------
+        y : NDVar
+            Dependent variable, containing the cases of all subjects.
+        model : Model
+            Model to fit to each subject's data.
+        subject : Factor
+            Subject to which each case belongs.
+        ds : Dataset
+            Optional Dataset providing data for y/model/subject.
+        coding : 'dummy' | 'effect'
+            Model parametrization (default is dummy coding). Vars are centered
+            for effect coding (but not for dummy coding).
+        sub : index
+            Only use part of the data.
+
+        Returns
+        -------
+        lm_group : LMGroup
+            Group level model, with one :class:`LM` for each cell of
+            ``subject``.
+
+        Notes
+        -----
+        If the design matrix is the same for all subjects, all subjects are
+        fit with a single (batched) matrix product.
+        """
+        sub = assub(sub, ds)
+        y = asndvar(y, sub, ds)
+        n_cases = len(y)
+        model = asmodel(model, sub, ds, n_cases)
+        subject = asfactor(subject, sub, ds, n_cases)
+        subjects = subject.cells
+        cell_index = subject._cell_index
+        indexes = list(cell_index.indexes())
+        models = [model[index] for index in indexes]
+        ps = [m._parametrize(coding) for m in models]
+        dims = y.dims[1:]
+        y_repr = dataobj_repr(y)
+        p0 = ps[0]
+        for s, p in zip(subjects[1:], ps[1:]):
+            if p.x.shape[1] != p0.x.shape[1]:
+                raise ValueError(
+                    f"Model for {subjects[0]} and {s} don't match: {p0.x.shape[1]} "
+                    f"and {p.x.shape[1]} columns (all subjects need to have "
+                    f"data in all cells of {dataobj_repr(model)})")
+        if all(p.x.shape == p0.x.shape and np.array_equal(p.x, p0.x) for p in ps[1:]):
+            stack_shape = (len(subjects), p0.x.shape[0], -1)
+            y_stack = cell_index.sort(y.x).reshape(stack_shape)
+            coeffs = np.matmul(p0.projector, y_stack)
+            se = lm_betas_se_batch(y_stack, coeffs, p0)
+        else:
+            coeffs = []
+            se = []
+            for index, p in zip(indexes, ps):
+                y_flat = y.x[index].reshape((len(p.x), -1))
+                coeffs.append(p.projector.dot(y_flat))
+                se.append(lm_betas_se_1d(y_flat, coeffs[-1], p))
+            coeffs = np.stack(coeffs)
+        lms = []
+        for i, s in enumerate(subjects):
+            lm = LM.__new__(LM)
+            lm.__setstate__({
+                'coding': coding, 'coeffs': coeffs[i], 'se': se[i],
+                'model': models[i], 'p': ps[i], 'dims': dims, 'subject': s,
+                'y': y_repr,
+            })
+            lms.append(lm)
+        out = cls.__new__(cls)
+        out.__setstate__({'lms': lms, 'subjects': subjects, 'coeffs': coeffs})
+        return out
+
     def __setstate__(self, state):
         self._lms = state['lms']
         self._subjects = state['subjects']
         self.tests = state.get('tests')
+        # coefficients of all subjects (subject x coefficient x ...)
+        if 'coeffs' in state:
+            self._coeffs = state['coeffs']
+        else:
+            self._coeffs = np.stack([lm._coeffs_flat for lm in self._lms])
         lm = self._lms[0]
         self.dims = lm.dims
         self.coding = lm.coding
@@ -193,8 +278,9 @@ class LMGroup:
 
     def coefficients(self, term):
         "Coefficients for one term as :class:`NDVar`"
-        return NDVar(np.concatenate([lm._coefficient(term) for lm in self._lms]),
-                     ('case',) + self.dims, name=term)
+        index = self._lms[0]._index(term)
+        x = self._coeffs[:, index].reshape((len(self._lms), *self._lms[0]._shape))
+        return NDVar(x, ('case',) + self.dims, name=term)
 
     def coefficients_dataset(self, terms):
         """Coefficients in a :class:`Dataset`
@@ -209,11 +295,12 @@ class LMGroup:
         """
         if isinstance(terms, str):
             terms = (terms,)
-        coeffs = []
-        for term in terms:
-            coeffs.append(self.coefficients(term))
+        lm = self._lms[0]
+        index = [lm._index(term) for term in terms]
+        x = self._coeffs.swapaxes(0, 1)[index]
+        x = x.reshape((len(terms) * len(self._lms), *lm._shape))
         ds = Dataset()
-        ds['coeff'] = combine(coeffs)
+        ds['coeff'] = NDVar(x, ('case',) + self.dims, name='coeff')
         ds['subject'] = Factor(self._subjects, tile=len(terms), random=True)
         ds['term'] = Factor(terms, repeat=len(self._lms))
         return ds
@@ -86,6 +86,45 @@ def corr(y, x, out=None, perm=None):
     return out
 
 
+def corr_z(z_y, z_x, out, perm=None):
+    """Correlation parameter map from standardized data
+
+    Parameters
+    ----------
+    z_y : array, shape = (n_cases, n_tests)
+        Dependent variable, standardized with :func:`standardize`.
+    z_x : array, shape = (n_cases,)
+        Covariate, standardized with :func:`standardize`.
+    out : array, shape = (n_tests,) | (n_permutations, n_tests)
+        Container for the result.
+    perm : array of int, shape = (n_cases,) | (n_permutations, n_cases)
+        Permutation of ``z_x``. With a block of permutations, all correlation
+        maps are computed with a single matrix product.
+    """
+    if perm is not None:
+        z_x = z_x[perm]
+    np.dot(z_x, z_y, out)
+    out /= len(z_y) - 1
+    return out
+
+
+def standardize(y):
+    """Z-score ``y`` along the case axis
+
+    Variables with 0 variance are set to 0, so that their correlation with any
+    other variable is 0.
+    """
+    y = np.asarray(y, np.float64)
+    out = y - y.mean(0)
+    std = out.std(0, ddof=1)
+    if np.ndim(std) == 0:
+        return out / std if std else np.zeros_like(out)
+    nonzero = std > 0
+    out /= np.where(nonzero, std, 1)
+    out *= nonzero
+    return out
+
+
 def lm_betas_se_1d(y, b, p):
     """Regression coefficient standard errors
 
@@ -106,6 +145,25 @@ def lm_betas_se_1d(y, b, p):
     return np.sqrt(var_b, var_b)
 
 
+def lm_betas_se_batch(y, b, p):
+    """Regression coefficient standard errors for a stack of data sharing a model
+
+    Parameters
+    ----------
+    y : array  [n_batch, n_cases, n_tests]
+        Dependent measures.
+    b : array  [n_batch, n_predictors, n_tests]
+        Regression coefficients.
+    p : Parametrization
+        Parametrized model.
+    """
+    v = np.einsum('kij,kij->kj', y, y)
+    v -= np.einsum('kij,kij->kj', np.matmul(p.x, b), y)
+    v /= y.shape[1] - p.x.shape[1]  # Var(e)
+    var_b = v[:, None] * p.g.diagonal()[:, None]
+    return np.sqrt(var_b, var_b)
+
+
 def lm_t(y, p):
     """Calculate t-values for regression coefficients
 
@@ -334,6 +392,47 @@ def t_ind(y, group, out=None, perm=None):
     return out
 
 
+def pairwise_t(y, related=True):
+    """T-values for all pairwise comparisons between groups
+
+    Parameters
+    ----------
+    y : array (..., n_groups, n_cases) | sequence of array
+        Data for each group, with cases on the last axis. For independent
+        samples, a sequence of 1-d arrays of different length is also accepted.
+    related : bool
+        Related measures t-test (cases are matched across groups; default)
+        or independent samples t-test (assuming equal variance).
+
+    Returns
+    -------
+    t : array (..., n_pairs)
+        T-value for each pair of groups ``(i, j)`` with ``i < j``, in the order
+        of :func:`itertools.combinations`.
+    """
+    if isinstance(y, np.ndarray):
+        n_groups = y.shape[-2]
+        i, j = np.triu_indices(n_groups, 1)
+        if related:
+            diffs = y[..., i, :] - y[..., j, :]
+            n = y.shape[-1]
+            return diffs.mean(-1) * np.sqrt(n) / diffs.std(-1, ddof=1)
+        ns = np.full(n_groups, y.shape[-1])
+        means = y.mean(-1)
+        variances = y.var(-1, ddof=1)
+    elif related:
+        return pairwise_t(np.array(y), related)
+    else:
+        n_groups = len(y)
+        i, j = np.triu_indices(n_groups, 1)
+        ns = np.array([len(group) for group in y])
+        means = np.array([np.mean(group) for group in y])
+        variances = np.array([np.var(group, ddof=1) for group in y])
+    df = ns[i] + ns[j] - 2
+    pooled_var = ((ns[i] - 1) * variances[..., i] + (ns[j] - 1) * variances[..., j]) / df
+    return (means[..., i] - means[..., j]) / np.sqrt(pooled_var * (1 / ns[i] + 1 / ns[j]))
+
+
 def ftest_f(p, df_num, df_den):
     "F values for given probabilities."
     p = np.asanyarray(p)
@@ -467,12 +566,12 @@ def variability(y, x, match, spec, pool, cells=None):
         if pool or x is None:
             out = SEM(y, x, match).ci(scale)
         else:
-            out = np.array([SEM(y[x == cell]).ci(scale) for cell in cells])
+            out = np.array([SEM(y[x.index(cell)]).ci(scale) for cell in cells])
     elif kind == 'sem':
         if pool or x is None:
             out = SEM(y, x, match).sem
         else:
-            out = np.array([SEM(y[x == cell]).sem for cell in cells])
+            out = np.array([SEM(y[x.index(cell)]).sem for cell in cells])
 
         if scale != 1:
             out *= scale
@@ -5,7 +5,8 @@ import re
 import numpy as np
 
 from .._data_obj import cellname
-from . import stats
+from .._utils.numpy_utils import index_to_int_array
+from . import opt
 from .contrast import parse
 
 
@@ -22,7 +23,13 @@ np_ufuncs = {'abs': np.abs,
 
 
 class TContrastRel:
-    "Parse a contrast expression and expose methods to apply it"
+    """Parse a contrast expression and expose methods to apply it
+
+    The contrast is compiled into a flat list of instructions that operate on
+    preallocated buffers. Leaf comparisons compute t-values directly from the
+    rows of the data that constitute each cell (:func:`opt.t_1samp_diff_block`),
+    so permutations do not require copying the data.
+    """
 
     def __init__(self, contrast, cells, indexes):
         """Parse a contrast expression and expose methods to apply it
@@ -38,39 +45,195 @@ class TContrastRel:
             Indexes for the data of every cell.
         """
         ast = parse(contrast)
-        n_buffers, cells_in_contrast = _t_contrast_rel_properties(ast)
+        _, cells_in_contrast = _t_contrast_rel_properties(ast)
         pcells, mcells = _t_contrast_rel_expand_cells(cells_in_contrast, cells)
 
+        # compile
+        program = []
+        n_slots = _t_contrast_rel_compile(ast, None, program, 0)
+
         self.contrast = contrast
         self.indexes = indexes
-        self._ast = ast
         self._pcells = pcells
         self._mcells = mcells
-        self._n_buffers = n_buffers
+        self._rows = None
+        self._program = program
+        self.n_slots = n_slots
 
         # data buffers
         self._buffer_shape = None
         self._buffer = None
-        self._y_perm = None
 
     def map(self, y):
         "Apply contrast without retainig data buffers"
-        buff = np.empty((self._n_buffers,) + y.shape[1:])
-        data = _t_contrast_rel_data(y, self.indexes, self._pcells, self._mcells)
-        tmap = _t_contrast_rel(self._ast, data, buff)
-        return tmap
+        shape = y.shape[1:]
+        y = np.ascontiguousarray(y.reshape((len(y), -1)))
+        out = np.empty((1, y.shape[1]))
+        buffer = np.empty((self.n_slots, 1, y.shape[1]))
+        inverse = np.arange(len(y))[None]
+        self._execute(y, inverse, buffer, out)
+        return out.reshape(shape)
 
     def __call__(self, y, out, perm):
-        "Apply contrast to permutation of the data, storing and recycling data buffers"
-        buffer_shape = (self._n_buffers,) + y.shape[1:]
-        if self._buffer_shape != buffer_shape:
-            self._buffer = np.empty(buffer_shape)
-            self._y_perm = np.empty_like(y)
-            self._buffer_shape = buffer_shape
-        self._y_perm[perm] = y
-        data = _t_contrast_rel_data(self._y_perm, self.indexes, self._pcells, self._mcells)
-        tmap = _t_contrast_rel(self._ast, data, self._buffer, out)
-        return tmap
+        """Apply contrast to permutation of the data, storing and recycling data buffers
+
+        Parameters
+        ----------
+        y : array (n_cases, n_tests)
+            Data.
+        out : array (n_tests,) | array (n_perm, n_tests)
+            Container for the t-map (a block of t-maps).
+        perm : array (n_cases,) | array (n_perm, n_cases)
+            Permutation (or block of permutations) of the cases.
+        """
+        if perm.ndim == 1:
+            self(y, out[None], perm[None])
+            return out
+        n_perm, n_tests = len(perm), y.shape[1]
+        shape = self._buffer_shape
+        if shape is None or shape[1] < n_perm or shape[2] != n_tests:
+            self._buffer_shape = (self.n_slots, n_perm, n_tests)
+            self._buffer = np.empty(self._buffer_shape)
+        self._execute(y, np.argsort(perm, 1), self._buffer[:, :n_perm], out)
+        return out
+
+    def _cell_rows(self, n):
+        "Rows of the data for each cell, ``{cell: array (n_cases, n_components)}``"
+        if self._rows is None or self._rows[0] != n:
+            rows = {cell: index_to_int_array(self.indexes[cell], n)[:, None]
+                    for cell in self._pcells}
+            for name, cells_ in self._mcells.items():
+                rows[name] = np.hstack([rows[cell] for cell in cells_])
+            self._rows = (n, rows)
+        return self._rows[1]
+
+    def _execute(self, y, inverse, buffer, out):
+        # data for cell c is y_perm[rows[c]] with y_perm[perm] = y, i.e.
+        # y[inverse[rows[c]]] with inverse = argsort(perm)
+        rows = self._cell_rows(len(y))
+        for instruction in self._program:
+            kind, dst = instruction[:2]
+            target = out if dst is None else buffer[dst]
+            if kind == 'comp':
+                _, _, c1, c0 = instruction
+                rows1 = np.ascontiguousarray(inverse[:, rows[c1]])
+                rows0 = np.ascontiguousarray(inverse[:, rows[c0]])
+                opt.t_1samp_diff_block(y, rows1, rows0, target)
+            elif kind == 'ufunc':
+                _, _, func, src = instruction
+                func(buffer[src], target)
+            elif kind == 'bfunc':
+                _, _, func, src = instruction
+                func(buffer[src], buffer[src + 1], target)
+            else:
+                _, _, func, src, n = instruction
+                func(buffer[src: src + n], axis=0, out=target)
+
+
+class TContrastsRel:
+    """Evaluate several t-contrasts on the same permutations of the data
+
+    Implements the interface for tests with multiple effects (see
+    :meth:`_NDANOVA.preallocate` and :meth:`_NDANOVA.map`): each block of
+    permutations is applied to all contrasts in turn, sharing the permutation
+    index and the data buffers.
+
+    Parameters
+    ----------
+    contrasts : sequence of str
+        Contrast specifications.
+    cells : tuple of cells
+        Cells that occur in the contrasts.
+    indexes : dict {cell: index}
+        Indexes for the data of every cell.
+    """
+
+    def __init__(self, contrasts, cells, indexes):
+        self.contrasts = [TContrastRel(contrast, cells, indexes) for contrast in contrasts]
+        self.n_effects = len(self.contrasts)
+        self.n_slots = max(contrast.n_slots for contrast in self.contrasts)
+        self._t_maps = None
+        self._buffer = None
+
+    def preallocate(self, y_shape, block_size=1):
+        """Pre-allocate an output array container
+
+        Parameters
+        ----------
+        y_shape : tuple
+            Data shape (excluding case).
+        block_size : int
+            Preallocate for blocks of up to ``block_size`` permutations.
+
+        Returns
+        -------
+        t_maps : array (block_size, n_effects, ...)
+            Properly shaped output array. Every time .map() is called, the
+            content of this array will change.
+        """
+        n_tests = int(np.prod(y_shape))
+        self._t_maps = np.empty((self.n_effects, block_size, n_tests))
+        self._buffer = np.empty((self.n_slots, block_size, n_tests))
+        return self._t_maps.swapaxes(0, 1).reshape((block_size, self.n_effects, *y_shape))
+
+    def map(self, y, perms):
+        """Compute all t-maps for a block of permutations
+
+        Parameters
+        ----------
+        y : array (n_cases, n_tests)
+            Data.
+        perms : array (n_perm, n_cases)
+            Block of permutations of the cases.
+        """
+        n_perm = len(perms)
+        inverse = np.argsort(perms, 1)
+        buffer = self._buffer[:, :n_perm]
+        for contrast, t_maps in zip(self.contrasts, self._t_maps):
+            contrast._execute(y, inverse, buffer, t_maps[:n_perm])
+
+
+def _t_contrast_rel_compile(item, dst, program, n_slots):
+    """Compile a t-contrast into a flat list of instructions
+
+    Parameters
+    ----------
+    item : tuple
+        Contrast specification.
+    dst : int | None
+        Buffer slot for the result (``None`` for the output array).
+    program : list
+        Instructions; instructions for ``item`` are appended after those for
+        its arguments.
+    n_slots : int
+        Number of buffer slots already in use.
+
+    Returns
+    -------
+    n_slots : int
+        Number of buffer slots in use after compiling ``item``.
+    """
+    kind = item[0]
+    if kind == 'ufunc':
+        _, func, item_ = item
+        src = n_slots
+        n_slots = _t_contrast_rel_compile(item_, src, program, n_slots + 1)
+        program.append((kind, dst, func, src))
+    elif kind in ('bfunc', 'afunc'):
+        _, func, items_ = item
+        # arguments occupy adjacent slots
+        src = n_slots
+        n_slots += len(items_)
+        for i, item_ in enumerate(items_):
+            n_slots = _t_contrast_rel_compile(item_, src + i, program, n_slots)
+        if kind == 'bfunc':
+            program.append((kind, dst, func, src))
+        else:
+            program.append((kind, dst, func, src, len(items_)))
+    else:
+        _, c1, c0 = item
+        program.append((kind, dst, c1, c0))
+    return n_slots
 
 
 def _t_contrast_rel_properties(item):
@@ -151,41 +314,3 @@ def _t_contrast_rel_expand_cells(cells, all_cells):
             primary_cells.update(base)
 
     return primary_cells, mean_cells
-
-
-def _t_contrast_rel_data(y, indexes, cells, mean_cells):
-    "Create {cell: data} dictionary"
-    data = {cell: y[indexes[cell]] for cell in cells}
-    for name, cells_ in mean_cells.items():
-        cell = cells_[0]
-        x = data[cell].copy()
-        for cell in cells_[1:]:
-            x += data[cell]
-        x /= len(cells_)
-        data[name] = x
-
-    return data
-
-
-def _t_contrast_rel(item, data, buff, out=None):
-    "Execute a t_contrast (recursive)"
-    if item[0] == 'ufunc':
-        _, func, item_ = item
-        tmap = _t_contrast_rel(item_, data, buff[1:], buff[0])
-        tmap = func(tmap, out)
-    elif item[0] == 'bfunc':
-        _, func, items = item
-        tmap1 = _t_contrast_rel(items[0], data, buff[2:], buff[1])
-        tmap2 = _t_contrast_rel(items[1], data, buff[2:], buff[0])
-        tmap = func(tmap1, tmap2, out)
-    elif item[0] == 'afunc':
-        _, func, items_ = item
-        tmaps = buff[:len(items_)]
-        for i, item_ in enumerate(items_):
-            _t_contrast_rel(item_, data, buff[i + 1:], tmaps[i])
-        tmap = func(tmaps, axis=0, out=out)
-    else:
-        _, c1, c0 = item
-        tmap = stats.t_1samp(data[c1] - data[c0], out)
-
-    return tmap
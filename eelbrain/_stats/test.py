@@ -12,13 +12,15 @@ from .._data_obj import (
     ascategorial, asfactor, asnumeric, assub, asvar,
     cellname, dataobj_repr, nice_label,
 )
-from .permutation import resample
+from .._utils import LazyProperty
+from .permutation import resample_index
 from . import stats
 
 
 __test__ = False
 DEFAULT_LEVELS = {.05: '*', .01: '**', .001: '***'}
 DEFAULT_LEVELS_TREND = {.05: '*', .01: '**', .001: '***', .1: '`'}
+BOOTSTRAP_BLOCK_BYTES = 2**24  # memory for each block of resampled data
 
 
 class Correlation:
@@ -791,24 +793,24 @@ def _pairwise(data, within=True, parametric=True, corr='Hochberg',
         statistic = "u"
 
     # perform test
-    _K = []  # kennwerte
-    _P = []
-    _df = []
-    i = 0
+    pairs = list(itertools.combinations(range(k), 2))
     indexes = {}
-    for x in range(k):
-        for y in range(x + 1, k):
-            Y1, Y2 = data[x], data[y]
-            t, p = test_func(Y1, Y2)
+    for i, (x, y) in enumerate(pairs):
+        indexes[(x, y)] = indexes[(y, x)] = i
+    if within:
+        _df = [len(data[x]) - 1 for x, y in pairs]
+    else:
+        _df = [len(data[x]) + len(data[y]) - 2 for x, y in pairs]
+    if parametric:
+        _K = list(stats.pairwise_t([np.asarray(group) for group in data], within))
+        _P = list(scipy.stats.t.sf(np.abs(_K), _df) * 2)
+    else:
+        _K = []  # kennwerte
+        _P = []
+        for x, y in pairs:
+            t, p = test_func(data[x], data[y])
             _K.append(t)
-            if within:
-                _df.append(len(Y1) - 1)
-            else:
-                _df.append(len(Y1) + len(Y2) - 2)
-
             _P.append(p)
-            indexes[(x, y)] = indexes[(y, x)] = i
-            i += 1
     # add stars
     if corr:
         p_adjusted = mcp_adjust(_P, corr)
@@ -991,6 +993,43 @@ def _corr(y, x):
 
 
 class bootstrap_pairwise:
+    """Pairwise related t-tests with a resampling distribution of max(|t|)
+
+    Parameters
+    ----------
+    y : Var
+        Dependent variable.
+    x : categorial
+        Groups to compare.
+    match : categorial
+        Units of measurement (e.g. subjects); values are resampled by
+        resampling units and shuffling ``x`` within units.
+    sub : index
+        Only use part of the data.
+    samples : int
+        Number of resampling iterations.
+    replacement : bool
+        Resample units with replacement.
+    title : str
+        Title for the table.
+    ds : Dataset
+        If a Dataset is given, all data-objects can be specified as names of
+        Dataset variables.
+
+    Attributes
+    ----------
+    t : array  (n_comparisons,)
+        T-values for all pairwise comparisons.
+    t_resampled : array  (samples,)
+        Resampling distribution of max(|t|).
+    resampled : array  (samples + 1, n_cases)
+        ``y`` in all resampling iterations (the first row is the original
+        data). Regenerated from the seed on first access.
+    ordered : array  (samples + 1, n_groups * n_units)
+        Cell means for each ``x`` and ``match`` cell in all iterations.
+    diffs : array  (samples + 1, n_units)
+        Differences for the last comparison in all iterations.
+    """
     def __init__(self, y, x, match=None, sub=None,
                  samples=1000, replacement=True,
                  title="Bootstrapped Pairwise Tests", ds=None):
@@ -998,74 +1037,50 @@ class bootstrap_pairwise:
         y = asvar(y, sub, ds)
         x = asfactor(x, sub, ds)
         assert len(y) == len(x), "data length mismatch"
-        if match is not None:
-            match = ascategorial(match, sub, ds)
-            assert len(match) == len(y), "data length mismatch"
-
-        # prepare data container
-        resampled = np.empty((samples + 1, len(y)))  # sample x subject within category
-        resampled[0] = y.x
-        # fill resampled
-        for i, y_i in enumerate(resample(y, samples, replacement, match), 1):
-            resampled[i] = y_i.x
-        self.resampled = resampled
+        if match is None:
+            raise NotImplementedError("bootstrap_pairwise without match")
+        match = ascategorial(match, sub, ds)
+        assert len(match) == len(y), "data length mismatch"
 
         cells = x.cells
         n_groups = len(cells)
+        match_cell_ids = match.cells
+        group_size = len(match_cell_ids)
+
+        # if there are several values per x%match cell, take the average
+        # index: indexes to transform y.x to [x, match, value]-array
+        index = [np.flatnonzero((x == x_cell) * (match == match_cell))
+                 for x_cell in cells for match_cell in match_cell_ids]
+        index = np.array(index).reshape((n_groups, group_size, -1))
+
+        # original t
+        group_data = y.x[index].mean(-1)
+        t = stats.pairwise_t(group_data)
+
+        # resampled max(|t|)
+        self.t_resampled = np.empty(samples)
+        block_size = max(1, BOOTSTRAP_BLOCK_BYTES // (8 * max(len(y), len(t) * group_size)))
+        i = 0
+        self._resample_args = (len(y), samples, replacement, match, 0, block_size)
+        for index_block in resample_index(*self._resample_args):
+            resampled = y.x[index_block]
+            group_data_block = resampled[:, index].mean(-1)
+            t_block = stats.pairwise_t(group_data_block)
+            np.abs(t_block, t_block).max(1, out=self.t_resampled[i: i + len(t_block)])
+            i += len(t_block)
 
-        if match is not None:
-            # if there are several values per x%match cell, take the average
-            # T: indexes to transform y.x to [x%match, value]-array
-            match_cell_ids = match.cells
-            group_size = len(match_cell_ids)
-            T = None
-            i = 0
-            for x_cell in cells:
-                for match_cell in match_cell_ids:
-                    source_indexes = np.where((x == x_cell) * (match == match_cell))[0]
-                    if T is None:
-                        n_cells = n_groups * group_size
-                        T = np.empty((n_cells, len(source_indexes)), dtype=int)
-                    T[i, :] = source_indexes
-                    i += 1
-
-            if T.shape[1] == 1:
-                T = T[:, 0]
-                ordered = resampled[:, T]
-            else:
-                ordered = resampled[:, T].mean(axis=2)
-            self.ordered = ordered
-
-            # t-tests
-            n_comparisons = sum(range(n_groups))
-            t = np.empty((samples + 1, n_comparisons))
-            comp_names = []
-            one_group = np.arange(group_size)
-            groups = [one_group + i * group_size for i in range(n_groups)]
-            for i, (g1, g2) in enumerate(itertools.combinations(range(n_groups), 2)):
-                group_1 = groups[g1]
-                group_2 = groups[g2]
-                diffs = ordered[:, group_1] - ordered[:, group_2]
-                t[:, i] = (np.mean(diffs, axis=1) * np.sqrt(group_size) /
-                           np.std(diffs, axis=1, ddof=1))
-                comp_names.append(' - '.join((cells[g1], cells[g2])))
-
-            self.diffs = diffs
-            self.t_resampled = np.max(np.abs(t[1:]), axis=1)
-            self.t = t = t[0]
-        else:
-            raise NotImplementedError
-
+        self.t = t
         self._Y = y
         self._X = x
         self._group_names = cells
-        self._group_data = np.array([ordered[0, g] for g in groups])
+        self._group_data = group_data
+        self._index = index
         self._group_size = group_size
         self._df = group_size - 1
         self._match = match
         self._n_samples = samples
         self._replacement = replacement
-        self._comp_names = comp_names
+        self._comp_names = [' - '.join(pair) for pair in itertools.combinations(cells, 2)]
         self._p_parametric = self.test_param(t)
         self._p_boot = self.test_boot(t)
         self.title = title
@@ -1074,10 +1089,27 @@ class bootstrap_pairwise:
         out = ['bootstrap_pairwise(', self._Y.name, self._X.name]
         if self._match:
             out.append('match=%s ' % self._match.name)
-        out.append('saples=%i ' % self._n_samples)
+        out.append('samples=%i ' % self._n_samples)
         out.append('replacement=%s)' % self._replacement)
         return ''.join(out)
 
+    @LazyProperty
+    def resampled(self):
+        # replay resample_index() with the same seed and block size
+        index_blocks = resample_index(*self._resample_args)
+        return np.vstack([self._Y.x[None], *(self._Y.x[block] for block in index_blocks)])
+
+    @LazyProperty
+    def ordered(self):
+        ordered = self.resampled[:, self._index].mean(-1)
+        return ordered.reshape((len(ordered), -1))
+
+    @LazyProperty
+    def diffs(self):
+        g1 = (len(self._group_names) - 2) * self._group_size
+        g2 = g1 + self._group_size
+        return self.ordered[:, g1:g2] - self.ordered[:, g2:]
+
     def __str__(self):
         return str(self.table())
 
@@ -1101,7 +1133,7 @@ class bootstrap_pairwise:
                                                 stars_parametric,
                                                 self._p_boot, stars_boot):
             table.cell(name)
-            table.cell(t, fmt='%.2f')
+            table.cell(fmtxt.stat(t, '%.2f'))
             table.cell(fmtxt.p(p1))
             table.cell(fmtxt.p(pc, stars=s1))
             table.cell(fmtxt.p(p2, stars=s2))
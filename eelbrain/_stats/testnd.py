@@ -23,20 +23,20 @@ n_samples : None | int
 from datetime import datetime, timedelta
 from itertools import chain, repeat
 from math import ceil
-from multiprocessing import Process, Event, SimpleQueue
-from multiprocessing.sharedctypes import RawArray
+from multiprocessing import Array, Process, Event, SimpleQueue
+from multiprocessing.sharedctypes import RawArray, RawValue
 import logging
 import operator
 import os
 import re
 import socket
-from time import time as current_time
+from time import perf_counter, sleep, time as current_time
 from typing import Union
 
 import numpy as np
 import scipy.stats
 from scipy import ndimage
-from tqdm import trange
+from tqdm import tqdm
 
 from .. import fmtxt, _info, _text
 from ..fmtxt import FMText
@@ -50,20 +50,27 @@ from .._data_obj import (
     cellname, combine, dataobj_repr)
 from .._exceptions import OldVersionError, WrongDimension, ZeroVariance
 from .._utils import LazyProperty, user_activity
-from .._utils.numpy_utils import FULL_AXIS_SLICE
+from .._utils.numpy_utils import FULL_AXIS_SLICE, from_sparse_state, sparse_state
 from . import opt, stats, vector
 from .connectivity import Connectivity, find_peaks
-from .connectivity_opt import merge_labels, tfce_increment
+from .connectivity_opt import merge_labels, segment_cluster_max, segment_max, tfce_increment
 from .glm import _nd_anova
 from .permutation import (
-    _resample_params, permute_order, permute_sign_flip, random_seeds,
-    rand_rotation_matrices)
-from .t_contrast import TContrastRel
+    _resample_params, permutation_blocks, permute_order, permute_sign_flip,
+    random_seeds, rand_rotation_matrices)
+from .t_contrast import TContrastRel, TContrastsRel
 from .test import star, star_factor
 from functools import reduce, partial
 
 
 __test__ = False
+# maximum size of the statistic maps for a block of permutations
+PERMUTATION_BLOCK_BYTES = 2 ** 24
+# adaptive permutation tests
+ADAPTIVE_ALPHA = 0.05
+ADAPTIVE_CONFIDENCE = 0.99  # confidence of the p-value intervals
+ADAPTIVE_MIN_SAMPLES = 100  # minimum number of permutations
+ADAPTIVE_CHECK_FACTOR = 1.1  # spacing of the checks of the stopping rule
 
 
 def check_for_vector_dim(y: NDVar) -> None:
@@ -185,6 +192,8 @@ class NDTest:
             return f"a complete set of {self.n_samples} permutations"
         elif self.samples is None:
             return "no permutations"
+        elif getattr(self._first_cdist, 'adaptive', False):
+            return f"{self.n_samples} random permutations (adaptive stopping)"
         else:
             return f"{self.n_samples} random permutations"
 
@@ -383,11 +392,20 @@ class NDTest:
 
     @property
     def n_samples(self):
-        if self.samples == -1:
+        if self.samples == -1 or getattr(self._first_cdist, 'adaptive', False):
             return self._first_cdist.samples
         else:
             return self.samples
 
+    @property
+    def permutation_timing(self):
+        """Time spent in each stage of the permutation test
+
+        ``{stage: (seconds, calls)}``, or ``None`` if the test was computed
+        without ``configure(profile_permutations=True)``.
+        """
+        return getattr(self._first_cdist, 'timing', None)
+
     @property
     def _time_dim(self):
         for dim in self._first_cdist.dims:
@@ -442,6 +460,13 @@ class t_contrast_rel(NDTest):
         disconnected.
     force_permutation: bool
         Conduct permutations regardless of whether there are any clusters.
+    adaptive : bool | scalar
+        Stop drawing permutations as soon as it is clear for all clusters
+        whether they are significant; ``True`` for ``alpha = 0.05``, or a
+        scalar to specify ``alpha``. ``samples`` is then the maximum number of
+        permutations, and ``n_samples`` the number actually used. Requires a
+        cluster-forming threshold (not available for TFCE and threshold-free
+        tests).
     mintime : scalar
         Minimum duration for clusters (in seconds).
     minsource : int
@@ -486,41 +511,27 @@ class t_contrast_rel(NDTest):
     @user_activity
     def __init__(self, y, x, contrast, match=None, sub=None, ds=None, tail=0,
                  samples=0, pmin=None, tmin=None, tfce=False, tstart=None,
-                 tstop=None, parc=None, force_permutation=False, **criteria):
-        if match is None:
-            raise TypeError("The `match` parameter needs to be specified for repeated measures test t_contrast_rel")
-        ct = Celltable(y, x, match, sub, ds=ds, coercion=asndvar, dtype=np.float64)
-        check_for_vector_dim(ct.y)
-        check_variance(ct.y.x)
-
-        # setup contrast
+                 tstop=None, parc=None, force_permutation=False, adaptive=False, **criteria):
+        ct = _t_contrast_rel_celltable(y, x, match, sub, ds)
         t_contrast = TContrastRel(contrast, ct.cells, ct.data_indexes)
-
-        # original data
         tmap = t_contrast.map(ct.y.x)
-
-        n_threshold_params = sum((pmin is not None, tmin is not None, bool(tfce)))
-        if n_threshold_params == 0 and not samples:
-            threshold = cdist = None
-        elif n_threshold_params > 1:
-            raise ValueError("Only one of pmin, tmin and tfce can be specified")
-        else:
-            if pmin is not None:
-                df = len(ct.match.cells) - 1
-                threshold = stats.ttest_t(pmin, df, tail)
-            elif tmin is not None:
-                threshold = abs(tmin)
-            else:
-                threshold = None
-
+        threshold, do_test = _t_contrast_rel_threshold(ct, samples, pmin, tmin, tfce, tail)
+        if do_test:
             cdist = NDPermutationDistribution(
                 ct.y, samples, threshold, tfce, tail, 't', "t-contrast",
-                tstart, tstop, criteria, parc, force_permutation)
+                tstart, tstop, criteria, parc, force_permutation, adaptive)
             cdist.add_original(tmap)
             if cdist.do_permutation:
                 iterator = permute_order(len(ct.y), samples, unit=ct.match)
-                run_permutation(t_contrast, cdist, iterator)
+                block_size = _t_contrast_rel_block_size(cdist, t_contrast.n_slots + 1)
+                run_permutation(t_contrast, cdist, iterator, block_size=block_size)
+        else:
+            cdist = None
+        self._init_result(ct, sub, contrast, tmap, threshold, cdist, tail,
+                          samples, pmin, tmin, tfce, tstart, tstop)
 
+    def _init_result(self, ct, sub, contrast, tmap, threshold, cdist, tail,
+                     samples, pmin, tmin, tfce, tstart, tstop):
         # NDVar map of t-values
         info = _info.for_stat_map('t', threshold, tail=tail, old=ct.y.info)
         t = NDVar(tmap, ct.y.dims[1:], info, 't')
@@ -555,6 +566,149 @@ class t_contrast_rel(NDTest):
         return args
 
 
+@user_activity
+def multi_t_contrast_rel(y, x, contrasts, match=None, sub=None, ds=None, tail=0,
+                         samples=0, pmin=None, tmin=None, tfce=False,
+                         tstart=None, tstop=None, parc=None,
+                         force_permutation=False, adaptive=False, merge=False,
+                         **criteria):
+    """Multiple :class:`t_contrast_rel` tests on the same data
+
+    All contrasts are evaluated on the same permutations of ``y``, so that the
+    data are permuted only once for all tests.
+
+    Parameters
+    ----------
+    y : NDVar
+        Dependent variable.
+    x : categorial
+        Model containing the cells which are compared with the contrasts.
+    contrasts : sequence of str
+        Contrast specifications (see :class:`t_contrast_rel`).
+    match : Factor
+        Match cases for a repeated measures test.
+    sub : None | index-array
+        Perform the test with a subset of the data.
+    ds : None | Dataset
+        If a Dataset is specified, all data-objects can be specified as
+        names of Dataset variables.
+    tail : 0 | 1 | -1
+        Which tail of the t-distribution to consider:
+        0: both (two-tailed);
+        1: upper tail (one-tailed);
+        -1: lower tail (one-tailed).
+    samples : int
+        Number of samples for permutation test (default 0).
+    pmin : None | scalar (0 < pmin < 1)
+        Threshold for forming clusters:  use a t-value equivalent to an
+        uncorrected p-value for a related samples t-test (with df =
+        len(match.cells) - 1).
+    tmin : scalar
+        Threshold for forming clusters as t-value.
+    tfce : bool | scalar
+        Use threshold-free cluster enhancement. Use a scalar to specify the
+        step of TFCE levels (for ``tfce is True``, 0.1 is used).
+    tstart : scalar
+        Start of the time window for the permutation test (default is the
+        beginning of ``y``).
+    tstop : scalar
+        Stop of the time window for the permutation test (default is the
+        end of ``y``).
+    parc : str
+        Collect permutation extrema for all regions of the parcellation of
+        this dimension. For threshold-based test, the regions are
+        disconnected.
+    force_permutation: bool
+        Conduct permutations regardless of whether there are any clusters.
+    adaptive : bool | scalar
+        Stop drawing permutations as soon as it is clear for all clusters
+        in all tests whether they are significant (see
+        :class:`t_contrast_rel`). With ``merge``, significance is assessed
+        relative to the merged distribution. Requires a cluster-forming
+        threshold.
+    merge : bool
+        Correct for multiple comparisons across contrasts: use the maximum
+        across all contrasts in each permutation as permutation distribution
+        for every test (family-wise error rate across tests).
+    mintime : scalar
+        Minimum duration for clusters (in seconds).
+    minsource : int
+        Minimum number of sources per cluster.
+
+    Returns
+    -------
+    results : list of t_contrast_rel
+        One test result for each contrast.
+    """
+    if isinstance(contrasts, str):
+        raise TypeError(f"contrasts={contrasts!r}: need a sequence of contrasts")
+    elif not contrasts:
+        raise ValueError(f"contrasts={contrasts!r}: need at least one contrast")
+    ct = _t_contrast_rel_celltable(y, x, match, sub, ds)
+    test = TContrastsRel(contrasts, ct.cells, ct.data_indexes)
+    tmaps = [t_contrast.map(ct.y.x) for t_contrast in test.contrasts]
+    threshold, do_test = _t_contrast_rel_threshold(ct, samples, pmin, tmin, tfce, tail)
+    if do_test:
+        cdists = []
+        for tmap in tmaps:
+            cdist = NDPermutationDistribution(
+                ct.y, samples, threshold, tfce, tail, 't', "t-contrast",
+                tstart, tstop, criteria, parc, force_permutation or merge,
+                adaptive)
+            cdist.add_original(tmap)
+            cdists.append(cdist)
+        if any(cdist.do_permutation for cdist in cdists):
+            iterator = permute_order(len(ct.y), samples, unit=ct.match)
+            block_size = _t_contrast_rel_block_size(cdists[0], test.n_effects + test.n_slots)
+            run_permutation_me(test, cdists, iterator, block_size, merge)
+            if merge:
+                dist = np.max([cdist.dist for cdist in cdists], 0)
+                for cdist in cdists:
+                    cdist.dist = dist
+    else:
+        cdists = [None] * len(tmaps)
+    results = []
+    for contrast, tmap, cdist in zip(contrasts, tmaps, cdists):
+        res = t_contrast_rel.__new__(t_contrast_rel)
+        res._init_result(ct, sub, contrast, tmap, threshold, cdist, tail,
+                         samples, pmin, tmin, tfce, tstart, tstop)
+        results.append(res)
+    return results
+
+
+def _t_contrast_rel_celltable(y, x, match, sub, ds):
+    if match is None:
+        raise TypeError("The `match` parameter needs to be specified for "
+                        "repeated measures test t_contrast_rel")
+    ct = Celltable(y, x, match, sub, ds=ds, coercion=asndvar, dtype=np.float64)
+    check_for_vector_dim(ct.y)
+    check_variance(ct.y.x)
+    return ct
+
+
+def _t_contrast_rel_threshold(ct, samples, pmin, tmin, tfce, tail):
+    "Cluster forming threshold, and whether a permutation distribution is needed"
+    n_threshold_params = sum((pmin is not None, tmin is not None, bool(tfce)))
+    if n_threshold_params == 0 and not samples:
+        return None, False
+    elif n_threshold_params > 1:
+        raise ValueError("Only one of pmin, tmin and tfce can be specified")
+    elif pmin is not None:
+        df = len(ct.match.cells) - 1
+        return stats.ttest_t(pmin, df, tail), True
+    elif tmin is not None:
+        return abs(tmin), True
+    else:
+        return None, True
+
+
+def _t_contrast_rel_block_size(cdist, n_maps):
+    "Number of permutations per block for ``n_maps`` maps per permutation"
+    n_tests = int(np.prod(cdist.shape))
+    block_size = PERMUTATION_BLOCK_BYTES // (8 * n_tests * n_maps)
+    return max(1, min(cdist.samples, block_size))
+
+
 class corr(NDTest):
     """Mass-univariate correlation
 
@@ -594,6 +748,13 @@ class corr(NDTest):
         Collect permutation extrema for all regions of the parcellation of
         this dimension. For threshold-based test, the regions are
         disconnected.
+    adaptive : bool | scalar
+        Stop drawing permutations as soon as it is clear for all clusters
+        whether they are significant; ``True`` for ``alpha = 0.05``, or a
+        scalar to specify ``alpha``. ``samples`` is then the maximum number of
+        permutations, and ``n_samples`` the number actually used. Requires a
+        cluster-forming threshold (not available for TFCE and threshold-free
+        tests).
     mintime : scalar
         Minimum duration for clusters (in seconds).
     minsource : int
@@ -620,7 +781,7 @@ class corr(NDTest):
     @user_activity
     def __init__(self, y, x, norm=None, sub=None, ds=None, samples=0,
                  pmin=None, rmin=None, tfce=False, tstart=None, tstop=None,
-                 match=None, parc=None, **criteria):
+                 match=None, parc=None, adaptive=False, **criteria):
         sub = assub(sub, ds)
         y = asndvar(y, sub=sub, ds=ds, dtype=np.float64)
         check_for_vector_dim(y)
@@ -666,13 +827,19 @@ class corr(NDTest):
             else:
                 threshold = None
 
+            # standardize y once, so that each block of permutations is a
+            # single matrix product
+            z_y = NDVar(stats.standardize(y.x), y.dims, y.info, y.name)
             cdist = NDPermutationDistribution(
-                y, samples, threshold, tfce, 0, 'r', name,
-                tstart, tstop, criteria, parc)
+                z_y, samples, threshold, tfce, 0, 'r', name,
+                tstart, tstop, criteria, parc, adaptive=adaptive)
             cdist.add_original(rmap)
             if cdist.do_permutation:
                 iterator = permute_order(n, samples, unit=match)
-                run_permutation(stats.corr, cdist, iterator, x.x)
+                map_bytes = 8 * int(np.prod(cdist.shape))
+                block_size = min(samples, max(1, PERMUTATION_BLOCK_BYTES // map_bytes))
+                run_permutation(stats.corr_z, cdist, iterator, stats.standardize(x.x),
+                                block_size=block_size)
 
         # compile results
         info = _info.for_stat_map('r', threshold)
@@ -810,6 +977,13 @@ class ttest_1samp(NDDifferenceTest):
         disconnected.
     force_permutation: bool
         Conduct permutations regardless of whether there are any clusters.
+    adaptive : bool | scalar
+        Stop drawing permutations as soon as it is clear for all clusters
+        whether they are significant; ``True`` for ``alpha = 0.05``, or a
+        scalar to specify ``alpha``. ``samples`` is then the maximum number of
+        permutations, and ``n_samples`` the number actually used. Requires a
+        cluster-forming threshold (not available for TFCE and threshold-free
+        tests).
     mintime : scalar
         Minimum duration for clusters (in seconds).
     minsource : int
@@ -844,7 +1018,7 @@ class ttest_1samp(NDDifferenceTest):
     @user_activity
     def __init__(self, y, popmean=0, match=None, sub=None, ds=None, tail=0,
                  samples=0, pmin=None, tmin=None, tfce=False, tstart=None,
-                 tstop=None, parc=None, force_permutation=False, **criteria):
+                 tstop=None, parc=None, force_permutation=False, adaptive=False, **criteria):
         ct = Celltable(y, match=match, sub=sub, ds=ds, coercion=asndvar, dtype=np.float64)
         check_for_vector_dim(ct.y)
 
@@ -878,9 +1052,11 @@ class ttest_1samp(NDDifferenceTest):
             else:
                 y_perm = ct.y
             n_samples, samples = _resample_params(len(y_perm), samples)
+            if samples < 0:
+                adaptive = False  # stopping would truncate the ordered enumeration
             cdist = NDPermutationDistribution(
                 y_perm, n_samples, threshold, tfce, tail, 't', '1-Sample t-Test',
-                tstart, tstop, criteria, parc, force_permutation)
+                tstart, tstop, criteria, parc, force_permutation, adaptive)
             cdist.add_original(tmap)
             if cdist.do_permutation:
                 iterator = permute_sign_flip(n, samples)
@@ -1017,6 +1193,13 @@ class ttest_ind(NDDifferenceTest):
         disconnected.
     force_permutation: bool
         Conduct permutations regardless of whether there are any clusters.
+    adaptive : bool | scalar
+        Stop drawing permutations as soon as it is clear for all clusters
+        whether they are significant; ``True`` for ``alpha = 0.05``, or a
+        scalar to specify ``alpha``. ``samples`` is then the maximum number of
+        permutations, and ``n_samples`` the number actually used. Requires a
+        cluster-forming threshold (not available for TFCE and threshold-free
+        tests).
     mintime : scalar
         Minimum duration for clusters (in seconds).
     minsource : int
@@ -1070,6 +1253,7 @@ class ttest_ind(NDDifferenceTest):
             tstop: float = None,
             parc: str = None,
             force_permutation: bool = False,
+            adaptive: Union[bool, float] = False,
             **criteria):
         y, y1, y0, c1, c0, match, x_name, c1_name, c0_name = _independent_measures_args(y, x, c1, c0, match, ds, sub)
         check_for_vector_dim(y)
@@ -1095,7 +1279,9 @@ class ttest_ind(NDDifferenceTest):
             else:
                 threshold = None
 
-            cdist = NDPermutationDistribution(y, samples, threshold, tfce, tail, 't', 'Independent Samples t-Test', tstart, tstop, criteria, parc, force_permutation)
+            cdist = NDPermutationDistribution(
+                y, samples, threshold, tfce, tail, 't', 'Independent Samples t-Test',
+                tstart, tstop, criteria, parc, force_permutation, adaptive)
             cdist.add_original(tmap)
             if cdist.do_permutation:
                 iterator = permute_order(n, samples)
@@ -1263,6 +1449,13 @@ class ttest_rel(NDMaskedC1Mixin, NDDifferenceTest):
         disconnected.
     force_permutation: bool
         Conduct permutations regardless of whether there are any clusters.
+    adaptive : bool | scalar
+        Stop drawing permutations as soon as it is clear for all clusters
+        whether they are significant; ``True`` for ``alpha = 0.05``, or a
+        scalar to specify ``alpha``. ``samples`` is then the maximum number of
+        permutations, and ``n_samples`` the number actually used. Requires a
+        cluster-forming threshold (not available for TFCE and threshold-free
+        tests).
     mintime : scalar
         Minimum duration for clusters (in seconds).
     minsource : int
@@ -1304,7 +1497,8 @@ class ttest_rel(NDMaskedC1Mixin, NDDifferenceTest):
     @user_activity
     def __init__(self, y, x, c1=None, c0=None, match=None, sub=None, ds=None,
                  tail=0, samples=0, pmin=None, tmin=None, tfce=False,
-                 tstart=None, tstop=None, parc=None, force_permutation=False, **criteria):
+                 tstart=None, tstop=None, parc=None, force_permutation=False,
+                 adaptive=False, **criteria):
         y1, y0, c1, c0, match, n, x_name, c1, c1_name, c0, c0_name = _related_measures_args(y, x, c1, c0, match, ds, sub)
         check_for_vector_dim(y1)
 
@@ -1328,9 +1522,11 @@ class ttest_rel(NDMaskedC1Mixin, NDDifferenceTest):
                 threshold = None
 
             n_samples, samples = _resample_params(len(diff), samples)
+            if samples < 0:
+                adaptive = False  # stopping would truncate the ordered enumeration
             cdist = NDPermutationDistribution(
                 diff, n_samples, threshold, tfce, tail, 't', 'Related Samples t-Test',
-                tstart, tstop, criteria, parc, force_permutation)
+                tstart, tstop, criteria, parc, force_permutation, adaptive)
             cdist.add_original(tmap)
             if cdist.do_permutation:
                 iterator = permute_sign_flip(n, samples)
@@ -1641,6 +1837,13 @@ class anova(MultiEffectNDTest):
         disconnected.
     force_permutation: bool
         Conduct permutations regardless of whether there are any clusters.
+    adaptive : bool | scalar
+        Stop drawing permutations as soon as it is clear for all clusters
+        whether they are significant; ``True`` for ``alpha = 0.05``, or a
+        scalar to specify ``alpha``. ``samples`` is then the maximum number of
+        permutations, and ``n_samples`` the number actually used. Requires a
+        cluster-forming threshold (not available for TFCE and threshold-free
+        tests).
     mintime : scalar
         Minimum duration for clusters (in seconds).
     minsource : int
@@ -1675,7 +1878,7 @@ class anova(MultiEffectNDTest):
     @user_activity
     def __init__(self, y, x, sub=None, ds=None, samples=0, pmin=None,
                  fmin=None, tfce=False, tstart=None, tstop=None, match=None,
-                 parc=None, force_permutation=False, **criteria):
+                 parc=None, force_permutation=False, adaptive=False, **criteria):
         x_arg = x
         sub_arg = sub
         sub = assub(sub, ds)
@@ -1717,7 +1920,7 @@ class anova(MultiEffectNDTest):
             cdists = [
                 NDPermutationDistribution(
                     y, samples, thresh, tfce, 1, 'f', e.name,
-                    tstart, tstop, criteria, parc, force_permutation)
+                    tstart, tstop, criteria, parc, force_permutation, adaptive)
                 for e, thresh in zip(effects, thresholds)]
 
             # Find clusters in the actual data
@@ -1728,7 +1931,10 @@ class anova(MultiEffectNDTest):
 
             if do_permutation:
                 iterator = permute_order(len(y), samples, unit=match)
-                run_permutation_me(lm, cdists, iterator)
+                # betas for a block take up to (2 * n_cases) maps
+                n_tests = int(np.prod(cdists[0].shape))
+                block_size = PERMUTATION_BLOCK_BYTES // (8 * n_tests * (len(effects) + 2 * len(y)))
+                run_permutation_me(lm, cdists, iterator, max(1, min(samples, block_size)))
 
         # create ndvars
         dims = y.dims[1:]
@@ -1860,6 +2066,13 @@ class Vector(NDDifferenceTest):
         Use Hotelling’s T-Square statistics. By default ``Vector`` test
         chooses this statistic over vector norm. To choose vector norm as
         test statistic try ``use_t2_stat=False``.
+    adaptive : bool | scalar
+        Stop drawing permutations as soon as it is clear for all clusters
+        whether they are significant; ``True`` for ``alpha = 0.05``, or a
+        scalar to specify ``alpha``. ``samples`` is then the maximum number of
+        permutations, and ``n_samples`` the number actually used. Requires a
+        cluster-forming threshold (not available for TFCE and threshold-free
+        tests).
     mintime : scalar
         Minimum duration for clusters (in seconds).
     minsource : int
@@ -1883,11 +2096,14 @@ class Vector(NDDifferenceTest):
     @user_activity
     def __init__(self, y, match=None, sub=None, ds=None,
                  samples=10000, vmin=None, tfce=False, tstart=None,
-                 tstop=None, parc=None, force_permutation=False, use_t2_stat=True, **criteria):
+                 tstop=None, parc=None, force_permutation=False, use_t2_stat=True,
+                 adaptive=False, **criteria):
         ct = Celltable(y, match=match, sub=sub, ds=ds, coercion=asndvar, dtype=np.float64)
 
         n = len(ct.y)
-        cdist = NDPermutationDistribution(ct.y, samples, vmin, tfce, 1, 'norm', 'Vector test', tstart, tstop, criteria, parc, force_permutation)
+        cdist = NDPermutationDistribution(
+            ct.y, samples, vmin, tfce, 1, 'norm', 'Vector test', tstart, tstop,
+            criteria, parc, force_permutation, adaptive)
 
         v_dim = ct.y.dimnames[cdist._vector_ax + 1]
         v_mean = ct.y.mean('case')
@@ -1906,7 +2122,8 @@ class Vector(NDDifferenceTest):
         if cdist.do_permutation:
             iterator = random_seeds(samples)
             vector_perm = partial(self._vector_perm, use_t2_stat=use_t2_stat)
-            run_permutation(vector_perm, cdist, iterator)
+            block_size = self._block_size(cdist, n, samples)
+            run_permutation(vector_perm, cdist, iterator, block_size=block_size)
 
         # store attributes
         NDTest.__init__(self, ct.y, ct.match, sub, samples, tfce, None, cdist, tstart, tstop)
@@ -1936,14 +2153,21 @@ class Vector(NDDifferenceTest):
         return args
 
     @staticmethod
-    def _vector_perm(y, out, seed, use_t2_stat):
+    def _block_size(cdist, n_cases, samples):
+        "Number of permutations to evaluate per call to ``_vector_perm``"
+        n_tests = int(np.prod(cdist.shape))
+        block_bytes = 8 * (n_tests + 9 * n_cases)  # stat-map and rotations
+        return min(samples, max(1, PERMUTATION_BLOCK_BYTES // block_bytes))
+
+    @staticmethod
+    def _vector_perm(y, out, seeds, use_t2_stat):
         n_cases, n_dims, n_tests = y.shape
         assert n_dims == 3
-        rotation = rand_rotation_matrices(n_cases, seed)
+        rotation = rand_rotation_matrices(n_cases, seeds)
         if use_t2_stat:
-            return vector.t2_stat_rotated(y, rotation, out)
+            return vector.t2_stat_rotated_block(y, rotation, out)
         else:
-            return vector.mean_norm_rotated(y, rotation, out)
+            return vector.mean_norm_rotated_block(y, rotation, out)
 
     @staticmethod
     def _vector_t2_map(y):
@@ -2006,6 +2230,13 @@ class VectorDifferenceIndependent(Vector):
         Use Hotelling’s T-Square statistics. By default ``Vector`` test
         chooses this statistic over vector norm. To choose vector norm as
         test statistic try ``use_t2_stat=False``.
+    adaptive : bool | scalar
+        Stop drawing permutations as soon as it is clear for all clusters
+        whether they are significant; ``True`` for ``alpha = 0.05``, or a
+        scalar to specify ``alpha``. ``samples`` is then the maximum number of
+        permutations, and ``n_samples`` the number actually used. Requires a
+        cluster-forming threshold (not available for TFCE and threshold-free
+        tests).
     mintime : scalar
         Minimum duration for clusters (in seconds).
     minsource : int
@@ -2042,13 +2273,16 @@ class VectorDifferenceIndependent(Vector):
     @user_activity
     def __init__(self, y, x, c1=None, c0=None, match=None, sub=None, ds=None,
                  samples=10000, vmin=None, tfce=False, tstart=None,
-                 tstop=None, parc=None, force_permutation=False, use_t2_stat=False, **criteria):
+                 tstop=None, parc=None, force_permutation=False, use_t2_stat=False,
+                 adaptive=False, **criteria):
         y, y1, y0, c1, c0, match, x_name, c1_name, c0_name = _independent_measures_args(y, x, c1, c0, match, ds, sub)
         self.n1 = len(y1)
         self.n0 = len(y0)
         self.n = len(y)
 
-        cdist = NDPermutationDistribution(y, samples, vmin, tfce, 1, 'norm', 'Vector test (independent)', tstart, tstop, criteria, parc, force_permutation)
+        cdist = NDPermutationDistribution(
+            y, samples, vmin, tfce, 1, 'norm', 'Vector test (independent)', tstart,
+            tstop, criteria, parc, force_permutation, adaptive)
 
         self._v_dim = v_dim = y.dimnames[cdist._vector_ax + 1]
         self.c1_mean = y1.mean('case', name=cellname(c1_name))
@@ -2065,7 +2299,8 @@ class VectorDifferenceIndependent(Vector):
         if cdist.do_permutation:
             iterator = random_seeds(samples)
             vector_perm = partial(self._vector_perm, use_t2_stat=use_t2_stat)
-            run_permutation(vector_perm, cdist, iterator, self.n1)
+            block_size = self._block_size(cdist, self.n, samples)
+            run_permutation(vector_perm, cdist, iterator, self.n1, block_size=block_size)
 
         NDTest.__init__(self, y, match, sub, samples, tfce, None, cdist, tstart, tstop)
         self._expand_state()
@@ -2077,31 +2312,21 @@ class VectorDifferenceIndependent(Vector):
             return "Vector test (independent)"
 
     @staticmethod
-    def _vector_perm(y, n1, out, seed, use_t2_stat):
+    def _vector_perm(y, n1, out, seeds, use_t2_stat):
         assert not use_t2_stat
         n_cases, n_dims, n_tests = y.shape
         assert n_dims == 3
-        # randomize directions
-        rotation = rand_rotation_matrices(n_cases, seed)
-        # randomize groups
-        cases = np.arange(n_cases)
-        np.random.shuffle(cases)
-        # group 1
-        mean_1 = np.zeros((n_dims, n_tests))
-        for case in cases[:n1]:
-            mean_1 += np.tensordot(rotation[case], y[case], ((1,), (0,)))
-        mean_1 /= n1
-        # group 0
-        mean_0 = np.zeros((n_dims, n_tests))
-        for case in cases[n1:]:
-            mean_0 += np.tensordot(rotation[case], y[case], ((1,), (0,)))
-        mean_0 /= (n_cases - n1)
-        # difference
-        mean_1 -= mean_0
-        norm = scipy.linalg.norm(mean_1, 2, axis=0)
-        if out is not None:
-            out[:] = norm
-        return norm
+        n_perm = len(seeds)
+        rotation = np.empty((n_perm, n_cases, 3, 3))
+        group = np.zeros((n_perm, n_cases), np.int8)
+        for i, seed in enumerate(seeds):
+            # randomize directions
+            rand_rotation_matrices(n_cases, seed, rotation[i])
+            # randomize groups
+            cases = np.arange(n_cases)
+            np.random.shuffle(cases)
+            group[i, cases[:n1]] = 1
+        return vector.mean_norm_rotated_ind_block(y, rotation, group, n1, out)
 
 
 class VectorDifferenceRelated(NDMaskedC1Mixin, Vector):
@@ -2152,6 +2377,13 @@ class VectorDifferenceRelated(NDMaskedC1Mixin, Vector):
         Use Hotelling’s T-Square statistics. By default ``Vector`` test
         chooses this statistic over vector norm. To choose vector norm as
         test statistic try ``use_t2_stat=False``.
+    adaptive : bool | scalar
+        Stop drawing permutations as soon as it is clear for all clusters
+        whether they are significant; ``True`` for ``alpha = 0.05``, or a
+        scalar to specify ``alpha``. ``samples`` is then the maximum number of
+        permutations, and ``n_samples`` the number actually used. Requires a
+        cluster-forming threshold (not available for TFCE and threshold-free
+        tests).
     mintime : scalar
         Minimum duration for clusters (in seconds).
     minsource : int
@@ -2184,15 +2416,17 @@ class VectorDifferenceRelated(NDMaskedC1Mixin, Vector):
     @user_activity
     def __init__(self, y, x, c1=None, c0=None, match=None, sub=None, ds=None,
                  samples=10000, vmin=None, tfce=False, tstart=None, tstop=None,
-                 parc=None, force_permutation=False, use_t2_stat=True, **criteria):
+                 parc=None, force_permutation=False, use_t2_stat=True, adaptive=False, **criteria):
         y1, y0, c1, c0, match, n, x_name, c1, c1_name, c0, c0_name = _related_measures_args(y, x, c1, c0, match, ds, sub)
         difference = y1 - y0
         difference.name = 'difference'
 
         n_samples, samples = _resample_params(n, samples)
+        if samples < 0:
+            adaptive = False  # stopping would truncate the ordered enumeration
         cdist = NDPermutationDistribution(
             difference, n_samples, vmin, tfce, 1, 'norm', 'Vector test (related)',
-            tstart, tstop, criteria, parc, force_permutation)
+            tstart, tstop, criteria, parc, force_permutation, adaptive)
 
         v_dim = difference.dimnames[cdist._vector_ax + 1]
         v_mean = difference.mean('case')
@@ -2211,7 +2445,8 @@ class VectorDifferenceRelated(NDMaskedC1Mixin, Vector):
         if cdist.do_permutation:
             iterator = random_seeds(n_samples)
             vector_perm = partial(self._vector_perm, use_t2_stat=use_t2_stat)
-            run_permutation(vector_perm, cdist, iterator)
+            block_size = self._block_size(cdist, n, n_samples)
+            run_permutation(vector_perm, cdist, iterator, block_size=block_size)
 
         # store attributes
         NDTest.__init__(self, difference, match, sub, samples, tfce, None, cdist, tstart, tstop)
@@ -2457,6 +2692,8 @@ class StatMapProcessor:
         self.tail = tail
         self.max_axes = max_axes
         self.parc = parc
+        if parc is not None:
+            self._parc_order, self._parc_starts = parc_segments(parc)
 
     def max_stat(self, stat_map):
         if self.tail == 0:
@@ -2465,11 +2702,14 @@ class StatMapProcessor:
             v = stat_map.max(self.max_axes)
         else:
             v = -stat_map.min(self.max_axes)
+        return self._parc_max(v)
 
+    def _parc_max(self, v):
         if self.parc is None:
             return v
-        else:
-            return [v[idx].max() for idx in self.parc]
+        out = np.empty(len(self._parc_starts) - 1)
+        segment_max(v, self._parc_order, self._parc_starts, out)
+        return out
 
 
 class TFCEProcessor(StatMapProcessor):
@@ -2494,10 +2734,7 @@ class TFCEProcessor(StatMapProcessor):
             self._bin_buff, self._int_buff, self._int_buff_flat, self._int_buff_1d,
             self.dh,
         ).max(self.max_axes)
-        if self.parc is None:
-            return v
-        else:
-            return [v[idx].max() for idx in self.parc]
+        return self._parc_max(v)
 
 
 class ClusterProcessor(StatMapProcessor):
@@ -2515,6 +2752,7 @@ class ClusterProcessor(StatMapProcessor):
 
         self._cmap = np.empty(shape, np.uint32)
         self._cmap_flat = flatten(self._cmap, connectivity)
+        self._cmap_1d = flatten_1d(self._cmap)
 
         if tail == 0:
             self._int_buff = np.empty(shape, np.uint32)
@@ -2522,6 +2760,13 @@ class ClusterProcessor(StatMapProcessor):
         else:
             self._int_buff = self._int_buff_flat = None
 
+        if parc is not None:
+            # region-sorted index into the flattened stat-map
+            parc_ax = 0 if max_axes is None else min(set(range(len(shape))).difference(max_axes))
+            index = np.moveaxis(np.arange(self._cmap.size).reshape(shape), parc_ax, 0)
+            segments = parc_segments([index[idx].ravel() for idx in parc])
+            self._parc_order, self._parc_starts = segments
+
     def max_stat(self, stat_map, threshold=None):
         if threshold is None:
             threshold = self.threshold
@@ -2531,16 +2776,10 @@ class ClusterProcessor(StatMapProcessor):
                                self._bin_buff, self._int_buff,
                                self._int_buff_flat)
         if self.parc is not None:
-            v = []
-            for idx in self.parc:
-                clusters_v = ndimage.sum(stat_map[idx], cmap[idx], cids)
-                if len(clusters_v):
-                    if self.tail <= 0:
-                        np.abs(clusters_v, clusters_v)
-                    v.append(clusters_v.max())
-                else:
-                    v.append(0)
-            return v
+            out = np.empty(len(self._parc_starts) - 1)
+            segment_cluster_max(stat_map.ravel(), self._cmap_1d, cids.astype(np.uint32, copy=False),
+                                self._parc_order, self._parc_starts, self.tail <= 0, out)
+            return out
         elif len(cids):
             clusters_v = ndimage.sum(stat_map, cmap, cids)
             if self.tail <= 0:
@@ -2550,6 +2789,27 @@ class ClusterProcessor(StatMapProcessor):
             return 0
 
 
+def parc_segments(parc):
+    """Region-sorted index for segment reductions
+
+    Parameters
+    ----------
+    parc : sequence of index
+        Index for each region.
+
+    Returns
+    -------
+    order : array of int64
+        Concatenated indexes of all regions.
+    starts : array of int64  (n_regions + 1,)
+        Region ``i`` consists of ``order[starts[i]: starts[i + 1]]``.
+    """
+    indexes = [np.atleast_1d(idx) for idx in parc]
+    starts = np.zeros(len(indexes) + 1, np.int64)
+    np.cumsum([len(idx) for idx in indexes], out=starts[1:])
+    return np.concatenate(indexes).astype(np.int64), starts
+
+
 def get_map_processor(kind, *args):
     if kind == 'tfce':
         return TFCEProcessor(*args)
@@ -2561,6 +2821,83 @@ def get_map_processor(kind, *args):
         raise ValueError("kind=%s" % repr(kind))
 
 
+class SequentialStopping:
+    """Sequential Monte Carlo stopping rule for permutation tests
+
+    Permutations can stop as soon as it is clear for every observed statistic
+    whether its p-value is above or below ``alpha``, i.e., when the
+    Clopper-Pearson confidence interval of each p-value excludes ``alpha``.
+    The rule is evaluated at geometrically spaced numbers of permutations
+    (starting at :data:`ADAPTIVE_MIN_SAMPLES`).
+
+    Parameters
+    ----------
+    values : array
+        Observed statistics (compared to the permutation distribution of the
+        maximum statistic).
+    alpha : scalar
+        Significance level.
+    confidence : scalar
+        Confidence level of the p-value intervals.
+    regions : array of int
+        For distributions with parcellation, the region (column of the
+        distribution) of each value. P-values are then resolved both relative
+        to the region's own distribution and relative to the maximum across
+        regions.
+    """
+    def __init__(self, values, alpha=ADAPTIVE_ALPHA, confidence=ADAPTIVE_CONFIDENCE, regions=None):
+        if not 0 < alpha < 1:
+            raise ValueError(f"adaptive={alpha!r}: alpha needs to be between 0 and 1")
+        values = np.asarray(values)
+        self.values = np.unique(values)
+        if regions is None:
+            self.region_values = None
+        else:
+            regions = np.asarray(regions)
+            self.region_values = {region: np.unique(values[regions == region])
+                                  for region in np.unique(regions)}
+        self.alpha = alpha
+        self.confidence = confidence
+        self.next_check = ADAPTIVE_MIN_SAMPLES
+
+    def due(self, n):
+        "Whether the rule is evaluated after ``n`` permutations"
+        return n >= self.next_check
+
+    def done(self, dist):
+        """Check whether all p-values are resolved
+
+        Parameters
+        ----------
+        dist : array, shape = (n, ...)
+            Permutation distribution of the first ``n`` permutations.
+        """
+        n = len(dist)
+        if not self.due(n):
+            return False
+        self.next_check = ceil(n * ADAPTIVE_CHECK_FACTOR)
+        if dist.ndim > 1:
+            if self.region_values is not None:
+                for region, values in self.region_values.items():
+                    if not self._resolved(dist[:, region], values):
+                        return False
+            dist = dist.max(tuple(range(1, dist.ndim)))
+        return self._resolved(dist, self.values)
+
+    def _resolved(self, dist, values):
+        "Whether the p-values of ``values`` in ``dist`` are resolved"
+        n = len(dist)
+        n_larger = n - np.searchsorted(np.sort(dist), values)
+        n_larger = np.unique(n_larger)
+        a = (1 - self.confidence) / 2
+        with np.errstate(invalid='ignore'):
+            lower = scipy.stats.beta.ppf(a, n_larger, n - n_larger + 1)
+            upper = scipy.stats.beta.ppf(1 - a, n_larger + 1, n - n_larger)
+        lower[n_larger == 0] = 0
+        upper[n_larger == n] = 1
+        return bool(np.all((upper < self.alpha) | (lower > self.alpha)))
+
+
 class NDPermutationDistribution:
     """Accumulate information on a cluster statistic.
 
@@ -2584,7 +2921,8 @@ class NDPermutationDistribution:
     tfce_warning = None
 
     def __init__(self, y, samples, threshold, tfce=False, tail=0, meas='?', name=None,
-                 tstart=None, tstop=None, criteria={}, parc=None, force_permutation=False):
+                 tstart=None, tstop=None, criteria={}, parc=None, force_permutation=False,
+                 adaptive=False):
         """Accumulate information on a cluster statistic.
 
         Parameters
@@ -2617,6 +2955,14 @@ class NDPermutationDistribution:
             disconnected.
         force_permutation : bool
             Conduct permutations regardless of whether there are any clusters.
+        adaptive : bool | scalar
+            Stop permutations as soon as the p-values of all clusters are
+            resolved relative to ``alpha`` (see :class:`SequentialStopping`);
+            ``True`` for ``alpha = 0.05``, or a scalar to specify ``alpha``.
+            ``samples`` is then the maximum number of permutations. Only
+            available for cluster-based tests: continuous maps (TFCE and
+            threshold-free tests) almost always contain values whose p-value
+            can not be resolved, so these tests would not stop early.
         """
         assert y.has_case
         assert parc is None or isinstance(parc, str)
@@ -2633,6 +2979,12 @@ class NDPermutationDistribution:
         else:
             kind = 'raw'
 
+        if adaptive and kind != 'cluster':
+            desc = 'TFCE' if kind == 'tfce' else 'tests without cluster-forming threshold'
+            raise ValueError(
+                f"adaptive={adaptive!r}: adaptive stopping is only available for "
+                f"cluster-based tests, not for {desc}")
+
         # vector: will be removed for stat_map
         vector = [d._connectivity_type == 'vector' for d in y.dims[1:]]
         has_vector_ax = any(vector)
@@ -2778,10 +3130,12 @@ class NDPermutationDistribution:
         self.has_original = False
         self.do_permutation = False
         self.dt_perm = None
+        self.timing = None
         self._finalized = False
         self._init_time = current_time()
         self._host = socket.gethostname()
         self.force_permutation = force_permutation
+        self.adaptive = adaptive
 
         from .. import __version__
         self._version = __version__
@@ -2879,6 +3233,50 @@ class NDPermutationDistribution:
         self.dist_array = dist_array
         self.dist = dist
 
+    def _stopping_rule(self):
+        "Stopping rule for adaptive permutation tests (or None)"
+        if not self.adaptive:
+            return
+        alpha = ADAPTIVE_ALPHA if self.adaptive is True else self.adaptive
+        if self._dist_dims is None:
+            region_map = None
+        else:
+            # region (distribution column) of each element of the stat-map
+            parc_ax = next(ax for ax in range(len(self.shape)) if ax not in self._max_axes)
+            region = np.empty(self.shape[parc_ax], int)
+            for i, index in enumerate(self.map_args[3]):
+                region[index] = i
+            region_shape = [1] * len(self.shape)
+            region_shape[parc_ax] = -1
+            region_map = np.broadcast_to(region.reshape(region_shape), self.shape)
+        regions = None
+        if self.n_clusters:
+            values = ndimage.sum(self._original_param_map, self._original_cluster_map, self._cids)
+            values = np.abs(values)
+            if region_map is not None:
+                # regions are disconnected, so each cluster is in one region
+                regions = ndimage.maximum(region_map, self._original_cluster_map, self._cids)
+                regions = np.asarray(regions, int)
+        else:
+            values = ()
+        return SequentialStopping(values, alpha, regions=regions)
+
+    def _stop(self, n):
+        """Discard the distribution beyond the first ``n`` permutations
+
+        Only adaptive tests can stop early; for other tests, fewer than
+        ``samples`` permutations indicate that the computation failed.
+        """
+        if n >= self.samples:
+            return
+        elif not self.adaptive:
+            raise RuntimeError(
+                f"Permutation test incomplete: only {n} of {self.samples} "
+                f"permutations were computed")
+        if self.dist is not None:
+            self.dist = self.dist[:n]
+        self.samples = n
+
     def _aggregate_dist(self, **sub):
         """Aggregate permutation distribution to one value per permutation
 
@@ -2930,13 +3328,19 @@ class NDPermutationDistribution:
             name: getattr(self, name) for name in (
                 'name', 'meas', '_version', '_host', '_init_time',
                 # settings ...
-                'kind', 'threshold', 'tfce', 'tail', 'criteria', 'samples', 'tstart', 'tstop', 'parc',
+                'kind', 'threshold', 'tfce', 'tail', 'criteria', 'samples',
+                'adaptive', 'tstart', 'tstop', 'parc',
                 # data properties ...
                 'dims', 'shape', '_nad_ax', '_vector_ax', '_criteria', '_connectivity',
                 # results ...
-                'dt_original', 'dt_perm', 'n_clusters', '_dist_dims', 'dist', '_original_param_map', '_original_cluster_map', '_cids',
+                'dt_original', 'dt_perm', 'timing', 'n_clusters', '_dist_dims',
+                'dist', '_original_param_map', '_original_cluster_map', '_cids',
             )}
-        state['version'] = 3
+        cluster_map_sparse = sparse_state(self._original_cluster_map)
+        if cluster_map_sparse is not None:
+            state['_original_cluster_map'] = cluster_map_sparse
+            state['_cluster_map_is_sparse'] = True
+        state['version'] = 6
         return state
 
     def __setstate__(self, state):
@@ -2978,6 +3382,12 @@ class NDPermutationDistribution:
             state['_vector_ax'] = None
         if version < 3:
             state['tfce'] = ['kind'] == 'tfce'
+        if version < 5:
+            state['adaptive'] = False
+        if version < 6:
+            state['timing'] = None
+        if state.pop('_cluster_map_is_sparse', False):
+            state['_original_cluster_map'] = from_sparse_state(state['_original_cluster_map'])
 
         for k, v in state.items():
             setattr(self, k, v)
@@ -2987,6 +3397,8 @@ class NDPermutationDistribution:
     def _repr_test_args(self, pmin):
         "Argument representation for TestResult repr"
         args = ['samples=%r' % self.samples]
+        if self.adaptive:
+            args[0] += ' (adaptive)'
         if pmin is not None:
             args.append(f"pmin={pmin!r}")
         elif self.kind == 'tfce':
@@ -3083,7 +3495,7 @@ class NDPermutationDistribution:
         y_flat_shape = x.shape[:ndims] + (n_flat,)
 
         if not raw:
-            return x.reshape(y_flat_shape)
+            return np.ascontiguousarray(x.reshape(y_flat_shape))
 
         n = reduce(operator.mul, y_flat_shape)
         ra = RawArray('d', n)
@@ -3467,6 +3879,13 @@ class NDPermutationDistribution:
                        .strftime('%y-%m-%d %H:%M'))
         l.add_item("Original time:  %s" % timedelta(seconds=round(self.dt_original)))
         l.add_item("Permutation time:  %s" % timedelta(seconds=round(self.dt_perm)))
+        if self.adaptive:
+            l.add_item("Permutations:  %i (adaptive)" % self.samples)
+        if self.timing:
+            sl = l.add_sublist("Permutation stages (summed over processes):")
+            for stage, (t, n) in self.timing.items():
+                if n:
+                    sl.add_item(f"{stage}:  {t:.3f} s ({n} calls, {1000 * t / n:.3f} ms per call)")
         return l
 
 
@@ -3474,6 +3893,11 @@ class _MergedTemporalClusterDist:
     """Merge permutation distributions from multiple tests"""
 
     def __init__(self, cdists):
+        flat_cdists = chain.from_iterable(cdists) if isinstance(cdists[0], list) else cdists
+        if any(d.adaptive for d in flat_cdists):
+            raise ValueError(
+                "Permutation distributions with adaptive stopping can not be "
+                "merged, because each was stopped based on its own distribution")
         if isinstance(cdists[0], list):
             self.effects = [d.name for d in cdists[0]]
             self.samples = cdists[0][0].samples
@@ -3516,21 +3940,42 @@ class _MergedTemporalClusterDist:
         return clusters
 
 
-def distribution_worker(dist_array, dist_shape, in_queue, kill_beacon):
-    "Worker that accumulates values and places them into the distribution"
+def distribution_worker(dist_array, dist_shape, in_queue, kill_beacon, rule,
+                        n_done, stop_beacon, timing):
+    """Worker that accumulates values and places them into the distribution
+
+    Values are received until ``None``; values arriving after ``stop_beacon``
+    has been set are discarded.
+    """
     n = reduce(operator.mul, dist_shape)
     dist = np.frombuffer(dist_array, np.float64, n)
     dist.shape = dist_shape
     samples = dist_shape[0]
-    for i in trange(samples, desc="Permutation test", unit=' permutations',
-                    disable=CONFIG['tqdm']):
-        dist[i] = in_queue.get()
-        if kill_beacon.is_set():
-            return
+    i = 0
+    with tqdm(total=samples, desc="Permutation test", unit=' permutations',
+              disable=CONFIG['tqdm']) as progress:
+        while not kill_beacon.is_set():
+            v = in_queue.get()
+            if v is None:
+                break
+            elif i == samples or stop_beacon.is_set():
+                continue
+            if timing:
+                timing.reset()
+            dist[i] = v
+            i += 1
+            n_done.value = i
+            progress.update()
+            if rule is not None and rule.done(dist[:i]):
+                stop_beacon.set()
+            if timing:
+                timing.lap(timing.DISTRIBUTION)
+    if timing:
+        timing.flush()
 
 
 def permutation_worker(in_queue, out_queue, y, y_flat_shape, stat_map_shape,
-                       test_func, args, map_args, kill_beacon):
+                       test_func, args, map_args, kill_beacon, timing):
     "Worker for 1 sample t-test"
     if CONFIG['nice']:
         os.nice(CONFIG['nice'])
@@ -3539,57 +3984,274 @@ def permutation_worker(in_queue, out_queue, y, y_flat_shape, stat_map_shape,
     y = np.frombuffer(y, np.float64, n).reshape(y_flat_shape)
     stat_map = np.empty(stat_map_shape)
     stat_map_flat = stat_map.ravel()
+    stat_maps = stat_maps_flat = None
     map_processor = get_map_processor(*map_args)
+    if timing:
+        timing.reset()
     while not kill_beacon.is_set():
         perm = in_queue.get()
         if perm is None:
             break
+        elif timing:
+            timing.lap(timing.QUEUE)
+        if isinstance(perm, PermutationBlock):
+            perm = perm.perms
+            n_perm = len(perm)
+            if stat_maps is None or len(stat_maps) < n_perm:
+                stat_maps = np.empty((n_perm, *stat_map_shape))
+                stat_maps_flat = stat_maps.reshape((n_perm, -1))
+            test_func(y, *args, stat_maps_flat[:n_perm], perm)
+            if timing:
+                timing.lap(timing.STAT_MAP)
+            for i in range(n_perm):
+                max_v = map_processor.max_stat(stat_maps[i])
+                if timing:
+                    timing.lap(timing.MAX_STAT)
+                out_queue.put(max_v)
+                if timing:
+                    timing.lap(timing.QUEUE)
+            continue
         test_func(y, *args, stat_map_flat, perm)
+        if timing:
+            timing.lap(timing.STAT_MAP)
         max_v = map_processor.max_stat(stat_map)
+        if timing:
+            timing.lap(timing.MAX_STAT)
         out_queue.put(max_v)
+        if timing:
+            timing.lap(timing.QUEUE)
+    if timing:
+        timing.flush()
 
 
-def run_permutation(test_func, dist, iterator, *args):
-    if CONFIG['n_workers']:
-        workers, out_queue, kill_beacon = setup_workers(test_func, dist, args)
+class PermutationBlock:
+    "Block of permutations sent to a permutation worker"
+    def __init__(self, perms):
+        self.perms = perms
 
-        try:
-            for perm in iterator:
-                out_queue.put(perm)
-
-            for _ in range(len(workers) - 1):
-                out_queue.put(None)
-
-            logger = logging.getLogger(__name__)
-            for w in workers:
-                w.join()
-                logger.debug("worker joined")
-        except KeyboardInterrupt:
-            kill_beacon.set()
-            raise
+
+class PermutationTiming:
+    """Accumulate the time spent in the stages of a permutation test
+
+    Each process records the time since its previous :meth:`lap` for the
+    current stage; with ``shared=True``, :meth:`flush` adds these local
+    timings to counters shared across worker processes.
+
+    Parameters
+    ----------
+    shared : bool
+        Collect timings from multiple processes.
+    """
+    STAGES = ('permutations', 'stat map', 'max statistic', 'queue', 'distribution')
+    PERMUTATIONS, STAT_MAP, MAX_STAT, QUEUE, DISTRIBUTION = range(5)
+
+    def __init__(self, shared=False):
+        n = len(self.STAGES)
+        self.times = np.zeros(n)
+        self.counts = np.zeros(n, np.int64)
+        if shared:
+            self._shared_times = Array('d', n)
+            self._shared_counts = Array('l', n)
+        else:
+            self._shared_times = self._shared_counts = None
+        self._t = perf_counter()
+
+    def reset(self):
+        "Start timing the next stage"
+        self._t = perf_counter()
+
+    def lap(self, stage, count=1):
+        "Attribute the time since the last call to ``stage`` (``count`` calls)"
+        t = perf_counter()
+        self.times[stage] += t - self._t
+        self.counts[stage] += count
+        self._t = t
+
+    def flush(self):
+        "Add local timings to the shared counters"
+        if self._shared_times is None:
+            return
+        with self._shared_times.get_lock():
+            for i in range(len(self.STAGES)):
+                self._shared_times[i] += self.times[i]
+                self._shared_counts[i] += int(self.counts[i])
+        self.times.fill(0)
+        self.counts.fill(0)
+
+    def result(self):
+        "Timings as ``{stage: (seconds, count)}``"
+        self.flush()
+        if self._shared_times is None:
+            times, counts = self.times, self.counts
+        else:
+            times, counts = self._shared_times, self._shared_counts
+        return {stage: (float(times[i]), int(counts[i])) for i, stage in enumerate(self.STAGES)}
+
+    def iterate(self, iterator):
+        "Attribute time spent generating items from ``iterator`` to the permutations stage"
+        self.reset()
+        for item in iterator:
+            self.lap(self.PERMUTATIONS)
+            yield item
+            self.reset()
+
+
+def permutation_timing(shared):
+    "Timing object for the next permutation test (or None if not profiling)"
+    if CONFIG['profile_permutations']:
+        return PermutationTiming(shared)
+
+
+def run_permutation(test_func, dist, iterator, *args, block_size=None):
+    """Compute the permutation distribution
+
+    Parameters
+    ----------
+    test_func : callable
+        ``test_func(y, *args, out, perm)``, writing the statistic map for
+        permutation ``perm`` to ``out``.
+    dist : NDPermutationDistribution
+        Distribution to fill.
+    iterator : iterator
+        Permutations.
+    ...
+        Additional arguments for ``test_func``.
+    block_size : int
+        Call ``test_func`` with blocks of up to ``block_size`` permutations:
+        ``perm`` is then an array with one permutation per row, and ``out``
+        has the corresponding number of rows.
+    """
+    rule = dist._stopping_rule()
+    if block_size:
+        if rule is not None:
+            # the stopping rule is evaluated between blocks
+            block_size = min(block_size, ADAPTIVE_MIN_SAMPLES)
+        iterator = permutation_blocks(iterator, block_size)
+    timing = permutation_timing(bool(CONFIG['n_workers']))
+    if timing:
+        iterator = timing.iterate(iterator)
+
+    if CONFIG['n_workers']:
+        workers, queues, kill_beacon, n_done, stop_beacon = setup_workers(
+            test_func, dist, args, rule, timing)
+        if block_size:
+            items = ((PermutationBlock(perms), len(perms)) for perms in iterator)
+        else:
+            items = zip(iterator, repeat(1))
+        run_workers(items, workers, queues, kill_beacon, n_done,
+                    stop_beacon if rule else None, timing)
+        n = n_done.value
     else:
         y = dist.data_for_permutation(False)
         map_processor = get_map_processor(*dist.map_args)
-        stat_map = np.empty(dist.shape)
-        stat_map_flat = stat_map.ravel()
-        for i, perm in enumerate(iterator):
-            test_func(y, *args, stat_map_flat, perm)
-            dist.dist[i] = map_processor.max_stat(stat_map)
+        n = 0
+        if block_size:
+            stat_maps = np.empty((block_size, *dist.shape))
+            stat_maps_flat = stat_maps.reshape((block_size, -1))
+            for perms in iterator:
+                n_perm = len(perms)
+                test_func(y, *args, stat_maps_flat[:n_perm], perms)
+                if timing:
+                    timing.lap(timing.STAT_MAP)
+                for stat_map in stat_maps[:n_perm]:
+                    dist.dist[n] = map_processor.max_stat(stat_map)
+                    n += 1
+                    if timing:
+                        timing.lap(timing.MAX_STAT)
+                if rule is not None and rule.done(dist.dist[:n]):
+                    break
+                if timing:
+                    timing.lap(timing.DISTRIBUTION, n_perm)
+        else:
+            stat_map = np.empty(dist.shape)
+            stat_map_flat = stat_map.ravel()
+            for perm in iterator:
+                test_func(y, *args, stat_map_flat, perm)
+                if timing:
+                    timing.lap(timing.STAT_MAP)
+                dist.dist[n] = map_processor.max_stat(stat_map)
+                n += 1
+                if timing:
+                    timing.lap(timing.MAX_STAT)
+                if rule is not None and rule.done(dist.dist[:n]):
+                    break
+                if timing:
+                    timing.lap(timing.DISTRIBUTION)
+    dist._stop(n)
+    if timing:
+        dist.timing = timing.result()
     dist.finalize()
 
 
-def setup_workers(test_func, dist, func_args):
+def run_workers(items, workers, queues, kill_beacon, n_done, stop_beacon=None, timing=None):
+    """Feed permutations to worker processes and wait for them to finish
+
+    Parameters
+    ----------
+    items : iterator over (item, int)
+        Items for the permutation workers, and the number of permutations
+        each item contains.
+    workers : list of Process
+        Permutation workers, followed by the distribution worker.
+    queues : tuple of SimpleQueue
+        Input queues of the permutation workers and the distribution worker.
+    kill_beacon : Event
+        Event to stop all workers.
+    n_done : RawValue
+        Number of permutations received by the distribution worker.
+    stop_beacon : Event
+        For adaptive tests, event set by the distribution worker when the
+        distribution is complete. Permutations are then fed only as the
+        workers can process them.
+    timing : PermutationTiming
+        Record time spent feeding the permutation queue.
+    """
+    permutation_queue, dist_queue = queues
+    n_workers = len(workers) - 1
+    logger = logging.getLogger(__name__)
+    try:
+        n_put = 0
+        for item, n in items:
+            if stop_beacon is not None:
+                while n_put - n_done.value >= 2 * n_workers * n and not stop_beacon.is_set():
+                    sleep(0.001)
+                if stop_beacon.is_set():
+                    break
+                if timing:
+                    timing.reset()
+            permutation_queue.put(item)
+            n_put += n
+            if timing:
+                timing.lap(timing.QUEUE)
+
+        for _ in range(n_workers):
+            permutation_queue.put(None)
+        for w in workers[:-1]:
+            w.join()
+            logger.debug("worker joined")
+        # all permutation results are in the queue
+        dist_queue.put(None)
+        workers[-1].join()
+        logger.debug("distribution worker joined")
+    except KeyboardInterrupt:
+        kill_beacon.set()
+        raise
+
+
+def setup_workers(test_func, dist, func_args, rule, timing=None):
     "Initialize workers for permutation tests"
     logger = logging.getLogger(__name__)
     logger.debug("Setting up %i worker processes..." % CONFIG['n_workers'])
     permutation_queue = SimpleQueue()
     dist_queue = SimpleQueue()
     kill_beacon = Event()
+    stop_beacon = Event()
+    n_done = RawValue('l', 0)
 
     # permutation workers
     y, y_flat_shape, stat_map_shape = dist.data_for_permutation()
     args = (permutation_queue, dist_queue, y, y_flat_shape, stat_map_shape,
-            test_func, func_args, dist.map_args, kill_beacon)
+            test_func, func_args, dist.map_args, kill_beacon, timing)
     workers = []
     for _ in range(CONFIG['n_workers']):
         w = Process(target=permutation_worker, args=args)
@@ -3597,77 +4259,116 @@ def setup_workers(test_func, dist, func_args):
         workers.append(w)
 
     # distribution worker
-    args = (dist.dist_array, dist.dist_shape, dist_queue, kill_beacon)
+    args = (dist.dist_array, dist.dist_shape, dist_queue, kill_beacon, rule,
+            n_done, stop_beacon, timing)
     w = Process(target=distribution_worker, args=args)
     w.start()
     workers.append(w)
 
-    return workers, permutation_queue, kill_beacon
+    return workers, (permutation_queue, dist_queue), kill_beacon, n_done, stop_beacon
+
 
+def run_permutation_me(test, dists, iterator, block_size=1, merge=False):
+    """Compute permutation distributions for a test with multiple effects
 
-def run_permutation_me(test, dists, iterator):
+    Parameters
+    ----------
+    test : _NDANOVA
+        Test object (see :meth:`_NDANOVA.map`).
+    dists : list of NDPermutationDistribution
+        Distribution to fill for each effect.
+    iterator : iterator
+        Permutations.
+    block_size : int
+        Number of permutations to evaluate with each call to ``test.map``.
+    merge : bool
+        The distributions will be merged (maximum across effects), so adaptive
+        stopping rules are evaluated on the merged distribution.
+    """
     dist = dists[0]
     if dist.kind == 'cluster':
         thresholds = tuple(d.threshold for d in dists)
     else:
         thresholds = None
+    rules = [d._stopping_rule() if d.do_permutation else None for d in dists]
+    adaptive = any(rules)
+    if adaptive:
+        # the stopping rules are evaluated between blocks
+        block_size = min(block_size, ADAPTIVE_MIN_SAMPLES)
+    iterator = permutation_blocks(iterator, block_size)
+    timing = permutation_timing(bool(CONFIG['n_workers']))
+    if timing:
+        iterator = timing.iterate(iterator)
 
     if CONFIG['n_workers']:
-        workers, out_queue, kill_beacon = setup_workers_me(test, dists, thresholds)
-
-        try:
-            for perm in iterator:
-                out_queue.put(perm)
-
-            for _ in range(len(workers) - 1):
-                out_queue.put(None)
-
-            logger = logging.getLogger(__name__)
-            for w in workers:
-                w.join()
-                logger.debug("worker joined")
-        except KeyboardInterrupt:
-            kill_beacon.set()
-            raise
+        workers, queues, kill_beacon, n_done, stop_beacon = setup_workers_me(
+            test, dists, thresholds, block_size, rules, merge, timing)
+        items = ((perms, len(perms)) for perms in iterator)
+        run_workers(items, workers, queues, kill_beacon, n_done,
+                    stop_beacon if adaptive else None, timing)
+        n = n_done.value
     else:
         y = dist.data_for_permutation(False)
         map_processor = get_map_processor(*dist.map_args)
 
-        stat_maps = test.preallocate(dist.shape)
-        if thresholds:
-            stat_maps_iter = tuple(zip(stat_maps, thresholds, dists))
-        else:
-            stat_maps_iter = tuple(zip(stat_maps, dists))
-
-        for i, perm in enumerate(iterator):
-            test.map(y, perm)
-            if thresholds:
-                for m, t, d in stat_maps_iter:
-                    if d.do_permutation:
-                        d.dist[i] = map_processor.max_stat(m, t)
-            else:
-                for m, d in stat_maps_iter:
-                    if d.do_permutation:
-                        d.dist[i] = map_processor.max_stat(m)
+        stat_maps = test.preallocate(dist.shape, block_size)
+        n = 0
+        for perms in iterator:
+            test.map(y, perms)
+            if timing:
+                timing.lap(timing.STAT_MAP)
+            for block_maps in stat_maps[:len(perms)]:
+                if thresholds:
+                    for m, t, d in zip(block_maps, thresholds, dists):
+                        if d.do_permutation:
+                            d.dist[n] = map_processor.max_stat(m, t)
+                else:
+                    for m, d in zip(block_maps, dists):
+                        if d.do_permutation:
+                            d.dist[n] = map_processor.max_stat(m)
+                n += 1
+                if timing:
+                    timing.lap(timing.MAX_STAT)
+            if adaptive and all_done(rules, [d.dist for d in dists], n, merge):
+                break
+            if timing:
+                timing.lap(timing.DISTRIBUTION, len(perms))
 
+    timing_result = timing.result() if timing else None
     for d in dists:
+        d._stop(n)
         if d.do_permutation:
+            d.timing = timing_result
             d.finalize()
 
 
-def setup_workers_me(test_func, dists, thresholds):
+def all_done(rules, dists, n, merge=False):
+    "Check the stopping rules of multiple distributions after ``n`` permutations"
+    if not any(rule.due(n) for rule in rules if rule is not None):
+        return False
+    elif merge:
+        merged = np.max([dist[:n] for dist in dists if dist is not None], 0)
+        dists = [merged] * len(dists)
+    # evaluate all rules to keep their schedules aligned
+    done = [rule.done(dist[:n]) for rule, dist in zip(rules, dists) if rule is not None]
+    return all(done)
+
+
+def setup_workers_me(test_func, dists, thresholds, block_size, rules, merge=False, timing=None):
     "Initialize workers for permutation tests"
     logger = logging.getLogger(__name__)
     logger.debug("Setting up %i worker processes..." % CONFIG['n_workers'])
     permutation_queue = SimpleQueue()
     dist_queue = SimpleQueue()
     kill_beacon = Event()
+    stop_beacon = Event()
+    n_done = RawValue('l', 0)
 
     # permutation workers
     dist = dists[0]
     y, y_flat_shape, stat_map_shape = dist.data_for_permutation()
     args = (permutation_queue, dist_queue, y, y_flat_shape, stat_map_shape,
-            test_func, dist.map_args, thresholds, kill_beacon)
+            test_func, dist.map_args, thresholds, block_size, kill_beacon, timing)
     workers = []
     for _ in range(CONFIG['n_workers']):
         w = Process(target=permutation_worker_me, args=args)
@@ -3675,53 +4376,81 @@ def setup_workers_me(test_func, dists, thresholds):
         workers.append(w)
 
     # distribution worker
-    args = ([d.dist_array for d in dists], dist.dist_shape, dist_queue, kill_beacon)
+    args = ([d.dist_array for d in dists], dist.dist_shape, dist_queue,
+            kill_beacon, rules, merge, n_done, stop_beacon, timing)
     w = Process(target=distribution_worker_me, args=args)
     w.start()
     workers.append(w)
 
-    return workers, permutation_queue, kill_beacon
+    return workers, (permutation_queue, dist_queue), kill_beacon, n_done, stop_beacon
 
 
 def permutation_worker_me(in_queue, out_queue, y, y_flat_shape, stat_map_shape,
-                          test, map_args, thresholds, kill_beacon):
+                          test, map_args, thresholds, block_size, kill_beacon,
+                          timing):
     if CONFIG['nice']:
         os.nice(CONFIG['nice'])
 
     n = reduce(operator.mul, y_flat_shape)
     y = np.frombuffer(y, np.float64, n).reshape(y_flat_shape)
-    iterator = test.preallocate(stat_map_shape)
-    if thresholds:
-        iterator = tuple(zip(iterator, thresholds))
-    else:
-        iterator = tuple(iterator)
+    stat_maps = test.preallocate(stat_map_shape, block_size)
     map_processor = get_map_processor(*map_args)
+    if timing:
+        timing.reset()
     while not kill_beacon.is_set():
-        perm = in_queue.get()
-        if perm is None:
+        perms = in_queue.get()
+        if perms is None:
             break
-        test.map(y, perm)
-
-        if thresholds:
-            max_v = [map_processor.max_stat(m, t) for m, t in iterator]
-        else:
-            max_v = [map_processor.max_stat(m) for m in iterator]
-        out_queue.put(max_v)
-
+        elif timing:
+            timing.lap(timing.QUEUE)
+        test.map(y, perms)
+        if timing:
+            timing.lap(timing.STAT_MAP)
 
-def distribution_worker_me(dist_arrays, dist_shape, in_queue, kill_beacon):
-    "Worker that accumulates values and places them into the distribution"
+        for block_maps in stat_maps[:len(perms)]:
+            if thresholds:
+                max_v = [map_processor.max_stat(m, t) for m, t in zip(block_maps, thresholds)]
+            else:
+                max_v = [map_processor.max_stat(m) for m in block_maps]
+            if timing:
+                timing.lap(timing.MAX_STAT)
+            out_queue.put(max_v)
+            if timing:
+                timing.lap(timing.QUEUE)
+    if timing:
+        timing.flush()
+
+
+def distribution_worker_me(dist_arrays, dist_shape, in_queue, kill_beacon,
+                           rules, merge, n_done, stop_beacon, timing):
+    "Worker that accumulates values and places them into the distributions"
     n = reduce(operator.mul, dist_shape)
     dists = [d if d is None else np.frombuffer(d, np.float64, n).reshape(dist_shape)
              for d in dist_arrays]
     samples = dist_shape[0]
-    for i in trange(samples, desc="Permutation test", unit=' permutations',
-                    disable=CONFIG['tqdm']):
-        for dist, v in zip(dists, in_queue.get()):
-            if dist is not None:
-                dist[i] = v
-        if kill_beacon.is_set():
-            return
+    i = 0
+    with tqdm(total=samples, desc="Permutation test", unit=' permutations',
+              disable=CONFIG['tqdm']) as progress:
+        while not kill_beacon.is_set():
+            vs = in_queue.get()
+            if vs is None:
+                break
+            elif i == samples or stop_beacon.is_set():
+                continue
+            if timing:
+                timing.reset()
+            for dist, v in zip(dists, vs):
+                if dist is not None:
+                    dist[i] = v
+            i += 1
+            n_done.value = i
+            progress.update()
+            if any(rules) and all_done(rules, dists, i, merge):
+                stop_beacon.set()
+            if timing:
+                timing.lap(timing.DISTRIBUTION)
+    if timing:
+        timing.flush()
 
 
 # Backwards compatibility for pickling
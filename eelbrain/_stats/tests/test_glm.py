@@ -7,7 +7,7 @@ import numpy as np
 from numpy import newaxis
 from numpy.testing import assert_allclose
 
-from eelbrain import datasets, test, testnd, Dataset, NDVar
+from eelbrain import datasets, test, testnd, Dataset, NDVar, Var
 from eelbrain._data_obj import UTS
 from eelbrain._exceptions import IncompleteModel
 from eelbrain._stats import glm
@@ -225,6 +225,29 @@ def test_anova_perm():
         aov.map(y_perm)
         assert_allclose(r2, r1, 1e-6, 1e-6)
 
+    # blocks of permutations
+    ds = datasets.get_uts(nrm=True)
+    for x, sub in (('A*B', None), ('A*B*rm', None), ('A*B*nrm(A)', None),
+                   ('A + B', None), ('A*B', np.arange(1, 60))):
+        y = ds['uts'].x if sub is None else ds['uts'].x[sub]
+        model = ds.eval(x) if sub is None else ds[sub].eval(x)
+        y_perm = np.empty_like(y)
+        n_cases = len(y)
+        aov = glm._nd_anova(model)
+        perms = np.array([perm.copy() for perm in permute_order(n_cases, 3)])
+        f_maps = aov.map(y, perms)
+        for perm, f_map in zip(perms, f_maps):
+            assert_allclose(f_map, aov.map(y, perm))
+            # compare with univariate ANOVA (scipy lstsq)
+            y_perm[perm] = y
+            for i in range(0, y.shape[1], 25):
+                res = glm.ANOVA(Var(y_perm[:, i]), model)
+                fs = dict(zip(res.effects, (f_test.F for f_test in res.f_tests)))
+                assert_allclose(f_map[:, i], [fs[e.name] for e in aov.effects], 1e-10)
+        r_block = aov.preallocate(y.shape[1:], 4)
+        aov.map(y, perms)
+        assert_allclose(r_block[:3], f_maps)
+
 
 def test_anova_r_adler():
     """Test ANOVA accuracy by comparing with R (Adler dataset of car package)
@@ -1,10 +1,10 @@
 # Author: Christian Brodbeck <christianbrodbeck@nyu.edu>
 import numpy as np
 import scipy.stats
-from numpy.testing import assert_allclose
+from numpy.testing import assert_allclose, assert_array_equal
 from eelbrain import datasets
-from eelbrain._stats import opt
-from eelbrain._stats.permutation import permute_sign_flip
+from eelbrain._stats import opt, vector
+from eelbrain._stats.permutation import permute_sign_flip, rand_rotation_matrices
 
 
 def test_t_1samp():
@@ -25,3 +25,33 @@ def test_t_1samp():
         opt.t_1samp_perm(y, t_perm, sign)
         opt.t_1samp(y * sign[:,None], t)
         assert_allclose(t_perm, t)
+
+
+def test_vector_block():
+    "Test vector functions for blocks of permutations"
+    ds = datasets.get_uts(vector3d=True)
+    y = ds['v3d'].get_data(('case', 'space', 'time'))
+    n_cases, _, n_tests = y.shape
+    seeds = np.arange(4, dtype=np.uint32)
+    rotation = rand_rotation_matrices(n_cases, seeds)
+    for seed, r in zip(seeds, rotation):
+        assert_array_equal(r, rand_rotation_matrices(n_cases, seed))
+
+    out = np.empty((len(seeds), n_tests))
+    vector.t2_stat_rotated_block(y, rotation, out)
+    for r, o in zip(rotation, out):
+        assert_array_equal(o, vector.t2_stat_rotated(y, r, np.empty(n_tests)))
+    vector.mean_norm_rotated_block(y, rotation, out)
+    for r, o in zip(rotation, out):
+        assert_array_equal(o, vector.mean_norm_rotated(y, r, np.empty(n_tests)))
+
+    # independent samples
+    n1 = 20
+    group = np.zeros((len(seeds), n_cases), np.int8)
+    for g in group:
+        g[np.random.permutation(n_cases)[:n1]] = 1
+    vector.mean_norm_rotated_ind_block(y, rotation, group, n1, out)
+    for r, g, o in zip(rotation, group, out):
+        y_rotated = np.einsum('cij,cjt->cit', r, y)
+        diff = y_rotated[g == 1].mean(0) - y_rotated[g == 0].mean(0)
+        assert_allclose(o, np.linalg.norm(diff, axis=0))
@@ -3,10 +3,11 @@ import sys
 
 from nose.tools import eq_, ok_, assert_not_equal
 import numpy as np
+from numpy.testing import assert_array_equal
 
 from eelbrain import Factor, Var
 from eelbrain._stats.permutation import (
-    resample, permute_order, permute_sign_flip)
+    resample, resample_index, permute_order, permute_sign_flip)
 
 
 def test_permutation():
@@ -36,6 +37,31 @@ def test_permutation():
         [(2, 3, 1, 0), (2, 1, 3, 0), (0, 2, 3, 1)])
 
 
+def test_resample_index():
+    "Test resample_index()"
+    res = np.vstack(list(resample_index(6, 10, block_size=3)))
+    eq_(res.shape, (10, 6))
+    assert_array_equal(np.sort(res, 1), np.tile(np.arange(6), (10, 1)))
+    # reproducible
+    assert_array_equal(np.vstack(list(resample_index(6, 10))), res)
+    # with replacement
+    res = next(resample_index(6, 100, True))
+    ok_(np.any(np.sort(res, 1) != np.arange(6)))
+    # shuffle within units
+    s = Factor('abc', tile=2)
+    res = next(resample_index(6, 100, unit=s))
+    for i in range(6):
+        eq_(set(res[:, i]), {i % 3, i % 3 + 3})
+    # resample units with replacement
+    res = next(resample_index(6, 100, True, unit=s))
+    unit_of = np.arange(6) % 3
+    for row in res:
+        # each unit's cases come from a single unit
+        for i in range(3):
+            eq_(len(set(unit_of[row[[i, i + 3]]])), 1)
+    ok_(any(len(set(unit_of[row])) < 3 for row in res))
+
+
 def test_permutation_sign_flip():
     "Test permute_sign_flip()"
     res = np.empty((2 ** 6 - 1, 6), dtype=np.int8)
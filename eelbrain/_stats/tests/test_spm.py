@@ -1,10 +1,10 @@
 # Author: Christian Brodbeck <christianbrodbeck@nyu.edu>
 import pickle
-from nose.tools import eq_
+from nose.tools import eq_, assert_raises
 import numpy as np
-from numpy.testing import assert_array_equal
+from numpy.testing import assert_allclose, assert_array_equal
 
-from eelbrain import datasets
+from eelbrain import Factor, combine, datasets
 from eelbrain._stats.spm import LM, LMGroup
 
 
@@ -50,3 +50,45 @@ def test_random_lm():
     # persistence
     rlm_p = pickle.loads(pickle.dumps(rlm, pickle.HIGHEST_PROTOCOL))
     eq_(rlm_p.dims, rlm.dims)
+
+
+def test_lm_group_fit():
+    ds = datasets.get_uts()
+    ds['C'] = Factor('abc', tile=20)
+    rng = np.random.RandomState(0)
+    dss = []
+    for subject in ('s1', 's2', 's3', 's4'):
+        ds_ = ds.copy()
+        ds_['uts'] = ds['uts'].copy()
+        ds_['uts'].x += rng.normal(0, 2, ds['uts'].shape)
+        ds_['subject'] = Factor([subject], repeat=ds.n_cases)
+        dss.append(ds_)
+    ds_all = combine(dss)
+    for coding in ('dummy', 'effect'):
+        rlm = LMGroup.fit('uts', 'A*B*Y', 'subject', ds_all, coding)
+        rlm_ = LMGroup([LM('uts', 'A*B*Y', ds_, coding, subject)
+                        for ds_, subject in zip(dss, rlm._subjects)])
+        eq_(repr(rlm), repr(rlm_))
+        for term in rlm.column_names:
+            assert_allclose(rlm.coefficients(term).x, rlm_.coefficients(term).x)
+            for lm, lm_ in zip(rlm._lms, rlm_._lms):
+                assert_allclose(lm.t(term).x, lm_.t(term).x)
+        ds_c = rlm.coefficients_dataset(('A', 'A x B'))
+        ds_c_ = rlm_.coefficients_dataset(('A', 'A x B'))
+        assert_allclose(ds_c['coeff'].x, ds_c_['coeff'].x)
+        assert_array_equal(ds_c['subject'], ds_c_['subject'])
+        assert_array_equal(ds_c['term'], ds_c_['term'])
+
+    # subjects with different designs
+    ds_all = ds_all.sub("~((subject == 's2') & (rm == 'R00'))")
+    rlm = LMGroup.fit('uts', 'A*B*Y', 'subject', ds_all)
+    lm_ = LM('uts', 'A*B*Y', ds_all.sub("subject == 's2'"))
+    assert_allclose(rlm._lms[1].coefficient('A').x, lm_.coefficient('A').x)
+    assert rlm._lms[1].n_cases == lm_.n_cases
+    # subject missing a cell
+    ds_all = ds_all.sub("~((subject == 's3') & (C == 'c'))")
+    assert_raises(ValueError, LMGroup.fit, 'uts', 'C', 'subject', ds_all)
+
+    # persistence
+    rlm_p = pickle.loads(pickle.dumps(rlm, pickle.HIGHEST_PROTOCOL))
+    assert_array_equal(rlm_p.coefficients('A').x, rlm.coefficients('A').x)
@@ -12,15 +12,17 @@ from numpy.testing import assert_equal, assert_array_equal
 def test_t_contrast_parsing():
     "Test parsing of t-contrast expressions"
     y = np.arange(9.).reshape((3, 3))
-    indexes = {'a': 0, 'b': 1, 'c': 2}
+    indexes = {'a': np.array([0]), 'b': np.array([1]), 'c': np.array([2])}
+
+    def cell_data(c):
+        "Data of each cell, averaging the component cells of mean cells"
+        return {cell: y[rows].mean(1)[0] for cell, rows in c._cell_rows(len(y)).items()}
 
     contrast = "sum(a>c, b>c)"
     contrast_ = t_contrast.parse(contrast)
     eq_(contrast_, ('afunc', np.sum, (('comp', 'a', 'c'),
                                       ('comp', 'b', 'c'))))
-    _, cells = t_contrast._t_contrast_rel_properties(contrast_)
-    pc, mc = t_contrast._t_contrast_rel_expand_cells(cells, ('a', 'b', 'c'))
-    data = t_contrast._t_contrast_rel_data(y, indexes, pc, mc)
+    data = cell_data(TContrastRel(contrast, ('a', 'b', 'c'), indexes))
     assert_equal(data['a'], np.arange(0., 3.))
     assert_equal(data['b'], np.arange(3., 6.))
     assert_equal(data['c'], np.arange(6., 9.))
@@ -30,8 +32,7 @@ def test_t_contrast_parsing():
     eq_(contrast_, ('afunc', np.sum, (('comp', 'a', '*'),
                                       ('comp', 'b', '*'))))
     _, cells = t_contrast._t_contrast_rel_properties(contrast_)
-    pc, mc = t_contrast._t_contrast_rel_expand_cells(cells, ('a', 'b', 'c'))
-    data = t_contrast._t_contrast_rel_data(y, indexes, pc, mc)
+    data = cell_data(TContrastRel(contrast, ('a', 'b', 'c'), indexes))
     assert_equal(data['a'], np.arange(0., 3.))
     assert_equal(data['b'], np.arange(3., 6.))
     assert_equal(data['*'], y.mean(0))
@@ -104,6 +105,24 @@ def test_t_contrasts():
     assert_equal(c(y, out, perm), tgt)
 
 
+def test_t_contrast_block():
+    "Test evaluating t-contrasts for blocks of permutations"
+    ds = datasets.get_uts()
+    ct = Celltable('uts', 'A % B', 'rm', ds=ds)
+    y = ct.y.x
+    perms = np.array([np.random.permutation(ds.n_cases) for _ in range(5)])
+    out = np.empty((len(perms), y.shape[1]))
+    for contrast in ("min(a1|b0 > a0|b0, a1|b1 > a0|b1)",
+                     "(a1|b0 > a0|b0) - abs(a1|* > a0|*)"):
+        c = TContrastRel(contrast, ct.cells, ct.data_indexes)
+        c(y, out, perms)
+        for perm, tmap in zip(perms, out):
+            y_perm = np.empty_like(y)
+            y_perm[perm] = y
+            assert_array_equal(tmap, c.map(y_perm))
+            assert_array_equal(c(y, np.empty(y.shape[1]), perm), tmap)
+
+
 def test_t_contrast_testnd():
     ds = datasets.get_uts()
 
@@ -1,12 +1,12 @@
 # Author: Christian Brodbeck <christianbrodbeck@nyu.edu>
 from nose.tools import eq_, assert_almost_equal
-from numpy.testing import assert_array_equal
+from numpy.testing import assert_allclose, assert_array_equal
 import numpy as np
 import scipy.stats
 
 from eelbrain import datasets, test
 from eelbrain.fmtxt import asfmtext
-from eelbrain._stats import test as _test
+from eelbrain._stats import stats, test as _test
 
 
 def test_correlations():
@@ -50,6 +50,42 @@ def test_correlations():
     assert_almost_equal(res.r, 0.315, 3)
 
 
+def test_pairwise():
+    "Test pairwise t-tests"
+    ds = datasets.get_uv()
+    cells = (('a1', 'b1'), ('a1', 'b2'), ('a2', 'b1'))
+    groups = [ds[ds.eval("A%%B == %r" % (cell,)), 'fltvar'].x for cell in cells]
+    for related, func in ((True, scipy.stats.ttest_rel), (False, scipy.stats.ttest_ind)):
+        res = _test._pairwise(groups, related)
+        ts = [func(groups[i], groups[j]) for i, j in ((0, 1), (0, 2), (1, 2))]
+        assert_allclose(res['t'], [t for t, p in ts])
+        assert_allclose(res['p'], [p for t, p in ts])
+    # unequal group sizes
+    groups[1] = groups[1][:-3]
+    res = _test._pairwise(groups, False)
+    assert_allclose(res['t'][0], scipy.stats.ttest_ind(groups[0], groups[1])[0])
+    print(test.pairwise('fltvar', 'A%B', 'rm', ds=ds))
+
+    # bootstrap
+    res = test.bootstrap_pairwise('fltvar', 'A%B', 'rm', ds=ds, samples=500)
+    res_rel = _test._pairwise(_test.Celltable('fltvar', 'A%B', 'rm', ds=ds).get_data(), True)
+    assert_allclose(res.t, res_rel['t'])
+    assert res.t_resampled.shape == (500,)
+    assert np.all(res._p_boot >= 0)
+    assert res._p_boot[4] < 0.01
+    print(res)
+    # resampled data is regenerated consistently with t_resampled
+    assert res.resampled.shape == (501, ds.n_cases)
+    assert_array_equal(res.resampled[0], ds['fltvar'].x)
+    n_groups = len(res._group_names)
+    t_resampled = stats.pairwise_t(res.ordered[1:].reshape((500, n_groups, -1)))
+    assert_allclose(np.abs(t_resampled).max(1), res.t_resampled)
+    n = res._group_size
+    assert_allclose(res.diffs, res.ordered[:, -2 * n:-n] - res.ordered[:, -n:])
+    res = test.bootstrap_pairwise('fltvar', 'A%B', 'rm', ds=ds, samples=500, replacement=False)
+    assert res._p_boot[0] > 0.5
+
+
 def test_star():
     "Test the star function"
     assert_array_equal(_test.star([0.1, 0.04, 0.01], int), [0, 1, 2])
@@ -1,22 +1,101 @@
 # Author: Christian Brodbeck <christianbrodbeck@nyu.edu>
-from itertools import product
+from itertools import islice, product
 import pickle
 import logging
 import pytest
 import sys
 
 import numpy as np
+from scipy import ndimage
 from numpy.testing import assert_array_equal, assert_allclose
 
 import eelbrain
 from eelbrain import Dataset, NDVar, Categorial, Scalar, UTS, Sensor, configure, datasets, test, testnd, set_log_level, cwt_morlet
 from eelbrain._exceptions import WrongDimension, ZeroVariance
-from eelbrain._stats.testnd import Connectivity, NDPermutationDistribution, label_clusters, _MergedTemporalClusterDist, find_peaks
+from eelbrain._stats import stats
+from eelbrain._stats import testnd as testnd_module
+from eelbrain._stats.permutation import permute_order
+from eelbrain._stats.connectivity_opt import segment_cluster_max, segment_max
+from eelbrain._stats.testnd import (
+    Connectivity, NDPermutationDistribution, label_clusters, _MergedTemporalClusterDist,
+    find_peaks, parc_segments)
 from eelbrain._utils.system import IS_WINDOWS
 from eelbrain.fmtxt import asfmtext
 from eelbrain.testing import assert_dataobj_equal, assert_dataset_equal, requires_mne_sample_data
 
 
+def test_adaptive():
+    "Test permutation tests with adaptive stopping"
+    ds = datasets.get_uts(True)
+    try:
+        for n_workers in (0, True):
+            configure(n_workers=n_workers)
+            ref = testnd.ttest_ind('uts', 'A', ds=ds, samples=1000, pmin=0.05)
+            res = testnd.ttest_ind('uts', 'A', ds=ds, samples=1000, pmin=0.05, adaptive=True)
+            assert ref.n_samples == 1000
+            assert res.n_samples < 1000
+            assert res._cdist.dist.shape == (res.n_samples,)
+            assert_array_equal(res.p <= 0.05, ref.p <= 0.05)
+            assert f"samples={res.n_samples} (adaptive)" in repr(res)
+            res_ = pickle.loads(pickle.dumps(res, pickle.HIGHEST_PROTOCOL))
+            assert res_.n_samples == res.n_samples
+            assert_dataobj_equal(res_.p, res.p)
+            # multiple effects stop together
+            res = testnd.anova('uts', 'A*B', ds=ds, samples=200, pmin=0.05, adaptive=True)
+            assert res.n_samples <= 200
+            for cdist in res._cdist:
+                assert cdist.samples == res.n_samples
+            # complete enumeration of sign flips is never truncated
+            res = testnd.ttest_1samp('uts', ds=ds[20:30], samples=10000, pmin=0.05, adaptive=True)
+            assert res.samples == -1
+            assert res.n_samples == 2 ** 10 - 1
+            assert res._cdist.dist.shape == (2 ** 10 - 1,)
+            assert "complete set" in res._desc_samples()
+    finally:
+        configure(n_workers=True)
+
+    # TFCE and threshold-free maps are continuous, so their p-values are never
+    # all resolved; adaptive stopping is only available for cluster-based tests
+    with pytest.raises(ValueError):
+        testnd.ttest_ind('uts', 'A', ds=ds, samples=100, tfce=True, adaptive=True)
+    with pytest.raises(ValueError):
+        testnd.ttest_ind('uts', 'A', ds=ds, samples=100, adaptive=True)
+
+    # with parcellation, each region is resolved against its own distribution
+    dist = np.zeros((1000, 2))
+    dist[:, 0] = np.arange(1000) / 1000  # p(0.95) = 0.05
+    dist[:, 1] = 2
+    rule = testnd_module.SequentialStopping([0.95], regions=[0])
+    assert not rule.done(dist)
+    rule = testnd_module.SequentialStopping([0.95])
+    assert rule.done(dist)
+    x = np.random.RandomState(0).normal(0, 1, (20, 5, 2))
+    x[:, 2, 0] += 1
+    y = NDVar(x, ('case', UTS(0, 0.1, 5), Categorial('categorial', ('a', 'b'))))
+    res = testnd.ttest_1samp(y, samples=1000, pmin=0.05, parc='categorial', adaptive=True)
+    ref = testnd.ttest_1samp(y, samples=1000, pmin=0.05, parc='categorial')
+    for cell in ('a', 'b'):
+        p = res.compute_probability_map(categorial=cell)
+        p_ref = ref.compute_probability_map(categorial=cell)
+        assert_array_equal(p.x <= 0.05, p_ref.x <= 0.05)
+
+
+@pytest.mark.parametrize('n_workers', [0, True])
+def test_incomplete_permutations(n_workers, monkeypatch):
+    "Test that tests without adaptive stopping fail with missing permutations"
+    ds = datasets.get_uts()
+    monkeypatch.setattr(testnd_module, 'permute_order',
+                        lambda *args, **kwargs: islice(permute_order(*args, **kwargs), 5))
+    configure(n_workers=n_workers)
+    try:
+        with pytest.raises(RuntimeError):
+            testnd.ttest_ind('uts', 'A', ds=ds, samples=20, pmin=0.05)
+        with pytest.raises(RuntimeError):
+            testnd.anova('uts', 'A*B', ds=ds, samples=20, pmin=0.05)
+    finally:
+        configure(n_workers=True)
+
+
 def test_anova():
     "Test testnd.anova()"
     ds = datasets.get_uts(True, nrm=True)
@@ -357,9 +436,65 @@ def test_clusterdist():
     assert_array_equal(p_parc.x, res.compute_probability_map().x)
     assert np.all(p_parc.sub(categorial='a').x >= p_a)
     assert np.all(p_parc.sub(categorial='b').x >= p_b)
+    # parc with clusters on unconnected dimension
+    res_parc = testnd.ttest_1samp(y, pmin=0.1, samples=3, parc='categorial')
+    res0 = testnd.ttest_1samp(y0, pmin=0.1, samples=3, force_permutation=True)
+    res1 = testnd.ttest_1samp(y1, pmin=0.1, samples=3, force_permutation=True)
+    assert_allclose(res_parc._cdist.dist, np.column_stack([res0._cdist.dist, res1._cdist.dist]))
     configure(True)
 
 
+def test_parc_segments():
+    "Test segment reductions for parcellation-wise maxima"
+    rng = np.random.RandomState(0)
+    stat_map = rng.normal(0, 1, (30, 40))
+    cmap = rng.randint(0, 15, (30, 40)).astype(np.uint32)
+    cids = np.array([2, 5, 7, 11], np.uint32)
+    parc = (np.arange(10), np.array([15, 13, 20]), np.arange(21, 30))
+    out = np.empty(len(parc))
+    # maximum
+    v = stat_map.max(1)
+    segment_max(v, *parc_segments(parc), out)
+    assert_array_equal(out, [v[idx].max() for idx in parc])
+    # clusters
+    index = np.arange(stat_map.size).reshape(stat_map.shape)
+    segments = parc_segments([index[idx].ravel() for idx in parc])
+    segment_cluster_max(stat_map.ravel(), cmap.ravel(), cids, *segments, True, out)
+    assert_allclose(out, [np.abs(ndimage.sum(stat_map[idx], cmap[idx], cids)).max()
+                          for idx in parc])
+    segment_cluster_max(stat_map.ravel(), cmap.ravel(), cids[:0], *segments, True, out)
+    assert_array_equal(out, 0)
+
+
+@pytest.mark.parametrize('n_workers', [0, True])
+def test_profile_permutations(n_workers):
+    "Test timing of permutation test stages"
+    ds = datasets.get_uts()
+    configure(n_workers=n_workers)
+    res = testnd.ttest_ind('uts', 'A', ds=ds, samples=20)
+    assert res.permutation_timing is None
+    configure(profile_permutations=True)
+    try:
+        res = testnd.ttest_ind('uts', 'A', ds=ds, samples=20, pmin=0.05)
+        timing = res.permutation_timing
+        assert timing['stat map'][1] > 0
+        assert timing['max statistic'][1] == 20
+        assert timing['distribution'][1] == 20
+        assert all(t >= 0 for t, n in timing.values())
+        assert 'stat map:' in str(res.info_list())
+        res_ = pickle.loads(pickle.dumps(res, pickle.HIGHEST_PROTOCOL))
+        assert res_.permutation_timing == timing
+        # blocks of permutations: one call per permutation
+        res = testnd.t_contrast_rel('uts', 'A', 'a1 > a0', 'rm', ds=ds, samples=20)
+        assert res.permutation_timing['distribution'][1] == 20
+        # multiple effects
+        res = testnd.anova('uts', 'A*B', ds=ds, samples=20)
+        assert res.permutation_timing['max statistic'][1] == 20
+        assert res.permutation_timing['distribution'][1] == 20
+    finally:
+        configure(n_workers=True, profile_permutations=False)
+
+
 def test_corr():
     "Test testnd.corr()"
     ds = datasets.get_uts(True)
@@ -380,6 +515,16 @@ def test_corr():
     repr(res)
     res = testnd.corr('utsnd', 'Y', ds=ds, samples=10, tfce=True)
     repr(res)
+    # permutation distribution
+    y = utsnd.x - utsnd.x.mean(0)
+    x = Y.x - Y.x.mean()
+    dist = [np.abs(stats.corr(y, x, perm=perm)).max() for perm in permute_order(len(y), 10)]
+    res = testnd.corr('utsnd', 'Y', ds=ds, samples=10)
+    assert_allclose(res._cdist.dist, dist)
+    configure(n_workers=0)
+    res = testnd.corr('utsnd', 'Y', ds=ds, samples=10)
+    assert_allclose(res._cdist.dist, dist)
+    configure(n_workers=True)
 
     # persistence
     string = pickle.dumps(res, protocol=pickle.HIGHEST_PROTOCOL)
@@ -420,6 +565,84 @@ def test_t_contrast():
         testnd.t_contrast_rel('uts', 'A%B', 'min(a1|b0>a0|b0, a1|b1>a0|b1)', 'rm', tail=1, ds=ds)
 
 
+@pytest.mark.parametrize('n_workers', [0, True])
+def test_multi_t_contrast_rel(n_workers):
+    ds = datasets.get_uts()
+    contrasts = ['a1|b1 > a0|b1', 'a1|b0 > a0|b0', 'min(a0|b0>a1|b0, a0|b1>a1|b1)']
+    configure(n_workers=n_workers)
+    try:
+        res = testnd.multi_t_contrast_rel(
+            'uts', 'A%B', contrasts, 'rm', ds=ds, samples=20, pmin=0.05)
+        res_merged = testnd.multi_t_contrast_rel(
+            'uts', 'A%B', contrasts, 'rm', ds=ds, samples=20, pmin=0.05, merge=True)
+        assert len(res) == len(res_merged) == 3
+        for contrast, r, r_merged in zip(contrasts, res, res_merged):
+            r_ = testnd.t_contrast_rel('uts', 'A%B', contrast, 'rm', ds=ds, samples=20, pmin=0.05)
+            assert repr(r) == repr(r_)
+            assert_array_equal(r.t.x, r_.t.x)
+            if r_._cdist.dist is not None:
+                assert_array_equal(r._cdist.dist, r_._cdist.dist)
+            assert_array_equal(r_merged.t.x, r.t.x)
+        # adaptive stopping on the merged distribution
+        ref = testnd.multi_t_contrast_rel(
+            'uts', 'A%B', contrasts, 'rm', ds=ds, samples=1000, pmin=0.05, merge=True)
+        res_adaptive = testnd.multi_t_contrast_rel(
+            'uts', 'A%B', contrasts, 'rm', ds=ds, samples=1000, pmin=0.05, merge=True,
+            adaptive=True)
+        n = res_adaptive[0].n_samples
+        assert n < 1000
+        for r, r_ in zip(res_adaptive, ref):
+            assert r.n_samples == n
+            assert_array_equal(r._cdist.dist, np.max([r._cdist.dist for r in res_adaptive], 0))
+            p, p_ref = r.find_clusters(0.05)['p'], r_.find_clusters(0.05)['p']
+            assert_array_equal(p <= 0.05, p_ref <= 0.05)
+    finally:
+        configure(n_workers=True)
+    # family-wise distribution
+    dist = np.max([r._cdist.dist for r in res_merged], 0)
+    assert_array_equal(res_merged[0]._cdist.dist, dist)
+    res_fw = testnd.multi_t_contrast_rel(
+        'uts', 'A%B', contrasts, 'rm', ds=ds, samples=20, pmin=0.05, force_permutation=True)
+    assert_array_equal(dist, np.max([r._cdist.dist for r in res_fw], 0))
+    clusters = res_merged[0].find_clusters()
+    clusters_ = res_fw[0].find_clusters()
+    assert np.all(clusters['p'] >= clusters_['p'])
+
+    # without permutations
+    res = testnd.multi_t_contrast_rel('uts', 'A%B', contrasts, 'rm', ds=ds)
+    assert [r._cdist for r in res] == [None] * 3
+    with pytest.raises(TypeError):
+        testnd.multi_t_contrast_rel('uts', 'A%B', contrasts[0], 'rm', ds=ds)
+
+
+def test_multi_t_contrast_rel_adaptive_parc():
+    "Test adaptive stopping of merged contrasts with parcellation in workers"
+    ds = datasets.get_uts()
+    contrasts = ['a1|b1 > a0|b1', 'a1|b0 > a0|b0']
+    x = np.stack([ds['uts'].x, ds['uts'].x[:, ::-1]], 2)
+    ds['y'] = NDVar(x, ('case', ds['uts'].time, Categorial('categorial', ('a', 'b'))))
+    # rules that are not due do not build the merged distribution
+    rule = testnd_module.SequentialStopping([1.])
+    assert not rule.due(rule.next_check - 1)
+    assert not testnd_module.all_done([rule], [None], rule.next_check - 1, True)
+
+    configure(n_workers=True)
+    kwargs = dict(ds=ds, samples=1000, pmin=0.05, parc='categorial', merge=True)
+    res = testnd.multi_t_contrast_rel('y', 'A%B', contrasts, 'rm', adaptive=True, **kwargs)
+    ref = testnd.multi_t_contrast_rel('y', 'A%B', contrasts, 'rm', **kwargs)
+    n = res[0].n_samples
+    assert n <= 1000
+    dist = np.max([r._cdist.dist for r in res], 0)
+    for r, r_ in zip(res, ref):
+        assert r.n_samples == n
+        assert r._cdist.dist.shape == (n, 2)
+        assert_array_equal(r._cdist.dist, dist)
+        for cell in ('a', 'b'):
+            p = r.compute_probability_map(categorial=cell)
+            p_ref = r_.compute_probability_map(categorial=cell)
+            assert_array_equal(p.x <= 0.05, p_ref.x <= 0.05)
+
+
 def test_labeling():
     "Test cluster labeling"
     shape = flat_shape = (4, 20)
@@ -775,3 +998,8 @@ def test_merged_temporal_cluster_dist():
     res1 = testnd.t_contrast_rel(ds=ds1, match='rm', **contrast_kw)
     res2 = testnd.t_contrast_rel(ds=ds2, match='rm', **contrast_kw)
     test_merged(res1, res2)
+
+    # adaptive distributions are stopped individually
+    res1 = testnd.ttest_1samp('uts', ds=ds1, pmin=0.05, samples=100, adaptive=True)
+    with pytest.raises(ValueError):
+        _MergedTemporalClusterDist([res1._cdist, res2._cdist])
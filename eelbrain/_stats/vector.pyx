@@ -20,6 +20,8 @@ ctypedef cnp.float64_t FLOAT64
 
 
 cdef double r_TOL = 2.220446049250313e-16
+# number of tests processed at a time by the block functions
+cdef Py_ssize_t TILE = 256
 
 cdef extern from "../../dsyevh3C/dsyevh3.c":
     int dsyevh3(double A[3][3], double Q[3][3], double w[3])
@@ -210,6 +212,174 @@ def t2_stat_rotated(cnp.ndarray[FLOAT64, ndim=3] y,
     return out
 
 
+@cython.cdivision(True)
+def mean_norm_rotated_block(FLOAT64[:, :, ::1] y,
+                            FLOAT64[:, :, :, ::1] rotation,
+                            FLOAT64[:, ::1] out):
+    """:func:`mean_norm_rotated` for a block of rotations
+
+    Passes over ``y`` once for the whole block, processing ``TILE`` tests at a
+    time.
+    """
+    cdef Py_ssize_t i, i0, i1, j, n_j, v, case, p
+    cdef double norm, r0, r1, r2
+
+    cdef Py_ssize_t n_cases = y.shape[0]
+    cdef Py_ssize_t n_tests = y.shape[2]
+    cdef Py_ssize_t n_perm = rotation.shape[0]
+    cdef FLOAT64[:, :, ::1] acc = np.empty((n_perm, 3, TILE))
+
+    for i0 in range(0, n_tests, TILE):
+        i1 = min(i0 + TILE, n_tests)
+        n_j = i1 - i0
+        acc[...] = 0
+        for case in range(n_cases):
+            for p in range(n_perm):
+                for v in range(3):
+                    r0 = rotation[p, case, v, 0]
+                    r1 = rotation[p, case, v, 1]
+                    r2 = rotation[p, case, v, 2]
+                    for j in range(n_j):
+                        acc[p, v, j] += r0 * y[case, 0, i0 + j]
+                        acc[p, v, j] += r1 * y[case, 1, i0 + j]
+                        acc[p, v, j] += r2 * y[case, 2, i0 + j]
+        for p in range(n_perm):
+            for j in range(n_j):
+                norm = 0
+                for v in range(3):
+                    norm += (acc[p, v, j] / n_cases) ** 2
+                out[p, i0 + j] = norm ** 0.5
+    return out.base
+
+
+@cython.cdivision(True)
+def mean_norm_rotated_ind_block(FLOAT64[:, :, ::1] y,
+                                FLOAT64[:, :, :, ::1] rotation,
+                                INT8[:, ::1] group,
+                                Py_ssize_t n1,
+                                FLOAT64[:, ::1] out):
+    """Norm of the difference between group means of rotated vectors
+
+    Parameters
+    ----------
+    y : array (n_cases, 3, n_tests)
+        Data.
+    rotation : array (n_perm, n_cases, 3, 3)
+        Rotation matrix for each permutation and case.
+    group : array of int8 (n_perm, n_cases)
+        For each permutation, 1 for cases assigned to group 1, 0 for group 0.
+    n1 : int
+        Number of cases in group 1.
+    out : array (n_perm, n_tests)
+        Container for the result.
+    """
+    cdef Py_ssize_t i0, i1, j, n_j, v, case, p, g
+    cdef double norm, r0, r1, r2
+
+    cdef Py_ssize_t n_cases = y.shape[0]
+    cdef Py_ssize_t n_tests = y.shape[2]
+    cdef Py_ssize_t n_perm = rotation.shape[0]
+    cdef Py_ssize_t n0 = n_cases - n1
+    cdef FLOAT64[:, :, :, ::1] acc = np.empty((2, n_perm, 3, TILE))
+
+    for i0 in range(0, n_tests, TILE):
+        i1 = min(i0 + TILE, n_tests)
+        n_j = i1 - i0
+        acc[...] = 0
+        for case in range(n_cases):
+            for p in range(n_perm):
+                g = group[p, case]
+                for v in range(3):
+                    r0 = rotation[p, case, v, 0]
+                    r1 = rotation[p, case, v, 1]
+                    r2 = rotation[p, case, v, 2]
+                    for j in range(n_j):
+                        acc[g, p, v, j] += r0 * y[case, 0, i0 + j] + r1 * y[case, 1, i0 + j] + r2 * y[case, 2, i0 + j]
+        for p in range(n_perm):
+            for j in range(n_j):
+                norm = 0
+                for v in range(3):
+                    norm += (acc[1, p, v, j] / n1 - acc[0, p, v, j] / n0) ** 2
+                out[p, i0 + j] = norm ** 0.5
+    return out.base
+
+
+@cython.cdivision(True)
+def t2_stat_rotated_block(FLOAT64[:, :, ::1] y,
+                          FLOAT64[:, :, :, ::1] rotation,
+                          FLOAT64[:, ::1] out):
+    """:func:`t2_stat_rotated` for a block of rotations
+
+    Passes over ``y`` once for the whole block, processing ``TILE`` tests at a
+    time.
+    """
+    cdef Py_ssize_t i0, i1, j, n_j, v, u, k, case, p
+    cdef double norm, temp, TOL, max_eig, t0, t1, t2
+    cdef double r[3][3]
+
+    cdef double mean[3]
+    cdef double sigma[3][3]
+
+    cdef double eig[3]
+    cdef double vec[3][3]
+
+    cdef Py_ssize_t n_cases = y.shape[0]
+    cdef Py_ssize_t n_tests = y.shape[2]
+    cdef Py_ssize_t n_perm = rotation.shape[0]
+    # accumulators: 3 sums, followed by the upper triangle of the sum of squares
+    cdef FLOAT64[:, :, ::1] acc = np.empty((n_perm, 9, TILE))
+
+    for i0 in range(0, n_tests, TILE):
+        i1 = min(i0 + TILE, n_tests)
+        n_j = i1 - i0
+        acc[...] = 0
+        for case in range(n_cases):
+            for p in range(n_perm):
+                for u in range(3):
+                    for v in range(3):
+                        r[u][v] = rotation[p, case, u, v]
+                for j in range(n_j):
+                    t0 = r[0][0] * y[case, 0, i0 + j] + r[0][1] * y[case, 1, i0 + j] + r[0][2] * y[case, 2, i0 + j]
+                    t1 = r[1][0] * y[case, 0, i0 + j] + r[1][1] * y[case, 1, i0 + j] + r[1][2] * y[case, 2, i0 + j]
+                    t2 = r[2][0] * y[case, 0, i0 + j] + r[2][1] * y[case, 1, i0 + j] + r[2][2] * y[case, 2, i0 + j]
+                    acc[p, 0, j] += t0
+                    acc[p, 1, j] += t1
+                    acc[p, 2, j] += t2
+                    acc[p, 3, j] += t0 * t0
+                    acc[p, 4, j] += t1 * t0
+                    acc[p, 5, j] += t1 * t1
+                    acc[p, 6, j] += t2 * t0
+                    acc[p, 7, j] += t2 * t1
+                    acc[p, 8, j] += t2 * t2
+        for p in range(n_perm):
+            for j in range(n_j):
+                norm = 0
+                k = 3
+                for u in range(3):
+                    mean[u] = acc[p, u, j]
+                    for v in range(3):
+                        sigma[u][v] = 0.0
+                for u in range(3):
+                    for v in range(u + 1):
+                        sigma[v][u] = acc[p, k, j] - mean[u] * mean[v] / n_cases
+                        k += 1
+
+                dsyevh3(sigma, vec, eig)
+                max_eig = max(eig, 3)
+                TOL = r_TOL * max_eig
+
+                for v in range(3):
+                    temp = 0
+                    for u in range(3):
+                        temp += vec[u][v] * mean[u]
+                    if eig[v] > TOL:
+                        norm += temp ** 2 / eig[v]
+                    else:
+                        norm += temp ** 2 / TOL
+                out[p, i0 + j] = norm ** 0.5
+    return out.base
+
+
 cdef max(double* x, int n):
     cdef int i
     cdef double max_elem = x[0]
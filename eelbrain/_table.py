@@ -7,9 +7,9 @@ import numpy as np
 from . import fmtxt
 from ._celltable import Celltable
 from ._data_obj import (
-    Categorial, Dataset, Factor, Interaction, NDVar, Scalar, UTS,
+    CellIndex, Categorial, Dataset, Factor, Interaction, NDVar, Scalar, UTS,
     Var, ascategorial, as_legal_dataset_key, asndvar, asvar, assub, asuv,
-    cellname, combine, isuv)
+    cellname, combine, dataobj_repr, isuv)
 
 
 def difference(y, x, c1, c0, match, by=None, sub=None, ds=None):
@@ -439,13 +439,18 @@ def cast_to_ndvar(data, dim_values, match, sub=None, ds=None, dim=None,
     # find NDVar data
     n_samples = len(dim)
     n_cases = len(match.cells)
-    case_indexes = [match == case for case in match.cells]
-    samples_indexes = [dim_values == v for v in unique_dim_vales]
-    x = np.empty((n_cases, n_samples))
-    index = None
-    for i, case_index in enumerate(case_indexes):
-        for j, sample_index in enumerate(samples_indexes):
-            x[i, j] = data.x[np.logical_and(case_index, sample_index, index)]
+    if isinstance(dim_values, Factor):
+        sample_codes = dim_values._cell_index.codes
+    else:
+        sample_codes = np.searchsorted(unique_dim_vales, dim_values.x)
+    codes = np.ravel_multi_index((match._cell_index.codes, sample_codes), (n_cases, n_samples))
+    index = CellIndex(codes, range(n_cases * n_samples))
+    if np.any(index.counts != 1):
+        raise ValueError(
+            f"data={dataobj_repr(data)}: need exactly one value for each "
+            f"combination of match={dataobj_repr(match)} and "
+            f"dim_values={dataobj_repr(dim_values)}")
+    x = index.aggregate(data.x).reshape((n_cases, n_samples))
 
     # package output dataset
     if ds is None:
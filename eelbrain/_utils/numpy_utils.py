@@ -8,6 +8,9 @@ from numpy import newaxis
 FULL_SLICE = slice(None)
 FULL_AXIS_SLICE = (FULL_SLICE,)
 INT_TYPES = (int, np.integer)
+# arrays are pickled sparsely if that reduces their size by this factor
+SPARSE_RATIO = 0.5
+SPARSE_MIN_SIZE = 4096
 
 
 def digitize_index(index: float, values: np.ndarray, tol: float=None):
@@ -76,6 +79,67 @@ def index_to_int_array(index, n):
     return np.arange(n)[index]
 
 
+def index_to_slice(index):
+    """Convert an array index to an equivalent slice if possible
+
+    Indexing with a slice returns a view instead of a copy of the data. Returns
+    ``index`` unchanged if it can not be expressed as a slice with a positive
+    step.
+    """
+    if not isinstance(index, np.ndarray) or index.ndim != 1:
+        return index
+    elif index.dtype.kind == 'b':
+        int_index = np.flatnonzero(index)
+    elif index.dtype.kind in 'iu':
+        int_index = index
+    else:
+        return index
+
+    if len(int_index) == 0 or int_index[0] < 0:
+        return index
+    start = int(int_index[0])
+    if len(int_index) == 1:
+        return slice(start, start + 1)
+    steps = np.diff(int_index)
+    step = int(steps[0])
+    if step < 1 or np.any(steps != step):
+        return index
+    return slice(start, int(int_index[-1]) + 1, None if step == 1 else step)
+
+
+def sparse_state(x):
+    """Compact state for pickling an array that contains mostly zeros
+
+    Returns
+    -------
+    state : None | tuple
+        ``None`` if ``x`` is too small or too dense to benefit; otherwise
+        ``(shape, dtype, index, values)``, where ``index`` contains the
+        indices of the non-zero elements in the flattened array (``values`` is
+        ``None`` for boolean arrays).
+    """
+    if not isinstance(x, np.ndarray) or x.size < SPARSE_MIN_SIZE or x.dtype.kind not in 'biufc':
+        return
+    flat = x.ravel()
+    index = np.flatnonzero(flat)
+    index_dtype = np.dtype(np.uint32 if x.size <= 2 ** 32 else np.int64)
+    item_size = index_dtype.itemsize
+    if x.dtype.kind != 'b':
+        item_size += x.dtype.itemsize
+    if len(index) * item_size > x.nbytes * SPARSE_RATIO:
+        return
+    values = None if x.dtype.kind == 'b' else flat[index]
+    return x.shape, x.dtype.str, index.astype(index_dtype), values
+
+
+def from_sparse_state(state):
+    "Reconstruct an array from :func:`sparse_state` output"
+    shape, dtype, index, values = state
+    x = np.zeros(shape, dtype)
+    x.ravel()[index] = True if values is None else values
+    return x
+
+
 def index_length(index, n):
     "Length of an array index (number of selected elements)"
     if isinstance(index, slice):
@@ -11,8 +11,10 @@
 #  - issues commands to Model
 from logging import getLogger
 import math
+import mmap
 import os
 import re
+from threading import Lock, Thread
 import time
 
 import numpy as np
@@ -22,12 +24,12 @@ import wx
 from .. import _meeg as meeg
 from .. import _text
 from .. import load, save, plot, fmtxt
-from .._data_obj import Dataset, Factor, Var, Datalist, asndvar, combine
+from .._data_obj import Case, Dataset, Factor, NDVar, Var, Datalist, asndvar, combine
 from .._info import BAD_CHANNELS
 from .._names import INTERPOLATE_CHANNELS
 from .._ndvar import neighbor_correlation
 from .._utils.parse import FLOAT_PATTERN, POS_FLOAT_PATTERN, INT_PATTERN
-from .._utils.numpy_utils import FULL_SLICE, INT_TYPES
+from .._utils.numpy_utils import FULL_SLICE, INT_TYPES, index_to_int_array
 from ..mne_fixes import MNE_EPOCHS
 from ..plot._base import AxisData, LayerData, PlotType, find_axis_params_data, find_fig_vlims, find_fig_cmaps
 from ..plot._nuts import _plt_bin_nuts
@@ -49,6 +51,19 @@ OUT_OF_RANGE = -3
 
 # For unit-tests
 TEST_MODE = False
+# number of epochs used to determine plot limits for memory-mapped data
+N_VLIM_EPOCHS = 100
+# number of epochs summed at a time for the grand average
+GRAND_AVERAGE_BLOCK_SIZE = 64
+
+
+def is_memory_mapped(x):
+    "Whether the data of array ``x`` are memory-mapped from a file"
+    while x is not None:
+        if isinstance(x, (np.memmap, mmap.mmap)):
+            return True
+        x = getattr(x, 'base', None)
+    return False
 
 
 def _epoch_list_to_ranges(elist):
@@ -140,12 +155,22 @@ class Document(FileDocument):
         Default location of the epoch selection file (used for save
         command). If the file exists, it is loaded as initial state.
 
+    Notes
+    -----
+    If the epoch data are memory-mapped (e.g., a Dataset saved with
+    ``save.pickle(ds, path, separate_arrays=True)`` and loaded with
+    ``load.unpickle(path, mmap=True)``), epochs are only read from disk when
+    they are displayed, and epochs for adjacent pages can be loaded in the
+    background with :meth:`.prefetch`.
+
     Attributes
     ----------
     n_epochs : int
         The number of epochs.
     epochs : NDVar
         The raw epochs.
+    lazy : bool
+        Whether the epoch data are memory-mapped.
     accept : Var of bool
         Case status.
     tag : Factor
@@ -239,8 +264,14 @@ class Document(FileDocument):
         self.bad_channels = []  # list of int
         self.good_channels = None
 
+        self.lazy = is_memory_mapped(data.x)
+
         # cache
         self._good_sensor_indices = {}
+        self._statistics = None
+        self._epoch_cache = {}  # {case: data} for memory-mapped epochs
+        self._epoch_cache_lock = Lock()
+        self._accepted_sum = None  # sum of accepted epochs, after first use
 
         # publisher
         self.callbacks.register_key('case_change')
@@ -296,16 +327,97 @@ class Document(FileDocument):
                 self._good_sensor_indices[key] = out
                 return out
 
+    def excluded_sensors(self):
+        "Sensors excluded from each epoch (bad and interpolated channels)"
+        out = np.zeros((self.n_epochs, len(self.epochs.sensor)), bool)
+        out[:, self.bad_channels] = True
+        for i, chs in enumerate(self.interpolate):
+            if chs:
+                out[i, self.epochs.sensor._array_index(chs)] = True
+        return out
+
+    def get_statistics(self, corr=False):
+        "Per epoch and sensor statistics for artifact detection"
+        if self._statistics is None or (corr and self._statistics.corr is None):
+            self._statistics = meeg.EpochStatistics(self.epochs, corr)
+        return self._statistics
+
     def get_epoch(self, case, name):
+        if isinstance(case, Var):
+            case = case.x
+        if isinstance(case, INT_TYPES):
+            x = self._get_epoch_data([case])[0]
+            dims = self.epochs.dims[1:]
+        else:
+            x = self._get_epoch_data(index_to_int_array(case, self.n_epochs))
+            dims = (Case, *self.epochs.dims[1:])
+        epoch = NDVar(x, dims, self.epochs.info.copy(), name)
         if self.bad_channels:
-            return self.epochs.sub(case=case, sensor=self.good_channels, name=name)
+            return epoch.sub(sensor=self.good_channels)
         else:
-            return self.epochs.sub(case=case, name=name)
+            return epoch
+
+    def _get_epoch_data(self, index):
+        "Data for the epochs in ``index``, using cached epochs if available"
+        if not self.lazy:
+            return self.epochs.x[index]
+        with self._epoch_cache_lock:
+            cached = {i: self._epoch_cache[i] for i in index if i in self._epoch_cache}
+        if not cached:
+            return self.epochs.x[index]
+        out = np.empty((len(index), *self.epochs.x.shape[1:]), self.epochs.x.dtype)
+        missing = [i for i, case in enumerate(index) if case not in cached]
+        if missing:
+            out[missing] = self.epochs.x[[index[i] for i in missing]]
+        for i, case in enumerate(index):
+            if case in cached:
+                out[i] = cached[case]
+        return out
+
+    def prefetch(self, index, keep=()):
+        """Read memory-mapped epochs in a background thread
+
+        Parameters
+        ----------
+        index : sequence of int
+            Epochs to read.
+        keep : sequence of int
+            Epochs to keep in the cache in addition to ``index`` (all other
+            epochs are removed from the cache).
+        """
+        if not self.lazy:
+            return
+        keep = set(keep).union(index)
+        with self._epoch_cache_lock:
+            for case in set(self._epoch_cache).difference(keep):
+                del self._epoch_cache[case]
+            index = [case for case in index if case not in self._epoch_cache]
+        if index:
+            thread = Thread(target=self._cache_epochs, args=(index,), daemon=True)
+            thread.start()
+            return thread
+
+    def _cache_epochs(self, index):
+        x = self.epochs.x[index]
+        with self._epoch_cache_lock:
+            self._epoch_cache.update(zip(index, x))
 
     def get_grand_average(self):
         "Grand average of all accepted epochs"
-        return self.epochs.sub(case=self.accept.x, sensor=self.good_channels,
-                               name="Grand Average").mean('case')
+        if self._accepted_sum is None:
+            x = self.epochs.x
+            accept = self.accept.x
+            self._accepted_sum = np.zeros(x.shape[1:])
+            for start in range(0, self.n_epochs, GRAND_AVERAGE_BLOCK_SIZE):
+                stop = start + GRAND_AVERAGE_BLOCK_SIZE
+                index = np.flatnonzero(accept[start:stop]) + start
+                if len(index):
+                    self._accepted_sum += x[index].sum(0)
+        average = self._accepted_sum / self.accept.x.sum()
+        out = NDVar(average, self.epochs.dims[1:], self.epochs.info.copy(), "Grand Average")
+        if self.bad_channels:
+            return out.sub(sensor=self.good_channels)
+        return out
 
     def set_bad_channels(self, indexes):
         """Set the channels to treat as bad (i.e., exclude)
@@ -332,7 +444,20 @@ class Document(FileDocument):
 
     def set_case(self, index, state, tag, interpolate):
         if state is not None:
-            self.accept[index] = state
+            if self._accepted_sum is None:
+                self.accept[index] = state
+            else:
+                # update the grand average sum with the changed epochs
+                index_ = np.atleast_1d(np.arange(self.n_epochs)[index])
+                old_state = self.accept.x[index_]
+                self.accept[index] = state
+                new_state = self.accept.x[index_]
+                added = index_[new_state & ~old_state]
+                removed = index_[old_state & ~new_state]
+                if len(added):
+                    self._accepted_sum += self.epochs.x[added].sum(0)
+                if len(removed):
+                    self._accepted_sum -= self.epochs.x[removed].sum(0)
         if tag is not None:
             self.tag[index] = tag
         if interpolate is not None:
@@ -538,15 +663,9 @@ class Model(FileModel):
         logger = getLogger(__name__)
         logger.info("Auto-reject trials: %s" % args)
 
-        if method == 'abs':
-            x = [x.abs().max(('time', 'sensor')) for x in
-                 self.doc.iter_good_epochs()]
-        elif method == 'p2p':
-            x = [(x.max('time') - x.min('time')).max('sensor') for x in
-                 self.doc.iter_good_epochs()]
-        else:
-            raise ValueError("Invalid method: %r" % method)
-        return np.array(x) < threshold
+        statistics = self.doc.get_statistics()
+        x = statistics.epoch_max(method, self.doc.excluded_sensors())
+        return x < threshold
 
     def toggle_interpolation(self, case, ch_name):
         old_interpolate = self.doc.interpolate[case]
@@ -729,7 +848,13 @@ class Frame(FileFrame):
                              wx.OK | wx.ICON_WARNING)
 
         # setup plot parameters
-        plot_list = ((self.doc.epochs,),)
+        if self.doc.lazy:
+            # avoid reading all epochs from disk
+            n = self.doc.n_epochs
+            index = np.linspace(0, n - 1, min(N_VLIM_EPOCHS, n)).round().astype(int)
+            plot_list = ((self.doc.get_epoch(np.unique(index), self.doc.epochs.name),),)
+        else:
+            plot_list = ((self.doc.epochs,),)
         cmaps = find_fig_cmaps(plot_list)
         self._vlims = find_fig_vlims(plot_list, vlim, None, cmaps)
         self._mark = mark
@@ -904,7 +1029,7 @@ class Frame(FileFrame):
             # Find bad channels
             flat, flat_average, mincorr = dlg.GetValues()
             if flat:
-                flats = meeg.find_flat_epochs(self.doc.epochs, flat)
+                flats = meeg.find_flat_epochs(self.doc.get_statistics(), flat)
             else:
                 flats = None
 
@@ -914,7 +1039,7 @@ class Frame(FileFrame):
                 flats_av = None
 
             if mincorr:
-                noisies = meeg.find_noisy_channels(self.doc.epochs, mincorr)
+                noisies = meeg.find_noisy_channels(self.doc.get_statistics(True), mincorr)
             else:
                 noisies = None
 
@@ -1340,6 +1465,15 @@ class Frame(FileFrame):
         self.page_choice.Select(page)
         self._epoch_idxs = self._segs_by_page[page]
 
+    def _prefetch_pages(self):
+        "Load epochs on adjacent pages in the background (memory-mapped data)"
+        if not self.doc.lazy:
+            return
+        page = self._current_page_i
+        pages = [p for p in (page + 1, page - 1) if 0 <= p < len(self._segs_by_page)]
+        index = [i for p in pages for i in self._segs_by_page[p]]
+        self.doc.prefetch(index, self._epoch_idxs)
+
     def SetPage(self, page):
         "Change the page that is displayed without redrawing"
         self._page_change(page)
@@ -1375,6 +1509,7 @@ class Frame(FileFrame):
             self._mean_plot.set_data(self._get_page_mean_seg())
 
         self.canvas.draw()
+        self._prefetch_pages()
 
     def ShowPage(self, page=None):
         "Dislay a specific page (start counting with 0)"
@@ -1460,6 +1595,7 @@ class Frame(FileFrame):
 
         self.canvas.draw()
         self.canvas.store_canvas()
+        self._prefetch_pages()
 
         dt = time.time() - t0
         logger.debug('Page draw took %.1f seconds.', dt)
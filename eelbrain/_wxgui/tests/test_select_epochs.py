@@ -3,9 +3,10 @@ from os.path import join
 
 import mne
 from nose.tools import eq_, ok_, assert_false
-from numpy.testing import assert_array_equal
+import numpy as np
+from numpy.testing import assert_array_almost_equal, assert_array_equal
 
-from eelbrain import gui, load, set_log_level
+from eelbrain import gui, load, save, set_log_level
 from eelbrain.testing import TempDir, gui_test
 from eelbrain._wxgui.select_epochs import Document, Model
 
@@ -95,6 +96,14 @@ def test_select_epochs():
     model.history.redo()
     eq_(doc.bad_channels, [1, 10])
 
+    # threshold (excluding bad and interpolated channels)
+    for method, threshold in (('abs', 1e-12), ('p2p', 2e-12)):
+        if method == 'abs':
+            x = [ep.abs().max(('time', 'sensor')) for ep in doc.iter_good_epochs()]
+        else:
+            x = [(ep.max('time') - ep.min('time')).max('sensor') for ep in doc.iter_good_epochs()]
+        assert_array_equal(model.threshold(threshold, method), np.array(x) < threshold)
+
     # reload to reset
     model.load(path)
     # tests
@@ -105,6 +114,30 @@ def test_select_epochs():
     eq_(doc.bad_channels, [1])
     assert_array_equal(doc.accept[2:], True)
 
+    # Test memory-mapped Document
+    # ===========================
+    mmap_path = join(tempdir, 'epochs.pickled')
+    save.pickle(ds, mmap_path, separate_arrays=True)
+    ds_mmap = load.unpickle(mmap_path, mmap=True)
+    doc = Document(ds_mmap, 'meg')
+    ok_(doc.lazy)
+    assert_false(Document(ds, 'meg').lazy)
+    doc.prefetch([1, 2, 3]).join()
+    eq_(sorted(doc._epoch_cache), [1, 2, 3])
+    assert_array_equal(doc.get_epoch(2, 'epoch').x, ds['meg'].x[2])
+    assert_array_equal(doc.get_epoch(np.arange(5), 'epochs').x, ds['meg'].x[:5])
+    doc.prefetch([4], [3]).join()
+    eq_(sorted(doc._epoch_cache), [3, 4])
+    # grand average is updated incrementally
+    doc.set_bad_channels([1])
+    doc.get_grand_average()
+    doc.set_case(slice(2, 5), False, None, None)
+    doc.set_case(3, True, None, None)
+    ga = doc.get_grand_average()
+    target = ds['meg'].sub(case=doc.accept.x, sensor=doc.good_channels).mean('case')
+    assert_array_almost_equal(ga.x, target.x)
+    assert_array_equal(ga.sensor.names, target.sensor.names)
+
     # Test GUI
     # ========
     frame = gui.select_epochs(ds, nplots=9)
@@ -112,3 +145,6 @@ def test_select_epochs():
     ok_(frame.CanForward())
     frame.OnForward(None)
     frame.SetVLim(1e-12)
+    # memory-mapped
+    frame = gui.select_epochs(ds_mmap, nplots=9)
+    frame.OnForward(None)
@@ -2,7 +2,6 @@
 """Tools for loading data form eyelink edf files."""
 from glob import glob
 import os
-import re
 import shutil
 import subprocess
 import tempfile
@@ -15,6 +14,16 @@ from .._utils.subp import get_bin
 
 __all__ = ('Edf', 'read_edf', 'read_edf_events', 'read_edf_samples')
 
+TRIGGER_PREFIX = 'MEG Trigger: '
+TRIGGER_DTYPE = np.dtype([('T', np.uint32), ('Id', np.uint8)])
+ARTIFACT_DTYPE = np.dtype([('event', np.str_, 6), ('start', np.uint32), ('stop', np.uint32)])
+SAMPLE_DTYPE = np.dtype([
+    ('time', np.uint32), ('xpos', np.float32), ('ypos', np.float32), ('pdia', np.float32)])
+# arrays stored in the edf cache file
+ASC_ARRAYS = ('messages', 'triggers', 'artifacts', 'samples')
+# number of sample lines converted to an array at a time
+SAMPLE_BLOCK_SIZE = 2 ** 16
+
 
 class Edf:
     """Eyelink .edf file reader.
@@ -87,28 +96,18 @@ class Edf:
         else:
             self.paths = [path]
 
-        triggers = []
-        artifacts = []
-        pos = []
-        for path in self.paths:
-            edf_asc = read_edf(path)
-            triggers += find_edf_triggers(edf_asc)
-            artifacts += find_edf_artifacts(edf_asc)
-            if samples:
-                pos += find_edf_pos(edf_asc)
-
-        dtype = [('T', np.uint32), ('Id', np.uint8)]
-        self.triggers = np.array(triggers, dtype=dtype)
-
-        dtype = np.dtype([('event', np.str_, 6), ('start', np.uint32), ('stop', np.uint32)])
-        self.artifacts = np.array(artifacts, dtype=dtype)
+        data = [read_edf_arrays(path, samples) for path in self.paths]
+        self.triggers = np.concatenate([d['triggers'] for d in data])
+        self.artifacts = np.concatenate([d['artifacts'] for d in data])
+        self._artifact_index = {}
 
         self.has_samples = bool(samples)
         if samples:
-            self.time = np.array([item[0] for item in pos], dtype=np.uint32)
-            self.xpos = np.array([item[1] for item in pos], dtype=np.float16)
-            self.ypos = np.array([item[2] for item in pos], dtype=np.float16)
-            self.pdia = np.array([item[3] for item in pos], dtype=np.float16)
+            pos = np.concatenate([d['samples'] for d in data])
+            self.time = pos['time']
+            self.xpos = pos['xpos'].astype(np.float16)
+            self.ypos = pos['ypos'].astype(np.float16)
+            self.pdia = pos['pdia'].astype(np.float16)
 
     def __getstate__(self):
         state = {'path': self.path, 'paths': self.paths,
@@ -121,6 +120,7 @@ class Edf:
 
     def __setstate__(self, state):
         self.__dict__.update(state)
+        self._artifact_index = {}
 
     def __repr__(self):
         return "Edf(%r)" % self.path
@@ -240,31 +240,33 @@ class Edf:
         """
         if T is None:
             T = self.triggers['T']
+        T = np.asarray(T, np.int64)
 
         # conert to ms
         start = int(tstart * 1000)
         stop = int(tstop * 1000)
 
-        self._debug = []
-
-        # get data for triggers
-        N = len(T)
-        accept = np.empty(N, np.bool_)
-
-        x = tuple(self.artifacts['event'] == name for name in use)
-        idx = np.any(x, axis=0)
-        artifacts = self.artifacts[idx]
-
-        for i, t in enumerate(T):
-            starts_before_tstop = artifacts['start'] < t + stop
-            stops_after_tstart = artifacts['stop'] > t + start
-            overlap = np.all((starts_before_tstop, stops_after_tstart), axis=0)
-            accept[i] = not np.any(overlap)
-
-            self._debug.append(overlap)
-
+        # an epoch overlaps with an artifact if any of the artifacts starting
+        # before the end of the epoch stops after the start of the epoch
+        starts, max_stops = self._get_artifact_index(use)
+        n_before_tstop = np.searchsorted(starts, T + stop, 'left')
+        accept = np.ones(len(T), np.bool_)
+        has_artifact = n_before_tstop > 0
+        last_stops = max_stops[n_before_tstop[has_artifact] - 1]
+        accept[has_artifact] = last_stops <= T[has_artifact] + start
         return accept
 
+    def _get_artifact_index(self, use):
+        """Artifact start times (sorted) and running maximum of stop times"""
+        key = tuple(sorted(use))
+        if key not in self._artifact_index:
+            artifacts = self.artifacts[np.in1d(self.artifacts['event'], key)]
+            order = np.argsort(artifacts['start'], kind='mergesort')
+            starts = artifacts['start'][order].astype(np.int64)
+            max_stops = np.maximum.accumulate(artifacts['stop'][order].astype(np.int64))
+            self._artifact_index[key] = starts, max_stops
+        return self._artifact_index[key]
+
     def get_t(self, name='t_edf'):
         "Retrieve all trigger times in the Dataset"
         return Var(self.triggers['T'], name=name)
@@ -544,15 +546,24 @@ def read_edf(fname, what='events'):
     what : 'all' | 'events' | 'samples'
         What type of information to read
     """
+    temp_dir = tempfile.mkdtemp()
+    try:
+        asc_path = _edf2asc(fname, what, temp_dir)
+        with open(asc_path) as asc_file:
+            return asc_file.read()
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def _edf2asc(fname, what, dst_dir):
+    "Convert ``fname`` to an asc file in ``dst_dir`` and return its path"
     if not os.path.isfile(fname):
         err = "%r is not a file." % fname
         raise ValueError(err)
 
-    temp_dir = tempfile.mkdtemp()
-
     # edf2asc does not seem to handle spaces in filenames?
     if ' ' in fname:
-        dst = os.path.join(temp_dir, os.path.basename(fname).replace(' ', '_'))
+        dst = os.path.join(dst_dir, os.path.basename(fname).replace(' ', '_'))
 #         shutil.copy(fname, dst)
         os.symlink(fname, dst)
         fname = dst
@@ -564,13 +575,11 @@ def read_edf(fname, what='events'):
         cmd.append('-e')  # outputs event data only
     elif what == 'samples':
         cmd.append('-s')  # outputs sample data only
-    elif what == 'all':
-        raise NotImplementedError()
-    else:
-        raise ValueError("what must be 'events' or 'samples', not %r" % what)
+    elif what != 'all':
+        raise ValueError("what must be 'all', 'events' or 'samples', not %r" % what)
 
     cmd.extend(('-nst',  # blocks output of start events
-                '-p', temp_dir,  # writes output with same name to <path> directory
+                '-p', dst_dir,  # writes output with same name to <path> directory
                 fname))
 
     # run the subprocess
@@ -581,58 +590,175 @@ def read_edf(fname, what='events'):
     # find asc file
     name, _ = os.path.splitext(os.path.basename(fname))
     ascname = os.path.extsep.join((name, 'asc'))
-    asc_path = os.path.join(temp_dir, ascname)
+    asc_path = os.path.join(dst_dir, ascname)
     if not os.path.exists(asc_path):
         print("======\nstdout\n======\n%s" % stdout)
         print("======\nstderr\n======\n%s" % stderr)
         raise subprocess.CalledProcessError(p.returncode, cmd, (stdout, stderr))
-    with open(asc_path) as asc_file:
-        asc_str = asc_file.read()
-
-    # clean
-    shutil.rmtree(temp_dir)
-    return asc_str
+    return asc_path
 
 
-def find_edf_triggers(asc_str):
-    """Find artifacts in an edf asci representation
+def read_edf_events(fname):
+    """Read triggers and ocular artifacts from an edf file
 
     Parameters
     ----------
-    asc_str : str
-        String with edf asci represenation as returned by read_edf.
+    fname : str
+        Filename.
+
+    Returns
+    -------
+    triggers : array
+        Structured array with trigger time (``'T'``) and value (``'Id'``).
+    artifacts : array
+        Structured array with ``'event'`` (``'EBLINK'`` or ``'ESACC'``),
+        ``'start'`` and ``'stop'`` time.
     """
-    re_trigger = re.compile(r'\bMSG\t(\d+)\tMEG Trigger: (\d+)')
-    triggers = re_trigger.findall(asc_str)
-    return triggers
+    data = read_edf_arrays(fname)
+    return data['triggers'], data['artifacts']
 
 
-def find_edf_artifacts(asc_str, kind='EBLINK|ESACC'):
-    """Find artifacts in an edf asci representation
+def read_edf_samples(fname):
+    """Read eye position samples from an edf file
 
     Parameters
     ----------
-    asc_str : str
-        String with edf asci represenation as returned by read_edf.
-    kind : 'EBLINK|ESACC' | 'EBLINK' | 'ESACC'
-        Kind of artifact to search.
+    fname : str
+        Filename.
+
+    Returns
+    -------
+    samples : array
+        Structured array with ``'time'``, ``'xpos'``, ``'ypos'`` and ``'pdia'``
+        (pupil size) for each sample.
     """
-    for kind_part in kind.split('|'):
-        if kind_part not in ['EBLINK', 'ESACC']:
-            raise ValueError("invalid kind parameter: %r" % kind)
-    re_artifact = re.compile(r'\b(%s)\t[LR]\t(\d+)\t(\d+)' % kind)
-    artifacts = re_artifact.findall(asc_str)
-    return artifacts
+    return read_edf_arrays(fname, True)['samples']
+
+
+def read_edf_arrays(fname, samples=False, cache=True):
+    """Read the content of an edf file as structured arrays
+
+    Parameters
+    ----------
+    fname : str
+        Filename.
+    samples : bool
+        Read eye position samples in addition to events.
+    cache : bool
+        Store the arrays in a file next to the edf file
+        (``*-edf.npz``) and use that file as long as the edf file is not
+        modified.
 
+    Returns
+    -------
+    data : dict
+        Arrays as returned by :func:`parse_asc`.
+    """
+    cache_path = os.path.splitext(fname)[0] + '-edf.npz'
+    stat = os.stat(fname)
+    if cache and os.path.exists(cache_path):
+        data = _read_edf_cache(cache_path, stat, samples)
+        if data is not None:
+            return data
 
-def find_edf_pos(asc_str):
-    """Find position values in an edf asci representation
+    temp_dir = tempfile.mkdtemp()
+    try:
+        asc_path = _edf2asc(fname, 'all' if samples else 'events', temp_dir)
+        with open(asc_path) as asc_file:
+            data = parse_asc(asc_file, samples)
+    finally:
+        shutil.rmtree(temp_dir)
+
+    if cache:
+        # write to a temporary file first so that readers never see a partial file
+        tmp_path = f'{cache_path}.tmp'
+        try:
+            with open(tmp_path, 'wb') as fid:
+                np.savez(fid, edf_mtime=stat.st_mtime, edf_size=stat.st_size, **data)
+            os.replace(tmp_path, cache_path)
+        except OSError:  # read-only location
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    return data
+
+
+def _read_edf_cache(cache_path, stat, samples):
+    "Arrays from the edf cache file, or None if the cache can not be used"
+    try:
+        with np.load(cache_path) as npz:
+            if (npz['edf_mtime'] == stat.st_mtime and
+                    npz['edf_size'] == stat.st_size and
+                    (not samples or 'samples' in npz)):
+                return {k: npz[k] for k in ASC_ARRAYS if k in npz}
+    except Exception:  # corrupt or incompatible cache file
+        return
+
+
+def parse_asc(lines, samples=False):
+    """Parse the lines of an edf asci representation
 
     Parameters
     ----------
-    asc_str : str
-        String with edf asci represenation as returned by read_edf.
+    lines : iterator of str
+        Lines of the asc file (e.g. an open file object).
+    samples : bool
+        Extract eye position samples.
+
+    Returns
+    -------
+    data : dict
+        Structured arrays ``'messages'`` (``'T'``, ``'message'``),
+        ``'triggers'`` (``'T'``, ``'Id'``), ``'artifacts'`` (``'event'``,
+        ``'start'``, ``'stop'``) and, if ``samples`` is True, ``'samples'``
+        (``'time'``, ``'xpos'``, ``'ypos'``, ``'pdia'``).
     """
-    re_pos = re.compile(r'\b(\d+)\t(\d+\.\d*)\t(\d+\.\d*)\t(\d+\.\d*)')
-    pos = re_pos.findall(asc_str)
-    return pos
+    messages = []
+    triggers = []
+    artifacts = []
+    sample_blocks = []
+    block = []
+    for line in lines:
+        if not line:
+            continue
+        elif line[0].isdigit():
+            if samples:
+                fields = line.split(None, 4)
+                # missing data (e.g. during blinks) are coded as '.'
+                if len(fields) >= 4 and '.' not in fields[1:4]:
+                    block.append(fields[:4])
+                    if len(block) == SAMPLE_BLOCK_SIZE:
+                        sample_blocks.append(np.array(block, np.float64))
+                        block = []
+        elif line.startswith('MSG'):
+            fields = line.split(None, 2)
+            if len(fields) < 3:
+                continue
+            t = int(fields[1])
+            message = fields[2].rstrip()
+            messages.append((t, message))
+            if message.startswith(TRIGGER_PREFIX):
+                trigger = message[len(TRIGGER_PREFIX):]
+                if trigger.isdigit():
+                    triggers.append((t, int(trigger)))
+        elif line.startswith(('EBLINK', 'ESACC')):
+            fields = line.split(None, 4)
+            if len(fields) >= 4:
+                artifacts.append((fields[0], int(fields[2]), int(fields[3])))
+    message_len = max([len(m) for _, m in messages], default=1)
+
+    out = {
+        'messages': np.array(messages, [('T', np.uint32), ('message', np.str_, message_len)]),
+        'triggers': np.array(triggers, TRIGGER_DTYPE),
+        'artifacts': np.array(artifacts, ARTIFACT_DTYPE),
+    }
+    if samples:
+        if block:
+            sample_blocks.append(np.array(block, np.float64))
+        if sample_blocks:
+            pos = np.concatenate(sample_blocks)
+        else:
+            pos = np.empty((0, 4))
+        out['samples'] = x = np.empty(len(pos), SAMPLE_DTYPE)
+        for i, name in enumerate(SAMPLE_DTYPE.names):
+            x[name] = pos[:, i]
+    return out
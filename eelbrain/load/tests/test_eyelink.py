@@ -0,0 +1,81 @@
+# Author: Christian Brodbeck <christianbrodbeck@nyu.edu>
+import os
+
+import numpy as np
+from numpy.testing import assert_array_equal
+
+from eelbrain.load import eyelink
+from eelbrain.load.eyelink import Edf, parse_asc, read_edf_arrays
+
+
+ASC = """\
+** CONVERTED FROM test.edf
+MSG	1000	DISPLAY_COORDS 0 0 1279 1023
+MSG	1002	MEG Trigger: 2
+1001	512.0	380.5	1024.0	...
+1002	513.5	381.0	1023.0	...
+SBLINK	R	1003
+1003	   .	   .	    0.0	...
+EBLINK	R	1003	1100	98
+ESACC	R	1150	1180	31	512.3	400.1	600.2	380.9	2.3	120
+1101	600.0	390.0	1000.0	...
+MSG	1300	MEG Trigger: 4
+MSG	1400	MEG Trigger: x
+"""
+
+
+def test_parse_asc():
+    "Test parsing eyelink asc files"
+    data = parse_asc(ASC.splitlines(True))
+    assert_array_equal(data['triggers']['T'], [1002, 1300])
+    assert_array_equal(data['triggers']['Id'], [2, 4])
+    assert_array_equal(data['artifacts']['event'], ['EBLINK', 'ESACC'])
+    assert_array_equal(data['artifacts']['start'], [1003, 1150])
+    assert_array_equal(data['artifacts']['stop'], [1100, 1180])
+    assert_array_equal(data['messages']['T'], [1000, 1002, 1300, 1400])
+    assert data['messages'][0]['message'] == 'DISPLAY_COORDS 0 0 1279 1023'
+    assert 'samples' not in data
+
+    data = parse_asc(ASC.splitlines(True), True)
+    assert_array_equal(data['samples']['time'], [1001, 1002, 1101])
+    assert_array_equal(data['samples']['xpos'], [512, 513.5, 600])
+    assert_array_equal(data['samples']['pdia'], [1024, 1023, 1000])
+
+    # epoch acceptance
+    edf = Edf.__new__(Edf)
+    edf.__setstate__({
+        'path': 'test.edf', 'paths': ['test.edf'], 'triggers': data['triggers'],
+        'artifacts': data['artifacts'], 'has_samples': False})
+    T = np.array([900, 1002, 1120, 1190, 1300, 1500])
+    assert_array_equal(edf.get_accept(T, -0.1, 0.1), [True, False, False, False, True, True])
+    assert_array_equal(edf.get_accept(T, 0, 0.01), [True, False, True, True, True, True])
+    accept = edf.get_accept(T, -0.05, 0.01, ['ESACC'])
+    assert_array_equal(accept, [True, True, True, False, True, True])
+    assert_array_equal(edf.get_accept(None, -0.01, 0.01), [False, True])
+
+
+def test_edf_cache(tmp_path, monkeypatch):
+    "Test the cache of edf file content"
+    def edf2asc(fname, what, dst_dir):
+        asc_path = os.path.join(dst_dir, 'test.asc')
+        with open(asc_path, 'w') as fid:
+            fid.write(ASC)
+        return asc_path
+
+    monkeypatch.setattr(eyelink, '_edf2asc', edf2asc)
+    edf_path = tmp_path / 'test.edf'
+    edf_path.write_bytes(b'edf')
+    cache_path = tmp_path / 'test-edf.npz'
+    # corrupt cache files are ignored and replaced
+    for content in (b'PK\x03\x04 truncated', None):
+        if content is None:  # valid file without edf_mtime
+            np.savez(cache_path, edf_size=3)
+        else:
+            cache_path.write_bytes(content)
+        data = read_edf_arrays(str(edf_path))
+        assert_array_equal(data['triggers']['Id'], [2, 4])
+        assert sorted(os.listdir(tmp_path)) == ['test-edf.npz', 'test.edf']
+    # valid cache is used
+    monkeypatch.setattr(eyelink, '_edf2asc', None)
+    data = read_edf_arrays(str(edf_path))
+    assert_array_equal(data['triggers']['Id'], [2, 4])
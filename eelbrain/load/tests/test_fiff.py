@@ -4,16 +4,19 @@ import os
 from warnings import catch_warnings, filterwarnings
 
 from nose.tools import eq_
+import numpy as np
 from numpy.testing import assert_array_equal, assert_array_almost_equal
 
 import mne
 from mne import pick_types
+from scipy.signal import resample_poly
 
 from eelbrain import load
+from eelbrain._io import fiff
 
 from ...tests.test_data import assert_dataobj_equal
 from eelbrain.testing import (requires_module, requires_mne_sample_data,
-                                     file_path)
+                                     file_path, TempDir)
 
 
 FILTER_WARNING = ('The measurement information indicates a low-pass frequency '
@@ -66,6 +69,40 @@ def test_load_fiff_sensor():
     sensor = load.fiff.sensor_dim(raw)
     eq_(sensor.sysname, 'KIT-UMD-3')
 
+    # cached sensor dimensions
+    fiff.SENSOR_DIM_CACHE.clear()
+    sensor = load.fiff.sensor_dim(raw)
+    eq_(len(fiff.SENSOR_DIM_CACHE), 1)
+    sensor_2 = load.fiff.sensor_dim(raw)
+    eq_(len(fiff.SENSOR_DIM_CACHE), 1)
+    assert sensor_2 is not sensor
+    eq_(sensor_2, sensor)
+    assert_array_equal(sensor_2.locs, sensor.locs)
+    assert_array_equal(sensor_2.connectivity(), sensor.connectivity())
+    sensor_2.set_sensor_positions(np.zeros(sensor.locs.shape))
+    assert_array_equal(load.fiff.sensor_dim(raw).locs, sensor.locs)
+    sensor_none = load.fiff.sensor_dim(raw, connectivity='none')
+    eq_(len(fiff.SENSOR_DIM_CACHE), 2)
+    assert sensor_none._connectivity is None
+    # persistent cache
+    tempdir = TempDir()
+    path = os.path.join(tempdir, 'sensor-dims.pickled')
+    keys = fiff.save_sensor_dim_cache(path)
+    fiff.SENSOR_DIM_CACHE.clear()
+    eq_(fiff.load_sensor_dim_cache(path), keys)
+    assert_array_equal(load.fiff.sensor_dim(raw).connectivity(), sensor.connectivity())
+    eq_(len(fiff.SENSOR_DIM_CACHE), 2)
+    eq_(os.listdir(tempdir), ['sensor-dims.pickled'])
+    # only save recorded entries
+    keys = set()
+    with fiff.record_sensor_dim_keys(keys):
+        load.fiff.sensor_dim(raw, connectivity='none')
+    eq_(len(keys), 1)
+    eq_(fiff.save_sensor_dim_cache(path, keys), keys)
+    fiff.SENSOR_DIM_CACHE.clear()
+    eq_(fiff.load_sensor_dim_cache(path), keys)
+    eq_(len(fiff.SENSOR_DIM_CACHE), 1)
+
 
 @requires_mne_sample_data
 def test_load_fiff_from_raw():
@@ -84,6 +121,22 @@ def test_load_fiff_from_raw():
     ds_evt.name = ds.name
     assert_dataobj_equal(ds_evt, ds)
 
+    # stim channel steps are read in chunks and cached
+    raw = mne.io.read_raw_fif(raw_path)
+    steps_ref = mne.find_stim_steps(raw.copy().load_data())
+    stim_chunk_size = fiff.STIM_CHUNK_SIZE
+    fiff.STIM_CHUNK_SIZE = 1000
+    fiff.STIM_STEPS_CACHE.clear()
+    try:
+        assert_array_equal(fiff.stim_steps(raw), steps_ref)
+        assert len(fiff.STIM_STEPS_CACHE) == 1
+        assert_array_equal(fiff.stim_steps(raw), steps_ref)
+        for merge in (-1, 2):
+            steps = fiff.merge_stim_steps(steps_ref, merge)
+            assert_array_equal(steps, mne.find_stim_steps(raw, merge=merge))
+    finally:
+        fiff.STIM_CHUNK_SIZE = stim_chunk_size
+
     # add epochs as ndvar
     ds = ds.sub('trigger == 32')
     with catch_warnings():
@@ -120,3 +173,65 @@ def test_load_fiff_from_raw():
     picks = pick_types(epochs.info, meg='mag')
     mne_data = epochs.get_data()[:, picks]
     assert_array_almost_equal(meg.x, mne_data, 10)
+
+
+def test_raw_ndvar():
+    "Test loading raw data in blocks with decimation"
+    tempdir = TempDir()
+    n = 10000
+    x = np.random.RandomState(0).normal(0, 1e-5, (4, n))
+    info = mne.create_info(['EEG 001', 'EEG 002', 'EEG 003', 'EEG 004'], 1000., 'eeg')
+    raw_path = os.path.join(tempdir, 'test-raw.fif')
+    mne.io.RawArray(x, info).save(raw_path)
+    raw = mne.io.read_raw_fif(raw_path)
+    x = raw.get_data()  # single precision in file
+
+    block_size = fiff.RAW_BLOCK_SIZE
+    fiff.RAW_BLOCK_SIZE = 300
+    try:
+        y = load.fiff.raw_ndvar(raw)
+        assert_array_equal(y.x, x)
+        y = load.fiff.raw_ndvar(raw, decim=4, anti_alias=False)
+        assert_array_equal(y.x, x[:, ::4])
+        y = load.fiff.raw_ndvar(raw, decim=4)
+        assert y.time.tstep == 0.004
+        assert_array_almost_equal(y.x, resample_poly(x, 1, 4, axis=1), 15)
+        # segment
+        y = load.fiff.raw_ndvar(raw, 2000, 5001, decim=4)
+        assert_array_almost_equal(y.x, resample_poly(x, 1, 4, axis=1)[:, 500:1251], 15)
+        # memory-mapped output
+        mmap_path = os.path.join(tempdir, 'raw.npy')
+        y = load.fiff.raw_ndvar(raw, decim=4, mmap=mmap_path)
+        assert isinstance(y.x, np.memmap)
+        assert_array_equal(np.load(mmap_path), y.x)
+    finally:
+        fiff.RAW_BLOCK_SIZE = block_size
+
+
+def test_raw_mmap():
+    "Test raw data stored as memory-mapped array"
+    tempdir = TempDir()
+    rng = np.random.RandomState(0)
+    x = rng.normal(0, 1e-5, (4, 5000))
+    x[3] = 0
+    x[3, 100::500] = 5
+    ch_names = ['EEG 001', 'EEG 002', 'EEG 003', 'STI 014']
+    info = mne.create_info(ch_names, 1000., ['eeg', 'eeg', 'eeg', 'stim'])
+    raw = mne.io.RawArray(x, info, first_samp=100)
+    raw.set_annotations(mne.Annotations([1.], [0.5], ['bad']))
+    path = os.path.join(tempdir, 'test-raw.pickled')
+    fiff.write_raw_mmap(raw, path)
+    assert os.path.exists(os.path.join(tempdir, 'test-raw.npy'))
+
+    raw_mmap = fiff.read_raw_mmap(path)
+    assert not raw_mmap.preload
+    assert raw_mmap.first_samp == 100
+    assert_array_equal(raw_mmap.annotations.description, ['bad'])
+    assert_array_almost_equal(raw_mmap.get_data(), x, 10)
+    assert_array_equal(raw_mmap[1:3, 200:300][0], raw_mmap.get_data()[1:3, 200:300])
+    # epochs read from the mapped array
+    events = mne.find_events(raw_mmap)
+    epochs = mne.Epochs(raw_mmap, events, tmin=-0.1, tmax=0.2, baseline=None, preload=True)
+    raw_preload = fiff.read_raw_mmap(path, preload=True)
+    epochs_ref = mne.Epochs(raw_preload, events, tmin=-0.1, tmax=0.2, baseline=None, preload=True)
+    assert_array_equal(epochs.get_data(), epochs_ref.get_data())
@@ -2820,7 +2820,13 @@ class TimeSlicerEF(TimeSlicer):
             controlled through the frame-rate; if the ``fps`` keyword argument
             is specified, ``time_dilation`` is ignored.
         ...
-            :func:`imageio.mimwrite` parmeters.
+            :func:`imageio.get_writer` parmeters.
+
+        Notes
+        -----
+        Frames are passed to the encoder as they are rendered, so memory use
+        does not increase with the length of the movie. Only the axes that
+        depend on time are redrawn for each frame.
         """
         import imageio
 
@@ -2834,13 +2840,14 @@ class TimeSlicerEF(TimeSlicer):
         if 'fps' not in kwargs:
             kwargs['fps'] = 1. / self._time_dim.tstep / time_dilation
 
-        ims = []
-        for t in self._time_dim:
-            self._set_time(t, True)
-            # private attr usage is official: https://matplotlib.org/gallery/misc/agg_buffer_to_array.html
-            im = np.array(self.figure.canvas.renderer._renderer)
-            ims.append(im)
-        imageio.mimwrite(filename, ims, **kwargs)
+        t_current, fixed = self._current_time, self._time_fixed
+        with imageio.get_writer(filename, **kwargs) as writer:
+            for t in self._time_dim:
+                self._set_time(t, True)
+                # private attr usage is official:
+                # https://matplotlib.org/gallery/misc/agg_buffer_to_array.html
+                writer.append_data(np.array(self.figure.canvas.renderer._renderer))
+        self._set_time(t_current, fixed)
 
 
 class TopoMapKey:
@@ -19,6 +19,11 @@ from ._utsnd import _ax_butterfly, _ax_im_array, _plt_im
 from ._sensors import SENSORMAP_FRAME, SensorMapMixin, _plt_map2d
 
 
+# cache for topomap interpolation operators
+TOPOMAP_OPERATORS = {}
+TOPOMAP_OPERATORS_MAX = 16
+
+
 class Topomap(SensorMapMixin, ColorMapMixin, TopoMapKey, EelFigure):
     """Plot individual topogeraphies
 
@@ -555,42 +560,9 @@ class _plt_topomap(_plt_im):
         # unique_locs = np.unique(locs, axis=0)
 
         if self._method is None:
-            # interpolate data
-            xi, yi = self._mgrid
-
-            # code adapted from mne-python topmap _griddata()
-            xy = locs[:, 0] + locs[:, 1] * -1j
-            d = np.abs(xy - xy[:, None])
-            diagonal_step = len(locs) + 1
-            d.flat[::diagonal_step] = 1.
-
-            g = (d * d) * (np.log(d) - 1.)
-            g.flat[::diagonal_step] = 0.
-            try:
-                weights = linalg.solve(g, v.ravel())
-            except ValueError:
-                raise NotImplementedError(
-                    "Error determining sensor map projection, possibly due to "
-                    "more than one sensor in a single location; try using a "
-                    "different projection.")
-
-            m, n = xi.shape
-            out = np.empty_like(xi)
-
-            g = np.empty(xy.shape)
-            for i in range(m):
-                for j in range(n):
-                    d = np.abs(xi[i, j] + -1j * yi[i, j] - xy)
-                    mask = np.where(d == 0)[0]
-                    if len(mask):
-                        d[mask] = 1.
-                    np.log(d, out=g)
-                    g -= 1.
-                    g *= d * d
-                    if len(mask):
-                        g[mask] = 0.
-                    out[i, j] = g.dot(weights)
-            return out
+            res = len(self._grid)
+            operator = topomap_operator(locs, res)
+            return operator.dot(v).reshape((res, res))
         elif self._method == 'spline':
             k = int(floor(sqrt(len(locs)))) - 1
             tck = interpolate.bisplrep(locs[:, 1], locs[:, 0], v, kx=k, ky=k)
@@ -607,6 +579,65 @@ class _plt_topomap(_plt_im):
             return interpolate.griddata(locs, v, self._mgrid, self._method)
 
 
+def topomap_operator(locs, res):
+    """Linear operator interpolating sensor values on the topomap grid
+
+    Parameters
+    ----------
+    locs : array  (n_sensors, 2)
+        Sensor locations (projected to 2d).
+    res : int
+        Resolution of the (``res`` by ``res``) grid spanning ``[0, 1]``.
+
+    Returns
+    -------
+    operator : array  (res * res, n_sensors)
+        Interpolation weights; ``operator.dot(data)`` for ``data`` of shape
+        ``(n_sensors,)`` or ``(n_sensors, n_frames)`` returns the grid values
+        in row-major order.
+
+    Notes
+    -----
+    Thin plate spline interpolation, adapted from mne-python topomap
+    ``_griddata()``. Operators are cached by sensor layout and resolution.
+    """
+    key = (locs.shape, locs.tobytes(), res)
+    if key in TOPOMAP_OPERATORS:
+        return TOPOMAP_OPERATORS[key]
+
+    xy = locs[:, 0] + locs[:, 1] * -1j
+    d = np.abs(xy - xy[:, None])
+    diagonal_step = len(locs) + 1
+    d.flat[::diagonal_step] = 1.
+    g = (d * d) * (np.log(d) - 1.)
+    g.flat[::diagonal_step] = 0.
+
+    # Green's function between grid points and sensors
+    grid = np.linspace(0, 1, res)
+    xi, yi = np.meshgrid(grid, grid)
+    d = np.abs((xi + -1j * yi).reshape((-1, 1)) - xy)
+    on_sensor = d == 0
+    d[on_sensor] = 1.
+    basis = (d * d) * (np.log(d) - 1.)
+    basis[on_sensor] = 0.
+
+    # operator = basis @ inv(g), with g symmetric
+    try:
+        operator = linalg.solve(g, basis.T, assume_a='sym').T
+    except (ValueError, linalg.LinAlgError):
+        raise NotImplementedError(
+            "Error determining sensor map projection, possibly due to "
+            "more than one sensor in a single location; try using a "
+            "different projection.")
+    operator = np.ascontiguousarray(operator)
+    operator.flags.writeable = False
+
+    if len(TOPOMAP_OPERATORS) >= TOPOMAP_OPERATORS_MAX:
+        TOPOMAP_OPERATORS.clear()
+    TOPOMAP_OPERATORS[key] = operator
+    return operator
+
+
 class _ax_topomap(_ax_im_array):
     """Axes with a topomap
 
@@ -6,6 +6,8 @@ import wx
 
 from eelbrain import datasets, plot, testnd
 from eelbrain._utils import IS_WINDOWS
+from eelbrain.plot._sensors import SENSORMAP_FRAME
+from eelbrain.plot._topo import topomap_operator
 from eelbrain.testing import requires_mne_sample_data
 from eelbrain._wxgui.testing import hide_plots
 
@@ -29,6 +31,25 @@ def test_plot_topomap():
     p.close()
 
 
+def test_topomap_operator():
+    "Test the cached topomap interpolation operator"
+    ds = datasets.get_uts(utsnd=True)
+    y = ds['utsnd'].mean('case')
+    locs = y.sensor.get_locs_2d('default', frame=SENSORMAP_FRAME)
+    data = y.get_data(('sensor', 'time'))
+    operator = topomap_operator(locs, 32)
+    assert operator.shape == (32 * 32, len(locs))
+    assert topomap_operator(locs.copy(), 32) is operator
+    # multiple frames
+    frames = operator.dot(data)
+    assert np.allclose(frames[:, 0], operator.dot(data[:, 0]))
+    # interpolation reproduces the data at sensors located on grid points
+    grid = np.round(locs * 31).astype(int)
+    operator = topomap_operator(grid / 31, 32)
+    x = operator.dot(data[:, 0]).reshape((32, 32))
+    assert np.allclose(x[grid[:, 1], grid[:, 0]], data[:, 0])
+
+
 @requires_mne_sample_data
 @hide_plots
 def test_plot_topomap_mne():
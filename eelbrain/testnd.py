@@ -3,7 +3,7 @@ __test__ = False
 
 from ._stats.testnd import (
     NDTest, MultiEffectNDTest,
-    t_contrast_rel, corr, ttest_1samp, ttest_ind, ttest_rel, anova,
+    t_contrast_rel, multi_t_contrast_rel, corr, ttest_1samp, ttest_ind, ttest_rel, anova,
     Vector, VectorDifferenceRelated, VectorDifferenceIndependent,
 )
 from ._stats.spm import LM, LMGroup
@@ -18,6 +18,7 @@ from numpy.testing import (
     assert_equal, assert_array_equal, assert_allclose,
     assert_array_almost_equal)
 import pytest
+import scipy.stats
 from scipy import signal
 
 from eelbrain import (
@@ -696,6 +697,53 @@ def test_factor():
     assert_array_equal(f.floodfill([1, 1, 1, 11, 11, 11, 11]), Factor('aaaeerr'))
 
 
+def test_factor_cell_index():
+    "Test the cached cell index of categorial data-objects"
+    f = Factor('abcabcacb')
+    index = f._cell_index
+    assert_array_equal(index.counts, [3, 3, 3])
+    for i, cell in enumerate(f.cells):
+        assert_array_equal(index.index(i), np.flatnonzero(f == cell))
+        assert_array_equal(f.index(cell), np.flatnonzero(f == cell))
+    assert_array_equal(f.sort_index(), np.argsort(f.x, kind='mergesort'))
+    assert_array_equal(f.enumerate_cells(), [0, 0, 0, 1, 1, 1, 2, 2, 2])
+    # in-place modifications invalidate the index
+    f[0] = 'd'
+    assert_array_equal(f.index('d'), [0])
+    assert_array_equal(f._cell_index.counts, [2, 3, 3, 1])
+    f.update_labels({'d': 'a'})
+    assert_array_equal(f.index('a'), [0, 3, 6])
+    f.sort_cells('cba')
+    assert_array_equal(f.sort_index(), [2, 5, 7, 1, 4, 8, 0, 3, 6])
+
+    # interaction with empty cell
+    i = Factor('aabb') % Factor('xyxx')
+    assert_array_equal(i._cell_index.counts, [1, 1, 2, 0])
+    assert_array_equal(i.index(('b', 'x')), [2, 3])
+    assert_array_equal(i.index(('b', 'y')), [])
+    assert_array_equal(i.isin([('a', 'x'), ('b', 'x')]), [True, False, True, True])
+
+    # aggregate
+    ds = datasets.get_uts()
+    x = ds.eval('A % B')
+    dsa = ds.aggregate(x, drop_bad=True)
+    for i, cell in enumerate(x.cells):
+        index = x == cell
+        assert_allclose(dsa[i, 'uts'].x, ds[index, 'uts'].x.mean(0))
+        assert dsa[i, 'Y'] == ds[index, 'Y'].mean()
+    # grouped reductions
+    ds = ds[np.random.RandomState(0).permutation(ds.n_cases)]
+    x = ds.eval('A % B')
+    y = ds['uts'] + 1000
+    for func in (np.mean, np.std, np.var, np.sum, scipy.stats.sem, np.median):
+        target = [func(y.x[x == cell], axis=0) for cell in x.cells]
+        assert_allclose(y.aggregate(x, func).x, target, rtol=1e-10)
+    counts, sums, ss = x._cell_index.moments(y.x, 7)
+    assert_array_equal(counts, 15)
+    target = [((y.x[x == cell] - y.x[x == cell].mean(0)) ** 2).sum(0) for cell in x.cells]
+    assert_allclose(ss, target, rtol=1e-10)
+
+
 def test_factor_relabel():
     "Test Factor.relabel() method"
     f = Factor('aaabbbccc')
@@ -1289,6 +1337,62 @@ def test_ndvar_summary_methods():
     assert x.extrema() == max(abs(x.min()), abs(x.max()))
 
 
+def test_ndvar_views():
+    "Test NDVar indexing with views and lazy evaluation"
+    ds = datasets.get_uts(True)
+    y = ds['utsnd']
+    # slices produce views
+    assert not y.is_view
+    ysub = y.sub(time=(0.1, 0.3))
+    assert ysub.is_view
+    assert np.shares_memory(ysub.x, y.x)
+    assert_array_equal(ysub.x, y.x[:, :, 30:50])
+    # array indexes produce copies
+    x = y.x.copy()
+    ysub = y.sub(sensor=[0, 1, 2])
+    assert not ysub.is_view
+    ysub += 1
+    assert_array_equal(y.x, x)
+    assert_array_equal(ysub.x, x[:, :3] + 1)
+    ysub = y.sub(sensor=[3, 1])
+    assert not ysub.is_view
+    assert not np.shares_memory(ysub.x, y.x)
+    assert_array_equal(ysub.x, y.x[:, [3, 1]])
+    assert not y.mean('time').is_view
+    # case index keeps copy semantics
+    assert not y[[1, 2, 3]].is_view
+    assert not np.shares_memory(y[[1, 2, 3]].x, y.x)
+
+    # lazy evaluation
+    for block_size in (None, 7):
+        lazy = y.lazy(block_size).sub(time=(0.1, 0.3)).mean('time')
+        assert_dataobj_equal(lazy.evaluate(), y.sub(time=(0.1, 0.3)).mean('time'), decimal=12)
+        lazy = y.lazy(block_size).sub(sensor=[0, 3]).rms(('sensor', 'time'))
+        target = y.sub(sensor=[0, 3]).rms(('sensor', 'time'))
+        assert_dataobj_equal(lazy.evaluate(), target, decimal=12)
+        lazy = y.lazy(block_size).mean(time=(0.1, 0.2))
+        assert_dataobj_equal(lazy.evaluate(), y.mean(time=(0.1, 0.2)), decimal=12)
+    # chains of sub() return views
+    ysub = y.lazy().sub(sensor=[1, 2, 3]).evaluate()
+    assert ysub.is_view
+    assert np.shares_memory(ysub.x, y.x)
+    assert_array_equal(ysub.x, y.x[:, 1:4])
+    ysub = y.lazy().sub(sensor=[0, 2, 4]).evaluate()
+    assert ysub.is_view
+    assert_array_equal(ysub.x, y.x[:, ::2])
+    lazy = y.lazy(7).sub(time=(0.1, 0.3)).sub(sensor=[1, 2])
+    assert lazy.is_view
+    ysub = lazy.evaluate()
+    assert ysub.is_view
+    assert np.shares_memory(ysub.x, y.x)
+    assert_dataobj_equal(ysub, y.sub(time=(0.1, 0.3), sensor=[1, 2]))
+    assert not y.lazy().sub(sensor=[3, 1]).is_view
+    assert not y.lazy().sub(time=(0.1, 0.3)).mean('time').is_view
+    # operations that can not be evaluated blockwise
+    assert y.lazy(7).mean().evaluate() == y.mean()
+    assert_dataobj_equal(y.lazy(7).sum('case').evaluate(), y.sum('case'))
+
+
 def test_ndvar_timeseries_methods():
     "Test NDVar time-series methods"
     ds = datasets.get_uts(True)
@@ -1443,6 +1547,22 @@ def test_io_pickle():
     assert_dataset_equal(ds, ds2)
 
 
+def test_io_pickle_sparse():
+    "Test pickling NDVars with mostly zeros"
+    ds = datasets.get_uts(True)
+    y = ds['utsnd']
+    mask = y > 3.5
+    assert 0 < mask.sum() < mask.x.size * 0.1
+    masked = y * mask
+    for x in (masked, mask, (masked * 10).astype(int)):
+        string = pickle.dumps(x, pickle.HIGHEST_PROTOCOL)
+        assert len(string) < x.x.nbytes / 2
+        assert_dataobj_equal(pickle.loads(string), x)
+    # dense data
+    x_ = pickle.loads(pickle.dumps(y, pickle.HIGHEST_PROTOCOL))
+    assert_dataobj_equal(x_, y)
+
+
 def test_io_txt():
     "Test Dataset io as text"
     ds = datasets.get_uv()
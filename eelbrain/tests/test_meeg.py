@@ -0,0 +1,42 @@
+# Author: Christian Brodbeck <christianbrodbeck@nyu.edu>
+import numpy as np
+from numpy.testing import assert_array_almost_equal, assert_array_equal
+
+from eelbrain import NDVar, datasets
+from eelbrain._meeg import EpochStatistics, find_flat_epochs, find_noisy_channels
+from eelbrain._ndvar import neighbor_correlation
+
+
+def test_epoch_statistics():
+    "Test EpochStatistics"
+    y = datasets.get_uts(utsnd=True)['utsnd']
+    x = y.get_data(('case', 'sensor', 'time')).copy()
+    x[3, 2] = 0
+    y = NDVar(x, y.dims)
+    stats = EpochStatistics(y)
+
+    assert_array_almost_equal(stats.epoch_max('abs'), y.abs().max(('sensor', 'time')).x)
+    p2p = y.max('time') - y.min('time')
+    assert_array_almost_equal(stats.epoch_max('p2p'), p2p.max('sensor').x)
+    exclude = np.zeros(stats.max.shape, bool)
+    exclude[:, 1] = True
+    exclude[5, 3] = True
+    p2p_sub = p2p.x.copy()
+    p2p_sub[exclude] = 0
+    assert_array_almost_equal(stats.epoch_max('p2p', exclude), p2p_sub.max(1))
+
+    # flat channels
+    flats = find_flat_epochs(stats, 1e-3)
+    assert flats[3] == ['2']
+    assert not any(flats[:3])
+    assert list(find_flat_epochs(y, 1e-3)) == list(flats)
+
+    # neighbor correlation
+    for i in (0, 1, 10):
+        assert_array_almost_equal(stats.corr[i], neighbor_correlation(y[i]).x)
+    assert np.isnan(stats.corr[3, 2])
+    noisy = find_noisy_channels(stats, 0.2)
+    for i in (0, 1, 10):
+        r = neighbor_correlation(y[i])
+        assert noisy[i] == list(y.sensor.names[r.x < 0.2])
+    assert_array_equal(find_noisy_channels(y, 0.2)[0], noisy[0])